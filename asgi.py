@@ -0,0 +1,56 @@
+"""
+ASGI entry point: uvicorn asgi:app (or gunicorn asgi:app -k uvicorn.workers.UvicornWorker)
+
+The read endpoints (customers, loans, payments, CIB data and reference data) are served by async handlers on an
+AsyncSession, so a slow listing waits on the database without holding a worker thread. Every other request,
+including all writes, goes to the Flask app of main.py, which runs in uvicorn's WSGI thread pool as before.
+"""
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
+from starlette.routing import Mount, Route, request_response
+from uvicorn.middleware.wsgi import WSGIMiddleware
+
+from main import app as flask_app
+from server.async_views import ReadHandlers
+from utils.async_database import create_read_engine, read_session_factory
+from utils.extensions import db
+from utils.instrumentation import instrument_endpoint, instrument_engine
+from utils.versioning import BUSINESS_INDUSTRIES, ECL_THRESHOLDS, LENDING_TYPES
+
+with flask_app.app_context():
+    read_engine = create_read_engine(flask_app, db.engine)
+instrument_engine(read_engine.sync_engine, flask_app.config['SLOW_QUERY_MS'])
+handlers = ReadHandlers(flask_app, read_session_factory(read_engine))
+
+
+def read_route(path, endpoint, handler):
+    """
+    GET route of an async handler, measured under the endpoint name of its Flask view. Other methods on the
+    same path (and CORS preflights) fall through to the Flask app.
+    """
+    app = CORSMiddleware(request_response(instrument_endpoint(endpoint, handler)), allow_origins=['*'])
+    return Route(path, app, methods=['GET'], name=endpoint)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    write_buffer = flask_app.extensions.get('ecl_write_buffer')
+    if write_buffer is not None:
+        await run_in_threadpool(write_buffer.close)
+    await read_engine.dispose()
+
+
+app = Starlette(routes=[
+    read_route('/api/v1/users', 'ecl-users-api', handlers.users),
+    read_route('/api/v1/cib-data', 'cib-data', handlers.cib_data),
+    read_route('/api/v1/loans', 'customer-loans', handlers.loans),
+    read_route('/api/v1/payments', 'loan-payments', handlers.payments),
+    read_route('/api/v1/business-industry', 'business-industry-api', handlers.reference(BUSINESS_INDUSTRIES)),
+    read_route('/api/v1/lending-types', 'lending-types-api', handlers.reference(LENDING_TYPES)),
+    read_route('/api/v1/risk-decisions', 'risk-decisions', handlers.reference(ECL_THRESHOLDS)),
+    Mount('/', app=WSGIMiddleware(flask_app)),
+], lifespan=lifespan)
@@ -0,0 +1,129 @@
+"""
+Compares the JSON encoders on the two largest listings, /api/v1/payments and /api/v1/loans.
+
+    python -m benchmarks.encoder_benchmark --payments 50000 --loans 20000
+
+Runs against a throw-away SQLite database, the instance database is not touched.
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time as timer
+from datetime import date, datetime, time
+from enum import Enum
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import Row, insert
+
+from server import views
+from server.models import ECLThreshold, LendingType, Loan, LoanCurrentECL, ECLData, Payment, User
+from utils.encoder import DobatoEncoder, orjson
+from utils.extensions import db
+
+
+class LegacyEncoder(DefaultJSONProvider):
+    """The encoder before the serializer registry, kept here as the baseline."""
+    def default(self, obj):
+        try:
+            return super().default(obj)
+        except Exception:
+            if isinstance(obj, Row):
+                return obj._asdict()
+            elif isinstance(obj, time):
+                return obj.isoformat()
+            elif isinstance(obj, Enum):
+                return obj.name
+            obj_dict = obj.__dict__
+            obj_dict.pop('_sa_instance_state', None)
+            return obj_dict
+
+
+def create_app(path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    app.add_url_rule('/api/v1/loans', view_func=views.CustomerLoanApi.as_view('customer-loans'))
+    app.add_url_rule('/api/v1/payments', view_func=views.LoanPaymentsApi.as_view('loan-payments'))
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def seed(payments, loans):
+    now = datetime.now()
+    db.session.execute(insert(LendingType), [{'id': 1, 'type': 'personal', 'pd_value': 0.05, 'lgd_value': 0.4}])
+    db.session.execute(insert(ECLThreshold), [
+        {'min_value': None, 'max_value': 2, 'level': 'low'},
+        {'min_value': 2, 'max_value': 5, 'level': 'medium'},
+        {'min_value': 5, 'max_value': None, 'level': 'high'},
+    ])
+    db.session.execute(insert(User), [{'id': 1, 'name': 'benchmark', 'email': 'benchmark@example.com',
+                                       'phone_number': 9800000000, 'estd_date': date(2010, 1, 1)}])
+    db.session.execute(insert(Loan), [
+        {'id': i, 'loan_name': f'loan {i}', 'user_id': 1, 'loan_term': 36, 'loan_amount': 10000.0,
+         'lending_type': 1, 'interest_rate': 9.5, 'collateral_value': 12000.0, 'outstanding_balance': 8000.0,
+         'created_at': now}
+        for i in range(1, loans + 1)
+    ])
+    db.session.execute(insert(ECLData), [
+        {'id': i, 'loan_id': i, 'value': i % 7, 'ecl_amount': 100.0, 'pd_value': 0.1, 'lgd_value': 0.4,
+         'ead_value': 8000.0, 'created_at': now, 'updated_at': now}
+        for i in range(1, loans + 1)
+    ])
+    db.session.execute(insert(LoanCurrentECL), [
+        {'loan_id': i, 'ecl_data_id': i, 'value': i % 7, 'ecl_amount': 100.0, 'pd_value': 0.1, 'lgd_value': 0.4,
+         'ead_value': 8000.0, 'updated_at': now}
+        for i in range(1, loans + 1)
+    ])
+    db.session.execute(insert(Payment), [
+        {'user_id': 1, 'loan_id': 1, 'date': date(2020 + i % 5, 1 + i % 12, 1), 'amount': 250.0,
+         'status': ('paid', 'late', 'missed')[i % 3], 'daysLate': i % 30}
+        for i in range(payments)
+    ])
+    db.session.commit()
+
+
+def measure(app, url, repeat):
+    client = app.test_client()
+    timings = []
+    for _ in range(repeat):
+        started = timer.perf_counter()
+        response = client.get(url)
+        timings.append(timer.perf_counter() - started)
+        assert response.status_code == 200, response.data[:200]
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--payments', type=int, default=50000)
+    parser.add_argument('--loans', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = create_app(os.path.join(directory, 'benchmark.db'))
+        with app.app_context():
+            seed(args.payments, args.loans)
+
+        encoders = [('legacy', LegacyEncoder(app), False), ('registry', DobatoEncoder(app), False)]
+        if orjson is not None:
+            encoders.append(('registry+orjson', DobatoEncoder(app), True))
+        urls = ['/api/v1/payments?user_id=1&loan_id=1', '/api/v1/loans']
+
+        print(f"{'endpoint':40} {'encoder':16} {'median':>10} {'speedup':>8}")
+        for url in urls:
+            baseline = None
+            for name, encoder, fast in encoders:
+                encoder.fast = fast
+                app.json = encoder
+                seconds = measure(app, url, args.repeat)
+                baseline = baseline or seconds
+                print(f"{url:40} {name:16} {seconds * 1000:8.1f}ms {baseline / seconds:7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
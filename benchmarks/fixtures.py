@@ -0,0 +1,56 @@
+"""
+Benchmark fixtures: the synthetic portfolio of `flask seed` plus the ECL history, scenarios and job the
+benchmark cases read.
+"""
+from datetime import datetime
+
+from sqlalchemy import func, insert
+
+from utils.extensions import db
+from server.seed import seed_portfolio
+from server.models import User, CIBData, Loan, ECLScenario, ECLScenarioOverlay, Job
+
+SCALES = {
+    'small': 1_000,
+    'medium': 100_000,
+    'large': 1_000_000,
+}
+
+
+def portfolio_size():
+    return db.session.query(func.count(Loan.id)).scalar()
+
+
+def build_portfolio(loans, payments_per_loan=6, ecl_history=3, seed=0):
+    """
+    Fills an empty database with `loans` loans. The same arguments always produce the same data.
+    Returns a dict with the ids the benchmark cases refer to.
+    """
+    now = datetime(2024, 6, 30, 12, 0)
+    seed_portfolio(loans, payments_per_loan=payments_per_loan, ecl_history=ecl_history, seed=seed, now=now)
+    db.session.execute(insert(ECLScenario), [
+        {'id': 1, 'name': 'base', 'weight': 0.6, 'pd_multiplier': 1, 'lgd_multiplier': 1},
+        {'id': 2, 'name': 'downside', 'weight': 0.3, 'pd_multiplier': 1.5, 'lgd_multiplier': 1.2},
+        {'id': 3, 'name': 'upside', 'weight': 0.1, 'pd_multiplier': 0.8, 'lgd_multiplier': 0.9},
+    ])
+    db.session.execute(insert(ECLScenarioOverlay), [{'scenario_id': 2, 'industry_id': 4, 'lending_type_id': None,
+                                                     'pd_multiplier': 1.3, 'lgd_multiplier': 1}])
+    db.session.execute(insert(Job), [{'id': 1, 'kind': 'ecl_recalculation', 'description': 'fixture',
+                                      'status': 'done', 'total': 0, 'processed': 0, 'failed': 0,
+                                      'created_at': now, 'finished_at': now}])
+    db.session.commit()
+    return fixture_ids()
+
+
+def fixture_ids():
+    """
+    Ids of an existing fixture database that the benchmark cases use.
+    """
+    loan = db.session.query(Loan.id, Loan.user_id).order_by(Loan.id).first()
+    return {
+        'loans': portfolio_size(),
+        'customers': db.session.query(func.count(User.id)).scalar(),
+        'loan_id': loan.id,
+        'user_id': loan.user_id,
+        'cib_id': db.session.query(CIBData.id).filter_by(user_id=loan.user_id).scalar()
+    }
@@ -0,0 +1,377 @@
+"""
+Benchmark suite: times every API route registered in main.py through the Flask test client, plus the ECL math
+in isolation, on a synthetic SQLite portfolio.
+
+    python -m benchmarks.run --scale small --output results.json
+    python -m benchmarks.run --scale small --baseline benchmarks/baselines/small.json --fail-on-regression
+    python -m benchmarks.run --scale medium --database /tmp/medium.db   # the fixture is built once and reused
+
+Results record p50/p95/p99 latency, rows per second and SQL statements per request. Read-only cases run before
+the ones that write, so a reused database only grows by the writes of earlier runs.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+
+from benchmarks.fixtures import SCALES, build_portfolio, fixture_ids, portfolio_size
+
+DEFAULT_REPEAT = 20
+DEFAULT_TOLERANCE = 0.2
+DEFAULT_MIN_DELTA_MS = 2
+HEAVY_REPEAT = 3
+
+QUOTE = {'credit_score': 680, 'industry_name': 'retail', 'yearInBusiness': 5, 'daysLate': 15, 'missed_payments': 1,
+         'latePayment': 2, 'outstanding_value': 45000, 'collateral_value': 20000, 'lendingType': 'personal'}
+
+Threshold = namedtuple('Threshold', ['min_value', 'max_value', 'level'])
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+
+def case(name, method, path, body=None, content_type=None, headers=None, repeat=None):
+    """
+    One timed request. body may be a callable taking the iteration number, for writes that must differ per call.
+    """
+    return {'name': name, 'method': method, 'path': path, 'body': body, 'content_type': content_type,
+            'headers': headers or {}, 'repeat': repeat}
+
+
+def _ndjson(records):
+    return ''.join(json.dumps(record) + '\n' for record in records)
+
+
+def route_cases(ids):
+    loan_id, user_id, cib_id = ids['loan_id'], ids['user_id'], ids['cib_id']
+    ndjson = {'Accept': 'application/x-ndjson'}
+    reads = [
+        case('GET users', 'GET', '/api/v1/users', repeat=HEAVY_REPEAT),
+        case('GET users page', 'GET', '/api/v1/users?limit=100&sort=average_ecl&order=desc'),
+        case('GET users ndjson', 'GET', '/api/v1/users', headers=ndjson, repeat=HEAVY_REPEAT),
+        case('GET business-industry', 'GET', '/api/v1/business-industry'),
+        case('GET risk-decisions', 'GET', '/api/v1/risk-decisions'),
+        case('GET cib-data', 'GET', '/api/v1/cib-data', repeat=HEAVY_REPEAT),
+        case('GET loans', 'GET', '/api/v1/loans', repeat=HEAVY_REPEAT),
+        case('GET loans of customer', 'GET', f'/api/v1/loans?user_id={user_id}'),
+        case('GET loans ndjson', 'GET', '/api/v1/loans', headers=ndjson, repeat=HEAVY_REPEAT),
+        case('GET payments', 'GET', f'/api/v1/payments?user_id={user_id}&loan_id={loan_id}'),
+        case('GET ecl-calculation', 'GET', f'/api/v1/ecl-calculation?user_id={user_id}&loan_id={loan_id}'),
+        case('GET ecl-scenarios', 'GET', '/api/v1/ecl-scenarios'),
+        case('GET jobs', 'GET', '/api/v1/jobs'),
+        case('GET job', 'GET', '/api/v1/jobs/1'),
+        case('GET db pool', 'GET', '/api/v1/db/pool'),
+        case('GET lending-types', 'GET', '/api/v1/lending-types'),
+        case('GET portfolio summary', 'GET', '/api/v1/portfolio/summary'),
+        case('GET ecl-history', 'GET', '/api/v1/ecl-history', repeat=HEAVY_REPEAT),
+        case('GET ecl-history of loan', 'GET', f'/api/v1/ecl-history?loan_id={loan_id}&interval=day'),
+        case('POST ecl-quote', 'POST', '/api/v1/ecl-quote', QUOTE),
+        case('POST ecl-quote 10k rows', 'POST', '/api/v1/ecl-quote', [QUOTE] * 10_000, repeat=HEAVY_REPEAT),
+        case('POST ecl-quote 10k columns', 'POST', '/api/v1/ecl-quote',
+             {key: [value] * 10_000 for key, value in QUOTE.items()}, repeat=HEAVY_REPEAT),
+    ]
+    writes = [
+        case('POST ecl-calculation', 'POST', '/api/v1/ecl-calculation', {
+            'user_id': user_id, 'loan_id': loan_id, 'credit_score': 680, 'industry_name': 'retail',
+            'yearInBusiness': 5, 'daysLate': 15, 'missed_payments': 1, 'latePayment': 2,
+            'outstanding_value': 45000, 'collateral_value': 20000, 'recovery_cost': 0, 'lendingType': 'personal'}),
+        case('POST payments', 'POST', '/api/v1/payments', lambda i: {
+            'user_id': user_id, 'loan_id': loan_id, 'date': '2024-07-01', 'amount': 10.0, 'status': 'paid',
+            'daysLate': 0}),
+        case('POST payments bulk', 'POST', '/api/v1/payments/bulk', lambda i: _ndjson(
+            {'user_id': user_id, 'loan_id': loan_id, 'date': '2024-08-01', 'amount': 1.0, 'status': 'late',
+             'daysLate': n % 30} for n in range(1000)), content_type='application/x-ndjson'),
+        case('POST users', 'POST', '/api/v1/users', lambda i: {
+            'name': f'Benchmark {i}', 'email': f'benchmark{i}.{time.time_ns()}@example.com',
+            'phone_number': 9900000000 + time.time_ns() % 99999999, 'estd_date': '2015-01-01',
+            'monthly_income': 100000, 'employment_status': 'employed', 'user_type': 'Corporate', 'industry_id': 1}),
+        case('POST users bulk', 'POST', '/api/v1/users/bulk', lambda i: _ndjson(
+            {'name': f'Bulk {i}-{n}', 'email': f'bulk{i}.{n}.{time.time_ns()}@example.com',
+             'phone_number': 9800000000 + (time.time_ns() + n) % 99999999, 'estd_date': '2015-01-01',
+             'monthly_income': 1000, 'employment_status': 'employed', 'user_type': 'Individual'}
+            for n in range(100)), content_type='application/x-ndjson'),
+        case('PUT users', 'PUT', f'/api/v1/users?id={user_id}', {'monthly_income': 123456}),
+        case('POST loans', 'POST', '/api/v1/loans', {
+            'user_id': user_id, 'loan_name': 'Benchmark loan', 'loan_term': 60, 'loan_amount': 100000,
+            'lending_type': 1, 'interest_rate': 9.5, 'collateral_value': 200000, 'outstanding_balance': 100000}),
+        case('POST loans bulk', 'POST', '/api/v1/loans/bulk', _ndjson(
+            {'user_id': user_id, 'loan_name': f'Bulk loan {n}', 'loan_term': 36, 'loan_amount': 5000,
+             'lending_type': 2, 'interest_rate': 11, 'collateral_value': 8000, 'outstanding_balance': 5000}
+            for n in range(100)), content_type='application/x-ndjson'),
+        case('PUT loans', 'PUT', f'/api/v1/loans?id={loan_id}&user_id={user_id}', {'interest_rate': 10.5}),
+        case('POST cib-data', 'POST', '/api/v1/cib-data', {'user_id': user_id, 'credit_score': 700}),
+        case('PUT cib-data', 'PUT', f'/api/v1/cib-data?id={cib_id}', {'user_id': user_id, 'credit_score': 710}),
+        case('POST business-industry', 'POST', '/api/v1/business-industry',
+             lambda i: {'name': f'benchmark {i}', 'risk_factor': 0.1}),
+        case('PUT business-industry', 'PUT', '/api/v1/business-industry?id=10', {'risk_factor': 0.3},
+             repeat=HEAVY_REPEAT),
+        case('POST lending-types', 'POST', '/api/v1/lending-types',
+             lambda i: {'type': f'benchmark {i}', 'pd_value': 0.1, 'lgd_value': 0.5}),
+        case('PUT lending-types', 'PUT', '/api/v1/lending-types?id=4', {'pd_value': 0.12}, repeat=HEAVY_REPEAT),
+        case('POST risk-decisions', 'POST', '/api/v1/risk-decisions', [
+            {'min_value': None, 'max_value': 2, 'level': 'low'}]),
+        case('PUT risk-decisions', 'PUT', '/api/v1/risk-decisions', [{'id': 1, 'max_value': 2}]),
+        case('POST ecl-scenarios', 'POST', '/api/v1/ecl-scenarios',
+             lambda i: {'name': f'benchmark {i}', 'weight': 0}),
+        case('PUT ecl-scenarios', 'PUT', '/api/v1/ecl-scenarios?id=3', {'weight': 0.1}),
+        case('POST credit-loss-simulation', 'POST', '/api/v1/credit-loss-simulation', {'scenarios': 20000},
+             repeat=HEAVY_REPEAT),
+        case('POST ecl-calculation batch', 'POST', '/api/v1/ecl-calculation/batch', {}, repeat=HEAVY_REPEAT),
+        case('POST ecl-calculation batch scenarios', 'POST', '/api/v1/ecl-calculation/batch',
+             {'scenarios': True, 'lifetime': True}, repeat=HEAVY_REPEAT),
+        case('POST early-warning scan full', 'POST', '/api/v1/early-warnings/scan', {'full': True},
+             repeat=HEAVY_REPEAT),
+        case('POST early-warning scan', 'POST', '/api/v1/early-warnings/scan', {}),
+        case('GET early-warnings', 'GET', '/api/v1/early-warnings?limit=100'),
+    ]
+    return reads + writes
+
+
+def uncovered_routes(app, cases):
+    """
+    (rule, method) pairs of the API that no case exercises, so new routes don't silently go unmeasured.
+    """
+    covered = set()
+    adapter = app.url_map.bind('localhost')
+    for item in cases:
+        rule, _ = adapter.match(item['path'].split('?')[0], method=item['method'], return_rule=True)
+        covered.add((rule.rule, item['method']))
+    routes = {(rule.rule, method) for rule in app.url_map.iter_rules() if rule.rule.startswith('/api/')
+              for method in rule.methods - {'HEAD', 'OPTIONS'}}
+    return sorted(routes - covered)
+
+
+def _count_rows(response):
+    if response.mimetype == 'application/x-ndjson':
+        return response.data.count(b'\n')
+    payload = response.get_json(silent=True) or {}
+    data = payload.get('data')
+    if isinstance(data, dict) and isinstance(data.get('rows'), list):
+        return len(data['rows'])
+    if isinstance(data, dict) and isinstance(data.get('loans'), int):
+        return data['loans']
+    if isinstance(data, list):
+        return len(data)
+    return 1
+
+
+def summarize(timings, rows=None, queries=None, status=None):
+    timings = np.array(timings)
+    p50, p95, p99 = np.percentile(timings, [50, 95, 99])
+    result = {
+        'samples': len(timings),
+        'p50_ms': round(p50 * 1000, 3),
+        'p95_ms': round(p95 * 1000, 3),
+        'p99_ms': round(p99 * 1000, 3),
+        'mean_ms': round(timings.mean() * 1000, 3),
+    }
+    if rows is not None:
+        result['rows'] = rows
+        result['rows_per_second'] = round(rows / p50, 1) if p50 else None
+    if queries is not None:
+        result['queries'] = queries
+    if status is not None:
+        result['status'] = status
+    return result
+
+
+def run_case(client, counter, item, repeat):
+    timings = []
+    queries = []
+    body = item['body']
+    for iteration in range(repeat + 1):  # the first call warms the caches and is not recorded
+        payload = body(iteration) if callable(body) else body
+        kwargs = {'headers': item['headers']}
+        if isinstance(payload, str):
+            kwargs.update(data=payload, content_type=item['content_type'])
+        elif payload is not None:
+            kwargs['json'] = payload
+        counter.count = 0
+        started = time.perf_counter()
+        response = client.open(item['path'], method=item['method'], **kwargs)
+        data = response.data  # streamed bodies are produced while they are read
+        elapsed = time.perf_counter() - started
+        if iteration:
+            timings.append(elapsed)
+            queries.append(counter.count)
+    return summarize(timings, rows=_count_rows(response), queries=int(np.median(queries)),
+                     status=response.status_code) | {'bytes': len(data)}
+
+
+def math_cases(loans):
+    from utils.calculations import RiskThresholdIndex, compute_ecl, lifetime_ecl, weighted_scenario_ecl
+    from utils.simulation import build_buckets, simulate_portfolio_loss
+
+    rng = np.random.default_rng(0)
+    inputs = {
+        'credit_score': rng.uniform(300, 850, loans), 'missed_payments': rng.integers(0, 5, loans),
+        'late_payments': rng.integers(0, 10, loans), 'days_late': rng.integers(0, 200, loans),
+        'industry_risk': rng.uniform(0, 0.5, loans), 'years_in_business': rng.integers(0, 30, loans),
+        'pd_factor': rng.uniform(0.01, 0.1, loans), 'lgd_factor': rng.uniform(0.2, 0.6, loans),
+        'collateral_value': rng.uniform(0, 1e6, loans), 'outstanding_value': rng.uniform(1, 1e6, loans),
+    }
+    pd, lgd, ead, ecl, ratio = compute_ecl(**inputs)
+    index = RiskThresholdIndex([Threshold(None, 2, 'low'), Threshold(2, 5, 'medium'), Threshold(5, None, 'high')])
+    multipliers = np.ones((loans, 3)) * [1, 1.5, 0.8]
+    months = rng.integers(1, 240, loans)
+    rates = rng.uniform(4, 18, loans)
+    pd_clipped = np.clip(pd, 0, 1)
+    buckets = build_buckets(pd_clipped, np.clip(lgd, 0, 1), ead, np.full(loans, 0.12), rng.integers(0, 10, loans),
+                            pd_decimals=2)
+    return [
+        ('compute_ecl', lambda: compute_ecl(**inputs)),
+        ('weighted_scenario_ecl', lambda: weighted_scenario_ecl(pd, lgd, ead, multipliers, multipliers,
+                                                                [0.6, 0.3, 0.1])),
+        ('lifetime_ecl', lambda: lifetime_ecl(pd_clipped, lgd, ead, months, rates)),
+        ('classify_many', lambda: index.classify_many(ratio)),
+        ('simulate_portfolio_loss 20k', lambda: simulate_portfolio_loss(buckets, 10, scenarios=20000)),
+    ]
+
+
+def run_math(loans, repeat, only=None):
+    results = {}
+    for name, function in math_cases(loans):
+        if only and only not in f'math {name}':
+            continue
+        function()
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - started)
+        rows = None if name.startswith('simulate') else loans
+        results[f'math {name}'] = summarize(timings, rows=rows)
+    return results
+
+
+def compare(results, baseline, tolerance, min_delta_ms=DEFAULT_MIN_DELTA_MS):
+    """
+    Compares the p50 of every benchmark with the baseline. Returns the rows of the report and the regressions.
+    A benchmark regressed when it is more than `tolerance` and `min_delta_ms` slower, or runs more SQL statements.
+    """
+    report = []
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get('results', {}).get(name)
+        if not base or not base.get('p50_ms'):
+            report.append((name, result['p50_ms'], None, None, result.get('queries'), None))
+            continue
+        ratio = result['p50_ms'] / base['p50_ms']
+        report.append((name, result['p50_ms'], base['p50_ms'], ratio, result.get('queries'), base.get('queries')))
+        slower = ratio > 1 + tolerance and result['p50_ms'] - base['p50_ms'] > min_delta_ms
+        if slower or (result.get('queries') or 0) > (base.get('queries') or 0) > 0:
+            regressions.append(name)
+    return report, regressions
+
+
+def print_results(results):
+    print(f"{'benchmark':40} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'rows/s':>12} {'queries':>8}")
+    for name, result in results.items():
+        rows_per_second = result.get('rows_per_second')
+        print(f"{name:40} {result['p50_ms']:10.2f} {result['p95_ms']:10.2f} {result['p99_ms']:10.2f} "
+              f"{rows_per_second if rows_per_second is not None else '':>12} {result.get('queries', ''):>8}")
+
+
+def print_comparison(report, regressions):
+    print(f"\n{'benchmark':40} {'p50 ms':>10} {'baseline':>10} {'ratio':>7} {'queries':>8} {'baseline':>8}")
+    for name, p50, base, ratio, queries, base_queries in report:
+        flag = '  REGRESSION' if name in regressions else ''
+        print(f"{name:40} {p50:10.2f} {f'{base:.2f}' if base is not None else '-':>10} "
+              f"{f'{ratio:.2f}x' if ratio is not None else '-':>7} {queries if queries is not None else '':>8} "
+              f"{base_queries if base_queries is not None else '':>8}{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', choices=SCALES, default='small')
+    parser.add_argument('--loans', type=int, help='Number of loans, overrides --scale.')
+    parser.add_argument('--database', help='SQLite file of the fixture, built when it is empty. Default: temporary.')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('--only', help='Only run benchmarks whose name contains this text.')
+    parser.add_argument('--output', help='Write the results as JSON to this file.')
+    parser.add_argument('--baseline', help='Compare with the results JSON of an earlier run.')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='Allowed p50 slowdown against the baseline before it counts as a regression.')
+    parser.add_argument('--min-delta-ms', type=float, default=DEFAULT_MIN_DELTA_MS,
+                        help='Slowdowns smaller than this are noise, whatever the ratio.')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+    loans = args.loans or SCALES[args.scale]
+
+    directory = None
+    database = args.database
+    if not database:
+        directory = tempfile.TemporaryDirectory()
+        database = os.path.join(directory.name, 'benchmark.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.path.abspath(database)}'
+
+    from sqlalchemy import event
+    from main import app
+    from utils.extensions import db
+
+    with app.app_context():
+        if not portfolio_size():
+            started = time.perf_counter()
+            build_portfolio(loans)
+            print(f"Built a portfolio of {loans} loans in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+        ids = fixture_ids()
+        counter = QueryCounter()
+        event.listen(db.engine, 'before_cursor_execute', counter)
+
+    cases = route_cases(ids)
+    for rule, method in uncovered_routes(app, cases):
+        print(f"warning: no benchmark for {method} {rule}", file=sys.stderr)
+    if args.only:
+        cases = [item for item in cases if args.only in item['name']]
+
+    results = {}
+    client = app.test_client()
+    for item in cases:
+        repeat = min(args.repeat, item['repeat'] or args.repeat)
+        results[item['name']] = run_case(client, counter, item, repeat)
+    results.update(run_math(ids['loans'], min(args.repeat, HEAVY_REPEAT * 2), args.only))
+    print_results(results)
+
+    output = {
+        'meta': {
+            'scale': args.scale if not args.loans else None,
+            'loans': ids['loans'],
+            'customers': ids['customers'],
+            'repeat': args.repeat,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'created_at': datetime.now().isoformat(timespec='seconds')
+        },
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(output, file, indent=2, sort_keys=True)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as file:
+            report, regressions = compare(results, json.load(file), args.tolerance, args.min_delta_ms)
+        print_comparison(report, regressions)
+    if directory:
+        with app.app_context():
+            db.engine.dispose()
+        directory.cleanup()
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Times the credit-loss Monte Carlo at the size it is meant for, 1M scenarios over 100k loans, on a synthetic book.
+
+    python -m benchmarks.simulation_benchmark                                # 1M x 100k, one process per CPU
+    python -m benchmarks.simulation_benchmark --sample 20000 --processes 1   # projects 1M from 20k scenarios
+    python -m benchmarks.simulation_benchmark --budget-seconds 600           # fails when the run takes longer
+
+No database is needed: PD, LGD and EAD come from compute_ecl on random inputs, as in the math benchmarks of
+benchmarks.run, with every loan in its own bucket.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+from utils.calculations import compute_ecl
+from utils.simulation import build_buckets, simulate_portfolio_loss
+
+
+def synthetic_buckets(loans, groups, seed=0):
+    rng = np.random.default_rng(seed)
+    pd, lgd, ead, _, _ = compute_ecl(
+        credit_score=rng.uniform(300, 850, loans), missed_payments=rng.integers(0, 5, loans),
+        late_payments=rng.integers(0, 10, loans), days_late=rng.integers(0, 200, loans),
+        industry_risk=rng.uniform(0, 0.5, loans), years_in_business=rng.integers(0, 30, loans),
+        pd_factor=rng.uniform(0.01, 0.1, loans), lgd_factor=rng.uniform(0.2, 0.6, loans),
+        collateral_value=rng.uniform(0, 1e6, loans), outstanding_value=rng.uniform(1, 1e6, loans))
+    group = rng.integers(0, groups, loans)
+    rho = rng.uniform(0.08, 0.24, groups)[group]
+    return build_buckets(np.clip(pd, 0, 1), np.clip(lgd, 0, 1), ead, rho, group)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--loans', type=int, default=100_000)
+    parser.add_argument('--groups', type=int, default=10, help='Industries, each with its own correlation.')
+    parser.add_argument('--scenarios', type=int, default=1_000_000)
+    parser.add_argument('--sample', type=int, help='Only run this many scenarios and project the time of --scenarios.')
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--budget-seconds', type=float, help='Exit with an error when the run takes longer.')
+    args = parser.parse_args()
+
+    buckets = synthetic_buckets(args.loans, args.groups)
+    scenarios = min(args.sample or args.scenarios, args.scenarios)
+    started = time.perf_counter()
+    result = simulate_portfolio_loss(buckets, args.groups, scenarios=scenarios, processes=args.processes)
+    seconds = time.perf_counter() - started
+    projected = seconds * args.scenarios / scenarios
+
+    print(f"{args.loans} loans in {len(buckets['group'])} buckets, {scenarios} scenarios, "
+          f"{args.processes} processes: {seconds:.1f}s, {scenarios / seconds:,.0f} scenarios/s")
+    if scenarios < args.scenarios:
+        print(f"projected for {args.scenarios} scenarios: {projected:.0f}s ({projected / 60:.1f} min)")
+    print(f"expected loss {result['expected_loss']:,.0f}, VaR {result['value_at_risk']:,.0f}, "
+          f"expected shortfall {result['expected_shortfall']:,.0f}")
+    if args.budget_seconds and projected > args.budget_seconds:
+        print(f"over the budget of {args.budget_seconds:.0f}s", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,35 @@
 from flask import Flask
 from flask_cors import CORS
 from flasgger import Swagger
-from server import views
+from server import views, commands
+from server.ecl_store import backfill_current_ecl
+from server.early_warning import init_early_warning
+from server.ecl_writer import init_write_behind
+from server.imports import init_customer_import
+from server.payment_summary import backfill_payment_summaries
+from server.portfolio_summary import init_portfolio_rollup
+from utils.database import configure_database, install_engine_hooks
 from utils.encoder import DobatoEncoder
+from utils.instrumentation import init_instrumentation
 from utils.extensions import db
 
 
 def create_app():
     app = Flask(__name__, instance_relative_config=True)
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///../instance/app.db'
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    configure_database(app)
 
     db.init_app(app)
     with app.app_context():
+        install_engine_hooks(db.engine)
+        init_instrumentation(app, db.engine)
         db.create_all()
+        init_customer_import()
+        backfill_current_ecl()
+        backfill_payment_summaries()
+        init_portfolio_rollup()
+        init_early_warning()
+    init_write_behind(app)
 
     return app
 
@@ -24,14 +40,41 @@ CORS(app, resources={r"/*": {"origins": "*", "methods": ["GET", "POST", "PUT", "
                              "headers": ["Content-Type", "Authorization", "ngrok-skip-browser-warning"]}})
 app.json = DobatoEncoder(app)
 app.add_url_rule('/api/v1/users', view_func=views.UserListApi.as_view('ecl-users-api'))
+app.add_url_rule('/api/v1/users/bulk', view_func=views.CustomerBulkApi.as_view('ecl-users-bulk-api'))
 app.add_url_rule('/api/v1/business-industry', view_func=views.BusinessIndustryApi.as_view('business-industry-api'))
 app.add_url_rule('/api/v1/risk-decisions', view_func=views.RiskThresholdApi.as_view('risk-decisions'))
 app.add_url_rule('/api/v1/cib-data', view_func=views.FetchCIBData.as_view('cib-data'))
 app.add_url_rule('/api/v1/loans', view_func=views.CustomerLoanApi.as_view('customer-loans'))
+app.add_url_rule('/api/v1/loans/bulk', view_func=views.LoanBulkApi.as_view('customer-loans-bulk'))
 app.add_url_rule('/api/v1/payments', view_func=views.LoanPaymentsApi.as_view('loan-payments'))
+app.add_url_rule('/api/v1/payments/bulk', view_func=views.PaymentBulkApi.as_view('loan-payments-bulk'))
 app.add_url_rule('/api/v1/ecl-calculation', view_func=views.ECLCalculationApi.as_view('ecl-calculations'))
+app.add_url_rule('/api/v1/ecl-calculation/batch', view_func=views.ECLBatchApi.as_view('ecl-batch-calculations'))
+app.add_url_rule('/api/v1/ecl-quote', view_func=views.ECLQuoteApi.as_view('ecl-quote'))
+app.add_url_rule('/api/v1/ecl-history', view_func=views.ECLHistoryApi.as_view('ecl-history'))
+app.add_url_rule('/api/v1/portfolio/summary', view_func=views.PortfolioSummaryApi.as_view('portfolio-summary'))
+app.add_url_rule('/api/v1/early-warnings', view_func=views.EarlyWarningAlertApi.as_view('early-warnings'))
+app.add_url_rule('/api/v1/early-warnings/scan', view_func=views.EarlyWarningScanApi.as_view('early-warning-scan'))
+app.add_url_rule('/api/v1/credit-loss-simulation', view_func=views.CreditLossSimulationApi.as_view('credit-loss-simulation'))
+app.add_url_rule('/api/v1/ecl-scenarios', view_func=views.ECLScenarioApi.as_view('ecl-scenarios'))
+app.add_url_rule('/api/v1/jobs', view_func=views.JobListApi.as_view('jobs'))
+app.add_url_rule('/api/v1/jobs/<int:job_id>', view_func=views.JobApi.as_view('job-detail'))
+app.add_url_rule('/api/v1/db/pool', view_func=views.DatabasePoolApi.as_view('db-pool'))
+app.add_url_rule('/metrics', view_func=views.MetricsApi.as_view('metrics'))
 app.add_url_rule('/api/v1/lending-types', view_func=views.LendingTypeAPI.as_view('lending-types-api'))
 
+app.cli.add_command(commands.ecl_batch_command)
+app.cli.add_command(commands.rebuild_current_ecl_command)
+app.cli.add_command(commands.rebuild_payment_summaries_command)
+app.cli.add_command(commands.check_payment_summaries_command)
+app.cli.add_command(commands.rebuild_portfolio_summary_command)
+app.cli.add_command(commands.ecl_worker_command)
+app.cli.add_command(commands.simulate_credit_loss_command)
+app.cli.add_command(commands.seed_command)
+app.cli.add_command(commands.compact_ecl_history_command)
+app.cli.add_command(commands.early_warning_scan_command)
+app.cli.add_command(commands.replay_ecl_dead_letter_command)
+
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5001, debug=True)
\ No newline at end of file
@@ -0,0 +1,163 @@
+"""
+Async handlers of the read endpoints for the ASGI entry point (asgi.py). They run the statements of
+server.listings on an AsyncSession and answer with the same bodies, headers and status codes as the Flask views.
+"""
+from sqlalchemy import select
+from starlette.responses import Response, StreamingResponse
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+from server.listings import CUSTOMER_SORT_FIELDS, customer_listing, customer_rows, cib_listing, loan_listing, \
+    loan_rows, payment_listing, reference_listing
+from server.models import User, ECLThreshold
+from utils.calculations import RiskThresholdIndex
+from utils.http_cache import cache_headers, cache_listing, cached_listing, is_modified
+from utils.pagination import PaginationError, keyset_order, parse_limit, split_page
+from utils.response import CSV_MIMETYPE, STREAM_CHUNK_SIZE, CsvChunkEncoder, iter_chunks, ndjson_chunk, \
+    stream_format, stream_headers
+from utils.versioning import DEFAULT_VERSION_MAX_AGE, ECL_THRESHOLDS, AsyncVersionedCache, read_version_stamps
+
+
+async def _load_risk_index(session):
+    return RiskThresholdIndex((await session.execute(select(ECLThreshold))).scalars().all())
+
+
+def _int_param(request, name):
+    value = request.query_params.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer.")
+
+
+class ReadHandlers:
+    """
+    The read endpoints on top of an async_sessionmaker. The Flask app provides the JSON encoder and config.
+    """
+
+    def __init__(self, flask_app, sessions):
+        self.json = flask_app.json
+        self.sessions = sessions
+        self._risk_index = AsyncVersionedCache([ECL_THRESHOLDS], _load_risk_index,
+                                               flask_app.config.get('VERSION_MAX_AGE', DEFAULT_VERSION_MAX_AGE))
+
+    def _json(self, payload, status=200):
+        built = self.json.response(payload)
+        return Response(built.get_data(), status_code=status, media_type=built.mimetype)
+
+    def _bad_request(self, msg):
+        return self._json({'message': msg, 'data': [], 'status': 400}, 400)
+
+    @staticmethod
+    def _stream_format(request):
+        return stream_format(parse_accept_header(request.headers.get('accept'), MIMEAccept))
+
+    def _encoder(self, mimetype):
+        if mimetype == CSV_MIMETYPE:
+            return CsvChunkEncoder(self.json.default).encode
+        return lambda chunk: ndjson_chunk(chunk, self.json.dumps)
+
+    def _stream(self, statement, mimetype, rows_of=None, scalars=False, **meta):
+        """
+        Streams the statement's rows in chunks of STREAM_CHUNK_SIZE from a server-side cursor.
+        """
+        async def body():
+            encode = self._encoder(mimetype)
+            async with self.sessions() as session:
+                risk_index = await self._risk_index.get(session) if rows_of else None
+                result = await session.stream(statement.execution_options(yield_per=STREAM_CHUNK_SIZE))
+                if scalars:
+                    result = result.scalars()
+                async for chunk in result.partitions():
+                    yield encode(rows_of(chunk, risk_index) if rows_of else chunk)
+
+        return StreamingResponse(body(), media_type=mimetype, headers=stream_headers(meta))
+
+    async def _list(self, request, statement, rows_of=None, scalars=False, **meta):
+        """
+        Async list_response for a statement: one JSON document, or NDJSON/CSV streamed when asked for.
+        `rows_of(rows, risk_index)` turns the fetched rows into the response rows.
+        """
+        mimetype = self._stream_format(request)
+        if mimetype:
+            return self._stream(statement, mimetype, rows_of, scalars, **meta)
+        async with self.sessions() as session:
+            result = await session.execute(statement)
+            rows = result.scalars().all() if scalars else result.all()
+            if rows_of:
+                rows = rows_of(rows, await self._risk_index.get(session))
+        return self._json({'data': {'rows': rows, **meta}})
+
+    def _page(self, request, rows, **meta):
+        mimetype = self._stream_format(request)
+        if not mimetype:
+            return self._json({'data': {'rows': rows, **meta}})
+        encode = self._encoder(mimetype)
+        return StreamingResponse((encode(chunk) for chunk in iter_chunks(rows)), media_type=mimetype,
+                                 headers=stream_headers(meta))
+
+    async def users(self, request):
+        sort = request.query_params.get('sort', 'id')
+        order = request.query_params.get('order', 'asc')
+        if sort not in CUSTOMER_SORT_FIELDS:
+            return self._bad_request(f"sort must be one of: {', '.join(CUSTOMER_SORT_FIELDS)}.")
+        if order not in ('asc', 'desc'):
+            return self._bad_request("order must be asc or desc.")
+
+        customers, sort_key = customer_listing(sort)
+        try:
+            limit = parse_limit(request.query_params.get('limit'))
+            customers = keyset_order(customers, sort_key, User.id, descending=order == 'desc',
+                                     cursor=request.query_params.get('cursor'))
+        except PaginationError as e:
+            return self._bad_request(str(e))
+        if not limit:
+            return await self._list(request, customers, customer_rows, next_cursor=None)
+
+        async with self.sessions() as session:
+            rows = (await session.execute(customers.limit(limit + 1))).all()
+            rows, next_cursor = split_page(rows, limit, sort_key, User.id)
+            rows = customer_rows(rows, await self._risk_index.get(session))
+        return self._page(request, rows, next_cursor=next_cursor)
+
+    async def cib_data(self, request):
+        return await self._list(request, cib_listing())
+
+    async def loans(self, request):
+        try:
+            user_id = _int_param(request, 'user_id')
+        except ValueError as e:
+            return self._bad_request(str(e))
+        return await self._list(request, loan_listing(user_id), loan_rows)
+
+    async def payments(self, request):
+        try:
+            user_id = _int_param(request, 'user_id')
+            loan_id = _int_param(request, 'loan_id')
+        except ValueError as e:
+            return self._bad_request(str(e))
+        return await self._list(request, payment_listing(user_id, loan_id), scalars=True)
+
+    def reference(self, name):
+        """
+        Handler of a reference dataset listing, cached per version with the ETag of versioned_list_response.
+        """
+        async def handler(request):
+            statement = reference_listing(name)
+            if self._stream_format(request):
+                return await self._list(request, statement, scalars=True)
+            async with self.sessions() as session:
+                version, updated_at = (await read_version_stamps(session, [name]))[name]
+                cached = cached_listing(name, version)
+                if cached is None:
+                    rows = (await session.execute(statement)).scalars().all()
+                    built = self.json.response({'data': {'rows': rows}})
+                    cached = cache_listing(name, version, updated_at, built.get_data(), built.mimetype)
+            headers = cache_headers(cached)
+            if not is_modified(cached, request.headers):
+                return Response(status_code=304, headers=headers)
+            return Response(cached.body, media_type=cached.mimetype, headers=headers)
+
+        return handler
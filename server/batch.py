@@ -0,0 +1,214 @@
+import time
+from datetime import date, datetime
+
+import numpy as np
+from sqlalchemy import func, insert
+
+from utils.calculations import compute_ecl, lifetime_ecl
+from utils.extensions import db
+from server.ecl_store import save_ecl_rows
+from server.reference_data import get_reference_data
+from server.scenarios import calculate_scenarios, load_scenarios, save_scenario_results, scenario_summary
+from server.models import User, CIBData, Loan, LoanPaymentSummary, ECLLifetimeData
+
+
+def years_in_business(estd_dates, today=None):
+    """
+    Returns the number of full years since each establishment date, same as relativedelta(today, estd).years.
+    """
+    today = today or date.today()
+    return np.fromiter(
+        ((today.year - d.year - ((today.month, today.day) < (d.month, d.day))) if d else 0 for d in estd_dates),
+        dtype=float, count=len(estd_dates))
+
+
+def remaining_months(loan_terms, start_dates, today=None):
+    """
+    Returns the months left of each loan term, counting whole calendar months since the loan started.
+    """
+    today = today or date.today()
+    elapsed = np.fromiter(((today.year - d.year) * 12 + today.month - d.month if d else 0 for d in start_dates),
+                          dtype=np.int64, count=len(start_dates))
+    return np.maximum(np.array(loan_terms, dtype=np.int64) - elapsed, 1)
+
+
+def load_portfolio(user_id=None, loan_ids=None):
+    """
+    Loads the ECL inputs of every loan as column arrays.
+    Credit scores come from a sub-query and payment behaviour from the loan payment summaries,
+    so the whole book is read in one statement. Industry and lending type factors come from the
+    reference data cache.
+    """
+    reference = get_reference_data()
+    first_cib = (
+        db.session.query(CIBData.user_id, func.min(CIBData.id).label('cib_id'))
+        .group_by(CIBData.user_id)
+        .subquery()
+    )
+    query = (
+        db.session.query(
+            Loan.id,
+            Loan.collateral_value,
+            Loan.outstanding_balance,
+            User.estd_date,
+            func.coalesce(User.industry_id, 0),
+            Loan.lending_type,
+            func.coalesce(CIBData.credit_score, 0),
+            func.coalesce(LoanPaymentSummary.missed_count, 0),
+            func.coalesce(LoanPaymentSummary.late_count, 0),
+            func.coalesce(LoanPaymentSummary.total_days_late, 0),
+            Loan.loan_term,
+            func.coalesce(Loan.interest_rate, 0),
+            Loan.created_at
+        )
+        .join(User, User.id == Loan.user_id)
+        .outerjoin(first_cib, first_cib.c.user_id == Loan.user_id)
+        .outerjoin(CIBData, CIBData.id == first_cib.c.cib_id)
+        .outerjoin(LoanPaymentSummary, LoanPaymentSummary.loan_id == Loan.id)
+        .filter(Loan.outstanding_balance > 0)
+    )
+    if user_id:
+        query = query.filter(Loan.user_id == user_id)
+    if loan_ids is not None:
+        query = query.filter(Loan.id.in_(loan_ids))
+    # Loans of an unknown lending type have no factors, the former inner join skipped them as well.
+    rows = [row for row in query.order_by(Loan.id) if row.lending_type in reference.lending_types]
+
+    columns = list(zip(*rows)) or [()] * 13
+    pd_factor, lgd_factor = reference.lending_type_factors(columns[5])
+    return {
+        "loan_id": np.array(columns[0], dtype=np.int64),
+        "collateral_value": np.array(columns[1], dtype=float),
+        "outstanding_value": np.array(columns[2], dtype=float),
+        "years_in_business": years_in_business(columns[3]),
+        "industry_risk": reference.industry_risks(columns[4]),
+        "pd_factor": pd_factor,
+        "lgd_factor": lgd_factor,
+        "credit_score": np.array(columns[6], dtype=float),
+        "missed_payments": np.array(columns[7], dtype=float),
+        "late_payments": np.array(columns[8], dtype=float),
+        "days_late": np.array(columns[9], dtype=float),
+        "industry_id": np.array(columns[4], dtype=np.int64),
+        "lending_type_id": np.array(columns[5], dtype=np.int64),
+        "remaining_term": remaining_months(columns[10], columns[12]),
+        "interest_rate": np.array(columns[11], dtype=float),
+    }
+
+
+def calculate_portfolio(inputs, recovery_cost=0):
+    """
+    Runs the ECL formulas over the loaded portfolio arrays in one vectorized pass.
+    """
+    pd, lgd, ead, ecl, ecl_ratio = compute_ecl(
+        inputs["credit_score"], inputs["missed_payments"], inputs["late_payments"], inputs["days_late"],
+        inputs["industry_risk"], inputs["years_in_business"], inputs["pd_factor"], inputs["lgd_factor"],
+        inputs["collateral_value"], inputs["outstanding_value"], recovery_cost)
+    return {
+        "loan_id": inputs["loan_id"],
+        "pd": pd,
+        "lgd": lgd,
+        "ead": ead,
+        "ecl_amount": ecl,
+        "ecl_percentage": ecl_ratio
+    }
+
+
+def save_ecl_results(results, return_ids=False):
+    """
+    Bulk inserts one ECLData row per loan and refreshes the loans' current ECL. The caller owns the transaction.
+    With return_ids the new ECLData ids are returned in loan order, otherwise the number of rows.
+    """
+    now = datetime.now()
+    rows = [
+        {
+            "loan_id": loan_id,
+            "value": value,
+            "ecl_amount": ecl_amount,
+            "pd_value": pd,
+            "lgd_value": lgd,
+            "ead_value": ead,
+            "created_at": now,
+            "updated_at": now
+        }
+        for loan_id, value, ecl_amount, pd, lgd, ead in zip(
+            results["loan_id"].tolist(), results["ecl_percentage"].tolist(), results["ecl_amount"].tolist(),
+            results["pd"].tolist(), results["lgd"].tolist(), results["ead"].tolist())
+    ]
+    return save_ecl_rows(rows, return_ids=return_ids)
+
+
+def calculate_lifetime(inputs, results):
+    """
+    Runs the lifetime term-structure over the (possibly scenario-weighted) PD and LGD of every loan.
+    """
+    ecl, lifetime_pd = lifetime_ecl(results["pd"], results["lgd"], results["ead"], inputs["remaining_term"],
+                                    inputs["interest_rate"])
+    return {
+        "loan_id": results["loan_id"],
+        "lifetime_pd": lifetime_pd,
+        "lgd": results["lgd"],
+        "ead": results["ead"],
+        "remaining_term": inputs["remaining_term"],
+        "ecl_amount": ecl,
+        "ecl_percentage": (ecl / results["ead"]) * 100
+    }
+
+
+def save_lifetime_results(lifetime, chunk_size=10000):
+    now = datetime.now()
+    rows = [
+        {
+            "loan_id": loan_id,
+            "value": value,
+            "ecl_amount": ecl_amount,
+            "lifetime_pd": lifetime_pd,
+            "lgd_value": lgd,
+            "ead_value": ead,
+            "remaining_term": remaining_term,
+            "created_at": now
+        }
+        for loan_id, value, ecl_amount, lifetime_pd, lgd, ead, remaining_term in zip(
+            lifetime["loan_id"].tolist(), lifetime["ecl_percentage"].tolist(), lifetime["ecl_amount"].tolist(),
+            lifetime["lifetime_pd"].tolist(), lifetime["lgd"].tolist(), lifetime["ead"].tolist(),
+            lifetime["remaining_term"].tolist())
+    ]
+    for start in range(0, len(rows), chunk_size):
+        db.session.execute(insert(ECLLifetimeData), rows[start:start + chunk_size])
+
+
+def run_ecl_batch(user_id=None, loan_ids=None, recovery_cost=0, scenarios=False, lifetime=False):
+    """
+    Calculates and stores ECL for every loan with an outstanding balance.
+    With scenarios the stored ECL is the probability-weighted ECL of the defined scenarios and the
+    per-scenario figures are stored next to it. With lifetime the lifetime ECL over the remaining
+    amortization schedule is stored as well. Returns a summary of the run.
+    """
+    started = time.perf_counter()
+    inputs = load_portfolio(user_id=user_id, loan_ids=loan_ids)
+    results = calculate_portfolio(inputs, recovery_cost)
+    summary = {}
+    try:
+        if scenarios:
+            scenario_results = calculate_scenarios(inputs, results, load_scenarios())
+            results = scenario_results["weighted"]
+            ecl_ids = save_ecl_results(results, return_ids=True)
+            save_scenario_results(ecl_ids, scenario_results)
+            saved = len(ecl_ids)
+            summary["scenarios"] = scenario_summary(scenario_results)
+        else:
+            saved = save_ecl_results(results)
+        if lifetime:
+            lifetime_results = calculate_lifetime(inputs, results)
+            save_lifetime_results(lifetime_results)
+            summary["total_lifetime_ecl_amount"] = float(lifetime_results["ecl_amount"].sum())
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return {
+        "loans": saved,
+        "total_ecl_amount": float(results["ecl_amount"].sum()),
+        "total_exposure": float(results["ead"].sum()),
+        "seconds": round(time.perf_counter() - started, 3),
+        **summary
+    }
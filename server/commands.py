@@ -0,0 +1,160 @@
+import json
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from server.batch import run_ecl_batch
+from server.scenarios import ScenarioError
+from server.ecl_store import rebuild_current_ecl
+from server.ecl_writer import dead_letter_path, replay_dead_letter
+from server.jobs import DEFAULT_BATCH_SIZE, DEFAULT_POLL_INTERVAL, DEFAULT_CLAIM_TIMEOUT, run_worker_pool
+from server.portfolio_risk import DEFAULT_CORRELATION, SimulationError, run_credit_loss_simulation
+from server.payment_summary import rebuild_payment_summaries, check_payment_summaries
+from server.portfolio_summary import rebuild_portfolio_summary
+from server.seed import seed_portfolio
+from server.ecl_history import DEFAULT_CHUNK_LOANS, compact_history
+from server.early_warning import DEFAULT_CHUNK_LOANS as SCAN_CHUNK_LOANS, ScanInProgress, run_early_warning_scan
+
+
+@click.command('ecl-batch')
+@click.option('--user-id', type=int, default=None, help='Only calculate loans of this customer.')
+@click.option('--recovery-cost', type=float, default=0, help='Recovery cost applied to every loan.')
+@click.option('--scenarios', is_flag=True, help='Store the probability-weighted ECL of the defined scenarios.')
+@click.option('--lifetime', is_flag=True, help='Also store the lifetime ECL over each remaining loan term.')
+@with_appcontext
+def ecl_batch_command(user_id, recovery_cost, scenarios, lifetime):
+    """Calculates and stores ECL for the whole loan book."""
+    try:
+        summary = run_ecl_batch(user_id=user_id, recovery_cost=recovery_cost, scenarios=scenarios, lifetime=lifetime)
+    except ScenarioError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Calculated ECL for {summary['loans']} loans in {summary['seconds']}s "
+               f"(total ECL {summary['total_ecl_amount']:.2f}).")
+    if lifetime:
+        click.echo(f"Lifetime ECL {summary['total_lifetime_ecl_amount']:.2f}.")
+    for scenario in summary.get('scenarios', []):
+        click.echo(f"  {scenario['name']} (weight {scenario['weight']}): {scenario['total_ecl_amount']:.2f}")
+
+
+@click.command('rebuild-current-ecl')
+@with_appcontext
+def rebuild_current_ecl_command():
+    """Rebuilds the latest-ECL-per-loan projection from ECL history."""
+    loans = rebuild_current_ecl()
+    click.echo(f"Current ECL rebuilt for {loans} loans.")
+
+
+@click.command('rebuild-payment-summaries')
+@with_appcontext
+def rebuild_payment_summaries_command():
+    """Rebuilds the per-loan and per-customer payment summaries from the payments table."""
+    for table, rows in rebuild_payment_summaries().items():
+        click.echo(f"{table}: {rows} rows")
+
+
+@click.command('rebuild-portfolio-summary')
+@with_appcontext
+def rebuild_portfolio_summary_command():
+    """Rebuilds the portfolio rollup by industry, lending type and risk level from the loans."""
+    counts = rebuild_portfolio_summary()
+    click.echo(f"Portfolio summary rebuilt for {counts['loans']} loans in {counts['cells']} rollup cells.")
+
+
+@click.command('check-payment-summaries')
+@click.option('--limit', type=int, default=20, help='Maximum number of mismatches to print.')
+@with_appcontext
+def check_payment_summaries_command(limit):
+    """Reports payment summary rows that no longer match the payments table."""
+    mismatches = check_payment_summaries()
+    for mismatch in mismatches[:limit]:
+        click.echo(mismatch)
+    if mismatches:
+        raise click.ClickException(f"{len(mismatches)} payment summary rows are inconsistent.")
+    click.echo("Payment summaries are consistent.")
+
+
+@click.command('ecl-worker')
+@click.option('--processes', type=int, default=1, help='Number of worker processes.')
+@click.option('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Loans claimed per batch.')
+@click.option('--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL, help='Seconds to wait on an empty queue.')
+@click.option('--claim-timeout', type=int, default=DEFAULT_CLAIM_TIMEOUT,
+              help='Seconds after which loans claimed by a dead worker are queued again.')
+@click.option('--once', is_flag=True, help='Exit when the queue is empty.')
+@with_appcontext
+def ecl_worker_command(processes, batch_size, poll_interval, claim_timeout, once):
+    """Processes queued ECL recalculations."""
+    run_worker_pool(processes, batch_size=batch_size, poll_interval=poll_interval, claim_timeout=claim_timeout,
+                    once=once)
+
+
+@click.command('simulate-credit-loss')
+@click.option('--scenarios', type=int, default=100000, help='Number of Monte Carlo scenarios.')
+@click.option('--seed', type=int, default=0, help='Random seed.')
+@click.option('--confidence', type=float, default=0.999, help='VaR / expected shortfall confidence level.')
+@click.option('--default-correlation', type=float, default=DEFAULT_CORRELATION, help='Asset correlation of loans.')
+@click.option('--correlation', 'correlations', type=(int, float), multiple=True,
+              help='Asset correlation of one industry, e.g. --correlation 3 0.2')
+@click.option('--processes', type=int, default=1, help='Worker processes for the scenario streams.')
+@with_appcontext
+def simulate_credit_loss_command(scenarios, seed, confidence, default_correlation, correlations, processes):
+    """Simulates the portfolio credit-loss distribution (one-factor Vasicek)."""
+    try:
+        result = run_credit_loss_simulation(scenarios, seed, confidence, default_correlation, dict(correlations),
+                                            processes)
+    except SimulationError as e:
+        raise click.ClickException(str(e))
+    click.echo(json.dumps(result, indent=2))
+
+
+@click.command('seed')
+@click.option('--loans', type=int, default=100000, help='Number of loans to generate.')
+@click.option('--customers', type=int, default=None, help='Number of customers, default one per 4 loans.')
+@click.option('--payments-per-loan', type=int, default=12, help='Maximum monthly payments per loan.')
+@click.option('--ecl-history', type=int, default=0, help='ECL history rows per loan.')
+@click.option('--seed', 'random_seed', type=int, default=0, help='Random seed; the same seed gives the same data.')
+@with_appcontext
+def seed_command(loans, customers, payments_per_loan, ecl_history, random_seed):
+    """Appends a deterministic synthetic portfolio for load testing."""
+    started = time.perf_counter()
+    counts = seed_portfolio(loans, customers=customers, payments_per_loan=payments_per_loan,
+                            ecl_history=ecl_history, seed=random_seed)
+    click.echo(', '.join(f"{rows} {table}" for table, rows in counts.items())
+               + f" written in {time.perf_counter() - started:.1f}s.")
+
+
+@click.command('compact-ecl-history')
+@click.option('--raw-days', type=int, default=None,
+              help='Days of raw ECL history to keep, default ECL_HISTORY_RAW_DAYS or 90.')
+@click.option('--retention-months', type=int, default=None,
+              help='Months of monthly snapshots to keep, default ECL_HISTORY_RETENTION_MONTHS or forever.')
+@click.option('--chunk-size', type=int, default=DEFAULT_CHUNK_LOANS, help='Loans compacted per transaction.')
+@with_appcontext
+def compact_ecl_history_command(raw_days, retention_months, chunk_size):
+    """Downsamples old ECL history into monthly snapshots and drops expired snapshots."""
+    job = compact_history(raw_days=raw_days, retention_months=retention_months, chunk_size=chunk_size)
+    click.echo(f"Job {job.id}: {job.description}.")
+
+
+@click.command('early-warning-scan')
+@click.option('--full', is_flag=True, help='Scan every active loan instead of the ones changed since the last scan.')
+@click.option('--chunk-size', type=int, default=SCAN_CHUNK_LOANS, help='Loans scanned per transaction.')
+@with_appcontext
+def early_warning_scan_command(full, chunk_size):
+    """Flags loans crossing an early-warning threshold."""
+    started = time.perf_counter()
+    try:
+        job = run_early_warning_scan(full=full, chunk_size=chunk_size)
+    except ScanInProgress as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Job {job.id}: {job.description} in {time.perf_counter() - started:.2f}s.")
+
+
+@click.command('replay-ecl-dead-letter')
+@click.option('--path', default=None, help='Dead-letter file, default ECL_WRITE_BEHIND_DEAD_LETTER.')
+@with_appcontext
+def replay_ecl_dead_letter_command(path):
+    """Writes the ECL rows the write-behind buffer could not write."""
+    rows = replay_dead_letter(path or dead_letter_path(current_app))
+    click.echo(f"{rows} ECL rows written.")
@@ -0,0 +1,287 @@
+"""
+Early-warning scan: flags active loans crossing a days-late, ECL jump, credit score drop or balance-to-collateral
+threshold, in set-based statements. Only loans with payments, ECL rows, CIB reports or loan rows added since the
+previous scan are evaluated (watermarks on the row ids); edits of loans and CIB data queue an ECL recalculation,
+so they are picked up through the new ECL row. The figures of each loan at its last scan are its baseline.
+
+With database sequences, a row can get an id below the watermark and commit after the scan read it. Every scan
+therefore also rescans the last EWS_WATERMARK_OVERLAP ids of each source; rescanning a loan whose figures did
+not change raises no alert, since its baseline already holds them. Only one scan runs at a time.
+"""
+import logging
+import os
+from datetime import datetime, timedelta
+
+from flask import current_app, has_app_context
+from sqlalchemy import and_, delete, func, insert, literal, or_, select, union, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateIndex
+
+from utils.extensions import db
+from server.models import RUNNING_SCAN_INDEX, CIBData, ECLData, EarlyWarningAlert, Job, Loan, LoanCurrentECL, \
+    LoanMonitorState, LoanPaymentSummary, Payment, ScanWatermark
+
+EARLY_WARNING_SCAN = 'early_warning_scan'
+DEFAULT_CHUNK_LOANS = 10000
+DEFAULT_WATERMARK_OVERLAP = 100  # ids below the watermark rescanned for rows committed late
+DEFAULT_STALE_SCAN_SECONDS = 3600  # a scan running longer is taken for a crashed one
+
+# rule -> (config key, default threshold)
+RULES = {
+    'days_late': ('EWS_DAYS_LATE', 30),  # days late of the worst late payment
+    'ecl_jump': ('EWS_ECL_JUMP', 2),  # ECL percentage points gained since the last scan
+    'credit_score_drop': ('EWS_CREDIT_SCORE_DROP', 50),  # points lost since the last scan
+    'balance_to_collateral': ('EWS_BALANCE_TO_COLLATERAL', 1),  # outstanding balance / collateral value
+}
+# watermark source -> (id column, loan id column of the changed rows)
+SOURCES = {
+    'payment': (Payment.id, Payment.loan_id),
+    'ecl_data': (ECLData.id, ECLData.loan_id),
+    'loan': (Loan.id, Loan.id),
+    'cib_data': (CIBData.id, None),
+}
+
+logger = logging.getLogger(__name__)
+
+
+class ScanInProgress(Exception):
+    pass
+
+
+def _setting(key, default):
+    """
+    Setting from the app config, else the environment, else the default.
+    """
+    value = current_app.config.get(key) if has_app_context() else None
+    if value is None:
+        value = os.environ.get(key) or default
+    return float(value)
+
+
+def alert_thresholds():
+    """
+    Threshold of every rule from the app config, else the environment, else the default.
+    """
+    return {rule: _setting(key, default) for rule, (key, default) in RULES.items()}
+
+
+def _changed_loans(watermarks, overlap):
+    """
+    Ids of the loans with rows added after the watermarks, less overlap ids, None when every loan has to be
+    scanned.
+    """
+    if not watermarks:
+        return None
+    changed = []
+    for source, (id_column, loan_column) in SOURCES.items():
+        last_id = max(watermarks.get(source, 0) - overlap, 0)
+        if loan_column is None:
+            new_reports = select(CIBData.user_id).where(CIBData.id > last_id)
+            changed.append(select(Loan.id).where(Loan.user_id.in_(new_reports)))
+        else:
+            changed.append(select(loan_column).where(id_column > last_id))
+    return union(*changed)
+
+
+def _observations(loans):
+    """
+    Current figures of the active loans matching the condition. The credit score is the customer's latest
+    CIB report.
+    """
+    latest_cib = (
+        select(CIBData.user_id, func.max(CIBData.id).label('cib_id'))
+        .where(CIBData.user_id.in_(select(Loan.user_id).where(loans)))
+        .group_by(CIBData.user_id)
+        .subquery()
+    )
+    statement = (
+        select(
+            Loan.id.label('loan_id'),
+            Loan.user_id.label('user_id'),
+            LoanPaymentSummary.max_days_late.label('max_days_late'),
+            LoanCurrentECL.value.label('ecl_value'),
+            CIBData.credit_score.label('credit_score'),
+            (Loan.outstanding_balance / func.nullif(Loan.collateral_value, 0)).label('balance_to_collateral')
+        )
+        .outerjoin(LoanPaymentSummary, LoanPaymentSummary.loan_id == Loan.id)
+        .outerjoin(LoanCurrentECL, LoanCurrentECL.loan_id == Loan.id)
+        .outerjoin(latest_cib, latest_cib.c.user_id == Loan.user_id)
+        .outerjoin(CIBData, CIBData.id == latest_cib.c.cib_id)
+        .where(loans, Loan.outstanding_balance > 0)
+    )
+    return statement.subquery()
+
+
+def _crossings(observed, thresholds):
+    """
+    (rule, value, previous value, condition) of every rule. Level rules fire when the value reaches the
+    threshold and the baseline was below it (or the loan was never scanned); change rules need a baseline.
+    """
+    state = LoanMonitorState
+    days_late, ecl_jump = thresholds['days_late'], thresholds['ecl_jump']
+    score_drop, ratio = thresholds['credit_score_drop'], thresholds['balance_to_collateral']
+    return [
+        ('days_late', observed.c.max_days_late, state.max_days_late,
+         and_(observed.c.max_days_late >= days_late,
+              or_(state.max_days_late.is_(None), state.max_days_late < days_late))),
+        ('ecl_jump', observed.c.ecl_value, state.ecl_value,
+         observed.c.ecl_value - state.ecl_value >= ecl_jump),
+        ('credit_score_drop', observed.c.credit_score, state.credit_score,
+         state.credit_score - observed.c.credit_score >= score_drop),
+        ('balance_to_collateral', observed.c.balance_to_collateral, state.balance_to_collateral,
+         and_(observed.c.balance_to_collateral >= ratio,
+              or_(state.balance_to_collateral.is_(None), state.balance_to_collateral < ratio))),
+    ]
+
+
+def _scan_chunk(job, thresholds, loans, now):
+    """
+    Stores the alerts of the loans matching the condition and moves their baseline to the current figures.
+    The caller commits. Returns the number of alerts.
+    """
+    observed = _observations(loans)
+    alerts = 0
+    for rule, value, previous, crossed in _crossings(observed, thresholds):
+        rows = (
+            select(literal(job.id), observed.c.loan_id, observed.c.user_id, literal(rule), value, previous,
+                   literal(thresholds[rule]), literal(now))
+            .select_from(observed)
+            .outerjoin(LoanMonitorState, LoanMonitorState.loan_id == observed.c.loan_id)
+            .where(crossed)
+        )
+        alerts += db.session.execute(insert(EarlyWarningAlert).from_select(
+            ['job_id', 'loan_id', 'user_id', 'rule', 'value', 'previous_value', 'threshold', 'created_at'],
+            rows)).rowcount
+
+    db.session.execute(delete(LoanMonitorState).where(
+        LoanMonitorState.loan_id.in_(select(observed.c.loan_id))))
+    db.session.execute(insert(LoanMonitorState).from_select(
+        ['loan_id', 'max_days_late', 'ecl_value', 'credit_score', 'balance_to_collateral', 'scanned_at'],
+        select(observed.c.loan_id, observed.c.max_days_late, observed.c.ecl_value, observed.c.credit_score,
+               observed.c.balance_to_collateral, literal(now))))
+    return alerts
+
+
+def _save_watermarks(last_ids, now):
+    db.session.execute(delete(ScanWatermark))
+    db.session.execute(insert(ScanWatermark), [
+        {'source': source, 'last_id': last_id, 'updated_at': now} for source, last_id in last_ids.items()])
+
+
+def _release_stale_scans(now):
+    db.session.execute(
+        update(Job)
+        .where(Job.kind == EARLY_WARNING_SCAN, Job.status == 'running',
+               Job.started_at < now - timedelta(seconds=_setting('EWS_STALE_SCAN_SECONDS',
+                                                                DEFAULT_STALE_SCAN_SECONDS)))
+        .values(status='failed', error="Abandoned: the scan stopped without finishing.", finished_at=now)
+    )
+
+
+def init_early_warning():
+    """
+    Creates the index allowing one running scan on a database whose job table predates it. Called at startup.
+    """
+    if db.engine.dialect.name not in ('sqlite', 'postgresql'):
+        return
+    _release_stale_scans(datetime.now())
+    db.session.commit()
+    with db.engine.begin() as connection:
+        connection.execute(CreateIndex(RUNNING_SCAN_INDEX, if_not_exists=True))
+
+
+def _start_job(now):
+    """
+    Commits the running Job of a new scan. Raises ScanInProgress while another scan runs; the unique index on
+    running scans settles two scans starting at once.
+    """
+    _release_stale_scans(now)
+    running = db.session.execute(
+        select(Job.id).where(Job.kind == EARLY_WARNING_SCAN, Job.status == 'running')).scalar()
+    if running is not None:
+        db.session.commit()
+        raise ScanInProgress(f"Early-warning scan {running} is still running.")
+    job = Job(kind=EARLY_WARNING_SCAN, status='running', created_at=now, started_at=now,
+              description="Early-warning scan")
+    db.session.add(job)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        raise ScanInProgress("Another early-warning scan is running.")
+    return job
+
+
+def run_early_warning_scan(full=False, chunk_size=DEFAULT_CHUNK_LOANS):
+    """
+    Scans the loans changed since the last scan (every active loan on the first scan or with full) in chunks of
+    chunk_size loans, one transaction each. The watermarks move only when the whole scan succeeded.
+    Progress is tracked on a Job row, which is returned with the number of alerts in its description.
+    Raises ScanInProgress while another scan runs.
+    """
+    now = datetime.now()
+    job = _start_job(now)
+
+    alerts = 0
+    try:
+        watermarks = {} if full else dict(
+            db.session.execute(select(ScanWatermark.source, ScanWatermark.last_id)).all())
+        thresholds = alert_thresholds()
+        # rows added while the scan runs are left to the next one
+        last_ids = {source: db.session.execute(select(func.coalesce(func.max(id_column), 0))).scalar()
+                    for source, (id_column, _) in SOURCES.items()}
+        changed = _changed_loans(watermarks, int(_setting('EWS_WATERMARK_OVERLAP', DEFAULT_WATERMARK_OVERLAP)))
+        if changed is None:
+            low, high = db.session.execute(select(func.min(Loan.id), func.max(Loan.id))).one()
+            chunks = [and_(Loan.id >= start, Loan.id < start + chunk_size)
+                      for start in range(low, high + 1, chunk_size)] if low is not None else []
+        else:
+            loan_ids = sorted(db.session.execute(changed).scalars())
+            chunks = [Loan.id.in_(loan_ids[start:start + chunk_size])
+                      for start in range(0, len(loan_ids), chunk_size)]
+        job.description = "Full early-warning scan" if changed is None else "Incremental early-warning scan"
+        job.total = len(chunks)
+        db.session.commit()
+
+        for loans in chunks:
+            alerts += _scan_chunk(job, thresholds, loans, now)
+            job.processed += 1
+            db.session.commit()
+        _save_watermarks(last_ids, now)
+        job.description += f": {alerts} alerts"
+        job.status = 'done'
+        job.finished_at = datetime.now()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.exception("Early-warning scan failed")
+        job.status = 'failed'
+        job.error = str(e)[:1000]
+        job.finished_at = datetime.now()
+        db.session.commit()
+        raise
+    return job
+
+
+def alert_listing(rule=None, loan_id=None, user_id=None):
+    """
+    Alerts, optionally of one rule, loan or customer, for keyset pagination on the id.
+    """
+    statement = select(
+        EarlyWarningAlert.id,
+        EarlyWarningAlert.job_id,
+        EarlyWarningAlert.loan_id,
+        EarlyWarningAlert.user_id,
+        EarlyWarningAlert.rule,
+        EarlyWarningAlert.value,
+        EarlyWarningAlert.previous_value,
+        EarlyWarningAlert.threshold,
+        EarlyWarningAlert.created_at
+    )
+    if rule:
+        statement = statement.where(EarlyWarningAlert.rule == rule)
+    if loan_id is not None:
+        statement = statement.where(EarlyWarningAlert.loan_id == loan_id)
+    if user_id is not None:
+        statement = statement.where(EarlyWarningAlert.user_id == user_id)
+    return statement
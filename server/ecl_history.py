@@ -0,0 +1,352 @@
+"""
+ECL history: daily/monthly series per loan and for the portfolio, and the compaction job that folds old ECLData
+rows into ECLMonthlySnapshot rows so the raw table only holds the recent past.
+"""
+import logging
+import os
+from datetime import date, datetime, timedelta
+
+from dateutil.relativedelta import relativedelta
+from flask import current_app, has_app_context
+from sqlalchemy import and_, delete, exists, func, insert, literal, select, union_all
+from sqlalchemy.orm import aliased
+
+from utils.extensions import db
+from server.models import ECLData, ECLMonthlySnapshot, ECLScenarioResult, Job, LoanCurrentECL
+
+ECL_HISTORY_COMPACTION = 'ecl_history_compaction'
+INTERVALS = ('day', 'month')
+DEFAULT_RAW_DAYS = 90
+DEFAULT_CHUNK_LOANS = 5000
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryError(ValueError):
+    pass
+
+
+def _setting(name, default):
+    """
+    App config value, else the environment variable of the same name, else the default.
+    """
+    if has_app_context() and current_app.config.get(name) is not None:
+        return current_app.config[name]
+    value = os.environ.get(name)
+    return int(value) if value not in (None, '') else default
+
+
+def retention_policy():
+    """
+    (raw_days, retention_months): raw rows are kept for ECL_HISTORY_RAW_DAYS days (whole months are compacted),
+    snapshots for ECL_HISTORY_RETENTION_MONTHS months, forever when it is not set.
+    """
+    return _setting('ECL_HISTORY_RAW_DAYS', DEFAULT_RAW_DAYS), _setting('ECL_HISTORY_RETENTION_MONTHS', None)
+
+
+def _bucket(column, interval):
+    """
+    Start of the day/month of a date or datetime column, in the dialect's date functions.
+    """
+    if db.engine.dialect.name == 'sqlite':
+        return func.strftime('%Y-%m-%d' if interval == 'day' else '%Y-%m-01', column)
+    return func.date_trunc(interval, column)
+
+
+def _bucket_date(value):
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+def parse_day(value, name):
+    """
+    A YYYY-MM-DD query parameter as a date, None when it is missing.
+    """
+    if value in (None, ''):
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise HistoryError(f"{name} must be a date (YYYY-MM-DD).")
+
+
+def _month_start(day):
+    return day.replace(day=1)
+
+
+def _raw_groups(interval, *conditions):
+    """
+    ECLData rows per loan and bucket with their aggregates and the last row's figures.
+    """
+    bucket = _bucket(ECLData.created_at, interval).label('bucket')
+    groups = (
+        select(
+            ECLData.loan_id,
+            bucket,
+            func.count().label('samples'),
+            func.sum(ECLData.value).label('value_sum'),
+            func.count(ECLData.value).label('value_count'),
+            func.min(ECLData.value).label('value_min'),
+            func.max(ECLData.value).label('value_max'),
+            func.sum(ECLData.ecl_amount).label('ecl_amount_sum'),
+            func.count(ECLData.ecl_amount).label('ecl_amount_count'),
+            func.min(ECLData.ecl_amount).label('ecl_amount_min'),
+            func.max(ECLData.ecl_amount).label('ecl_amount_max'),
+            func.max(ECLData.id).label('last_id')
+        )
+        .where(*conditions)
+        .group_by(ECLData.loan_id, bucket)
+        .subquery()
+    )
+    last = aliased(ECLData)
+    return (
+        select(
+            groups.c.loan_id, groups.c.bucket, groups.c.samples,
+            groups.c.value_sum, groups.c.value_count, groups.c.value_min, groups.c.value_max,
+            groups.c.ecl_amount_sum, groups.c.ecl_amount_count, groups.c.ecl_amount_min, groups.c.ecl_amount_max,
+            last.value.label('last_value'),
+            last.ecl_amount.label('last_ecl_amount'),
+            last.pd_value.label('last_pd_value'),
+            last.lgd_value.label('last_lgd_value'),
+            last.ead_value.label('last_ead_value'),
+            last.created_at.label('last_at')
+        )
+        .join(last, last.id == groups.c.last_id)
+    )
+
+
+def _snapshot_groups(interval, *conditions):
+    """
+    Snapshots in the shape of _raw_groups. For daily series a month's snapshot falls on the day of its last row.
+    """
+    bucket = _bucket(ECLMonthlySnapshot.month if interval == 'month' else ECLMonthlySnapshot.last_at, interval)
+    return select(
+        ECLMonthlySnapshot.loan_id,
+        bucket.label('bucket'),
+        ECLMonthlySnapshot.samples,
+        ECLMonthlySnapshot.value_sum,
+        ECLMonthlySnapshot.value_count,
+        ECLMonthlySnapshot.value_min,
+        ECLMonthlySnapshot.value_max,
+        ECLMonthlySnapshot.ecl_amount_sum,
+        ECLMonthlySnapshot.ecl_amount_count,
+        ECLMonthlySnapshot.ecl_amount_min,
+        ECLMonthlySnapshot.ecl_amount_max,
+        ECLMonthlySnapshot.last_value,
+        ECLMonthlySnapshot.last_ecl_amount,
+        ECLMonthlySnapshot.last_pd_value,
+        ECLMonthlySnapshot.last_lgd_value,
+        ECLMonthlySnapshot.last_ead_value,
+        ECLMonthlySnapshot.last_at
+    ).where(*conditions)
+
+
+def _history_groups(interval, loan_id=None, start=None, end=None):
+    raw_conditions, snapshot_conditions = [], []
+    if loan_id is not None:
+        raw_conditions.append(ECLData.loan_id == loan_id)
+        snapshot_conditions.append(ECLMonthlySnapshot.loan_id == loan_id)
+    if start is not None:
+        raw_conditions.append(ECLData.created_at >= start)
+        snapshot_conditions.append(ECLMonthlySnapshot.last_at >= start)
+    if end is not None:
+        raw_conditions.append(ECLData.created_at < end + timedelta(days=1))
+        snapshot_conditions.append(ECLMonthlySnapshot.last_at < end + timedelta(days=1))
+    return union_all(_raw_groups(interval, *raw_conditions),
+                     _snapshot_groups(interval, *snapshot_conditions)).subquery()
+
+
+def _average(total, count):
+    return total / count if count else None
+
+
+def _merge(current, row):
+    """
+    Adds a loan's group row to the bucket being built from earlier rows of the same bucket.
+    """
+    if current is None:
+        return dict(row._mapping)
+    merged = dict(current)
+    for key in ('samples', 'value_count', 'ecl_amount_count'):
+        merged[key] += row._mapping[key]
+    for key in ('value_sum', 'ecl_amount_sum'):
+        values = [v for v in (current[key], row._mapping[key]) if v is not None]
+        merged[key] = sum(values) if values else None
+    for key, pick in (('value_min', min), ('value_max', max), ('ecl_amount_min', min), ('ecl_amount_max', max)):
+        values = [v for v in (current[key], row._mapping[key]) if v is not None]
+        merged[key] = pick(values) if values else None
+    if row.last_at >= current['last_at']:
+        merged.update({key: row._mapping[key] for key in row._mapping.keys() if key.startswith('last_')})
+    return merged
+
+
+def loan_history(loan_id, interval='month', start=None, end=None):
+    """
+    ECL series of one loan: per bucket the number of calculations and the last, average, min and max of the
+    ECL percentage and amount.
+    """
+    history = _history_groups(interval, loan_id=loan_id, start=start, end=end)
+    buckets = {}
+    for row in db.session.execute(select(history).order_by(history.c.bucket, history.c.last_at)):
+        key = _bucket_date(row.bucket)
+        buckets[key] = _merge(buckets.get(key), row)
+    return [
+        {
+            "bucket": key,
+            "samples": group['samples'],
+            "value_last": group['last_value'],
+            "value_avg": _average(group['value_sum'], group['value_count']),
+            "value_min": group['value_min'],
+            "value_max": group['value_max'],
+            "ecl_amount_last": group['last_ecl_amount'],
+            "ecl_amount_avg": _average(group['ecl_amount_sum'], group['ecl_amount_count']),
+            "ecl_amount_min": group['ecl_amount_min'],
+            "ecl_amount_max": group['ecl_amount_max'],
+            "pd_last": group['last_pd_value'],
+            "lgd_last": group['last_lgd_value'],
+            "ead_last": group['last_ead_value'],
+        }
+        for key, group in buckets.items()
+    ]
+
+
+def portfolio_history(interval='month', start=None, end=None):
+    """
+    ECL series of the whole portfolio, aggregated in the database. Per bucket: loans calculated, calculations,
+    the sum of each loan's last ECL amount and exposure in the bucket, their ratio as ECL percentage, and the
+    average, min and max ECL percentage of all calculations.
+    """
+    history = _history_groups(interval, start=start, end=end)
+    rows = db.session.execute(
+        select(
+            history.c.bucket,
+            func.count(history.c.loan_id.distinct()).label('loans'),
+            func.sum(history.c.samples).label('samples'),
+            func.sum(history.c.value_sum).label('value_sum'),
+            func.sum(history.c.value_count).label('value_count'),
+            func.min(history.c.value_min).label('value_min'),
+            func.max(history.c.value_max).label('value_max'),
+            func.sum(history.c.last_ecl_amount).label('ecl_amount'),
+            func.sum(history.c.last_ead_value).label('ead')
+        )
+        .group_by(history.c.bucket)
+        .order_by(history.c.bucket)
+    )
+    return [
+        {
+            "bucket": _bucket_date(row.bucket),
+            "loans": row.loans,
+            "samples": row.samples,
+            "ecl_amount": row.ecl_amount,
+            "ead": row.ead,
+            "value": row.ecl_amount / row.ead * 100 if row.ecl_amount is not None and row.ead else None,
+            "value_avg": _average(row.value_sum, row.value_count),
+            "value_min": row.value_min,
+            "value_max": row.value_max,
+        }
+        for row in rows
+    ]
+
+
+def _compactable(cutoff, low, high):
+    """
+    Raw rows older than the cutoff of loans in [low, high). The month holding a loan's current row stays raw,
+    so every loan month is either raw or a snapshot.
+    """
+    current = aliased(ECLData)
+    in_current_month = (
+        exists()
+        .where(LoanCurrentECL.loan_id == ECLData.loan_id)
+        .where(current.id == LoanCurrentECL.ecl_data_id)
+        .where(_bucket(current.created_at, 'month') == _bucket(ECLData.created_at, 'month'))
+    )
+    return and_(ECLData.loan_id >= low, ECLData.loan_id < high, ECLData.created_at < cutoff, ~in_current_month)
+
+
+def _compact_chunk(cutoff, low, high):
+    """
+    Folds the compactable rows of loans in [low, high) into monthly snapshots, merging with snapshots of the same
+    month from earlier runs, and deletes them with their scenario results. The caller commits.
+    Returns (rows deleted, snapshots written).
+    """
+    compactable = _compactable(cutoff, low, high)
+    groups = db.session.execute(_raw_groups('month', compactable)).all()
+    if not groups:
+        return 0, 0
+    existing = {
+        (snapshot.loan_id, snapshot.month): snapshot
+        for snapshot in db.session.query(ECLMonthlySnapshot).filter(
+            ECLMonthlySnapshot.loan_id >= low, ECLMonthlySnapshot.loan_id < high,
+            ECLMonthlySnapshot.month < cutoff)
+    }
+    new_rows = []
+    for group in groups:
+        month = _bucket_date(group.bucket)
+        values = {key: value for key, value in group._mapping.items() if key != 'bucket'}
+        snapshot = existing.get((group.loan_id, month))
+        if snapshot is None:
+            new_rows.append({**values, 'month': month})
+            continue
+        merged = _merge({column: getattr(snapshot, column) for column in values}, group)
+        for column, value in merged.items():
+            setattr(snapshot, column, value)
+    if new_rows:
+        db.session.execute(insert(ECLMonthlySnapshot), new_rows)
+    db.session.flush()
+
+    compacted_ids = select(ECLData.id).where(compactable)
+    db.session.execute(delete(ECLScenarioResult).where(ECLScenarioResult.ecl_data_id.in_(compacted_ids)))
+    deleted = db.session.execute(delete(ECLData).where(compactable).execution_options(synchronize_session=False))
+    return deleted.rowcount, len(groups)
+
+
+def compact_history(raw_days=None, retention_months=None, chunk_size=DEFAULT_CHUNK_LOANS, now=None):
+    """
+    Runs the compaction job: ECLData rows from before the month that started raw_days ago are folded into
+    monthly snapshots, chunk_size loans per transaction, and snapshots older than retention_months are dropped.
+    The settings default to retention_policy(). Progress is tracked on a Job row, which is returned.
+    """
+    default_raw_days, default_retention = retention_policy()
+    raw_days = default_raw_days if raw_days is None else raw_days
+    retention_months = default_retention if retention_months is None else retention_months
+    now = now or datetime.now()
+    cutoff = _month_start((now - timedelta(days=raw_days)).date())
+
+    low, high = db.session.query(func.min(ECLData.loan_id), func.max(ECLData.loan_id)).filter(
+        ECLData.created_at < cutoff).one()
+    chunks = list(range(low, high + 1, chunk_size)) if low is not None else []
+    job = Job(kind=ECL_HISTORY_COMPACTION, description=f"Compact ECL history before {cutoff}",
+              status='running', total=len(chunks), created_at=now, started_at=now)
+    db.session.add(job)
+    db.session.commit()
+
+    rows = snapshots = 0
+    try:
+        for start in chunks:
+            deleted, written = _compact_chunk(cutoff, start, start + chunk_size)
+            rows += deleted
+            snapshots += written
+            job.processed += 1
+            db.session.commit()
+        dropped = 0
+        if retention_months:
+            oldest = _month_start(now.date()) - relativedelta(months=retention_months)
+            dropped = db.session.execute(
+                delete(ECLMonthlySnapshot).where(ECLMonthlySnapshot.month < oldest)).rowcount
+        job.description = (f"Compact ECL history before {cutoff}: {rows} rows into {snapshots} monthly snapshots, "
+                           f"{dropped} expired snapshots dropped")
+        job.status = 'done'
+        job.finished_at = datetime.now()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.exception("ECL history compaction failed")
+        job.status = 'failed'
+        job.error = str(e)[:1000]
+        job.finished_at = datetime.now()
+        db.session.commit()
+        raise
+    return job
@@ -0,0 +1,134 @@
+import logging
+from datetime import datetime
+
+from sqlalchemy import func, insert, select, delete
+
+from utils.database import UPSERT_DIALECTS
+from utils.extensions import db
+from server.models import ECLData, LoanCurrentECL
+from server.portfolio_summary import rebuild_portfolio_rollup, refresh_loans
+
+INSERT_CHUNK_SIZE = 5000
+PROJECTION_COLUMNS = ('value', 'ecl_amount', 'pd_value', 'lgd_value', 'ead_value')
+
+logger = logging.getLogger(__name__)
+
+
+def ecl_row(loan_id, value, ecl_amount, pd_value, lgd_value, ead_value):
+    """
+    Column values of a new ECLData row, in the form save_ecl_rows takes.
+    """
+    now = datetime.now()
+    return {
+        'loan_id': loan_id,
+        'value': value,
+        'ecl_amount': ecl_amount,
+        'pd_value': pd_value,
+        'lgd_value': lgd_value,
+        'ead_value': ead_value,
+        'created_at': now,
+        'updated_at': now
+    }
+
+
+def record_ecl(loan_id, value, ecl_amount, pd_value, lgd_value, ead_value):
+    """
+    Adds one ECLData row, points the loan's current ECL at it and updates the portfolio rollup. The caller commits.
+    """
+    row = ecl_row(loan_id, value, ecl_amount, pd_value, lgd_value, ead_value)
+    data_obj = ECLData(**row)
+    db.session.add(data_obj)
+    db.session.flush()
+    upsert_current_ecl({
+        'ecl_data_id': data_obj.id,
+        **{key: row[key] for key in ('loan_id', *PROJECTION_COLUMNS, 'updated_at')}
+    })
+    refresh_loans([loan_id])
+    return data_obj
+
+
+def upsert_current_ecl(values):
+    """
+    Inserts or replaces the current ECL row of one loan in a single statement where the dialect supports
+    ON CONFLICT, instead of the SELECT + INSERT/UPDATE of session.merge.
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect not in UPSERT_DIALECTS:
+        db.session.merge(LoanCurrentECL(**values))
+        return
+    statement = UPSERT_DIALECTS[dialect](LoanCurrentECL).values(**values)
+    statement = statement.on_conflict_do_update(
+        index_elements=[LoanCurrentECL.loan_id],
+        set_={key: statement.excluded[key] for key in values if key != 'loan_id'})
+    db.session.execute(statement)
+
+
+def save_ecl_rows(rows, chunk_size=INSERT_CHUNK_SIZE, return_ids=False):
+    """
+    Bulk inserts ECLData rows (dicts of column values) and refreshes the current ECL of their loans.
+    The caller owns the transaction. Returns the number of rows, or the new ids in row order with return_ids.
+    With return_ids every loan may appear only once; the ids are read back from the refreshed current ECL rows,
+    because an ordered INSERT ... RETURNING runs one statement per row on SQLite.
+    """
+    if return_ids and len({row["loan_id"] for row in rows}) != len(rows):
+        raise ValueError("save_ecl_rows with return_ids takes at most one row per loan.")
+    ids = []
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        loan_ids = [row["loan_id"] for row in chunk]
+        db.session.execute(insert(ECLData), chunk)
+        refresh_current_ecl(set(loan_ids))
+        if return_ids:
+            current = dict(db.session.execute(
+                select(LoanCurrentECL.loan_id, LoanCurrentECL.ecl_data_id).where(LoanCurrentECL.loan_id.in_(loan_ids))
+            ).all())
+            ids.extend(current[loan_id] for loan_id in loan_ids)
+    return ids if return_ids else len(rows)
+
+
+def _latest_ecl_rows(loan_ids=None):
+    latest_ids = select(func.max(ECLData.id)).group_by(ECLData.loan_id)
+    if loan_ids is not None:
+        latest_ids = latest_ids.where(ECLData.loan_id.in_(loan_ids))
+    return (select(ECLData.loan_id, ECLData.id, *[getattr(ECLData, c) for c in PROJECTION_COLUMNS],
+                   ECLData.updated_at)
+            .where(ECLData.id.in_(latest_ids)))
+
+
+def refresh_current_ecl(loan_ids=None):
+    """
+    Recomputes the current ECL rows of the given loans (all loans when None) from ECLData history, and their
+    portfolio rollup positions.
+    """
+    target_columns = ['loan_id', 'ecl_data_id', *PROJECTION_COLUMNS, 'updated_at']
+    if loan_ids is None:
+        db.session.execute(delete(LoanCurrentECL))
+    else:
+        loan_ids = list(loan_ids)
+        db.session.execute(delete(LoanCurrentECL).where(LoanCurrentECL.loan_id.in_(loan_ids)))
+    db.session.execute(insert(LoanCurrentECL).from_select(target_columns, _latest_ecl_rows(loan_ids)))
+    if loan_ids is None:
+        rebuild_portfolio_rollup()
+    else:
+        refresh_loans(loan_ids)
+
+
+def rebuild_current_ecl():
+    """
+    Rebuilds the whole current ECL projection from history. Returns the number of loans in it.
+    """
+    refresh_current_ecl()
+    db.session.commit()
+    return db.session.query(func.count(LoanCurrentECL.loan_id)).scalar()
+
+
+def backfill_current_ecl():
+    """
+    Builds the current ECL projection when it is empty but ECL history exists, i.e. on a database created before
+    loan_current_ecl. Called at startup. Returns the number of loans, None when the projection was in place.
+    """
+    if db.session.query(LoanCurrentECL.loan_id).first() is not None or db.session.query(ECLData.id).first() is None:
+        return None
+    loans = rebuild_current_ecl()
+    logger.info("Built the current ECL projection of %d loans from ECL history", loans)
+    return loans
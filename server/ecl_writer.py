@@ -0,0 +1,285 @@
+"""
+Optional write-behind mode for the ECL rows of ECLCalculationApi (ECL_WRITE_BEHIND). Instead of one commit per
+calculation, the rows go into a bounded in-process queue and a background thread writes them with save_ecl_rows,
+ECL_WRITE_BEHIND_BATCH_ROWS rows or ECL_WRITE_BEHIND_INTERVAL_MS milliseconds at a time, in one transaction per
+batch. A calculation is visible in the listings once its batch is committed; rows still queued when the process
+exits normally are written first. Every gunicorn worker has its own queue and thread.
+
+Durability: the request gets its 200 when the row is queued, before it is written. Rows still queued when the
+process is killed or crashes are lost. A batch failing with OperationalError (e.g. "database is locked") is retried
+ECL_WRITE_BEHIND_RETRIES times with a backoff starting at ECL_WRITE_BEHIND_RETRY_BACKOFF_MS and doubling; a batch
+failing otherwise is written row by row, so one bad row doesn't drop the others. Rows that still fail are appended
+to the dead-letter file (ECL_WRITE_BEHIND_DEAD_LETTER, NDJSON, default instance/ecl_write_dead_letter.ndjson) and
+logged; `flask replay-ecl-dead-letter` writes them once the cause is fixed. Leave write-behind off where a 200 must
+mean the row is committed.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy.exc import OperationalError
+
+from utils.extensions import db
+from utils.instrumentation import metrics
+from server.ecl_store import save_ecl_rows
+
+TABLE = 'ecl_data'
+DEFAULT_MAX_ROWS = 10000
+DEFAULT_BATCH_ROWS = 500
+DEFAULT_INTERVAL_MS = 50
+DEFAULT_PUT_TIMEOUT_MS = 1000
+DEFAULT_RETRIES = 3
+DEFAULT_RETRY_BACKOFF_MS = 100
+DEFAULT_DEAD_LETTER = 'ecl_write_dead_letter.ndjson'
+DATETIME_COLUMNS = ('created_at', 'updated_at')
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class BufferFull(Exception):
+    pass
+
+
+class ECLWriteBuffer:
+    """
+    Bounded queue of ECLData rows (dicts of column values) with the thread that writes them.
+    submit() blocks for up to put_timeout_ms while the queue is full and raises BufferFull after that, so a
+    database that can't keep up slows the callers down instead of growing the queue.
+    """
+
+    def __init__(self, app, max_rows=DEFAULT_MAX_ROWS, batch_rows=DEFAULT_BATCH_ROWS,
+                 interval_ms=DEFAULT_INTERVAL_MS, put_timeout_ms=DEFAULT_PUT_TIMEOUT_MS, retries=DEFAULT_RETRIES,
+                 retry_backoff_ms=DEFAULT_RETRY_BACKOFF_MS, dead_letter_path=None):
+        self.app = app
+        self.max_rows = max_rows
+        self.batch_rows = batch_rows
+        self.interval = interval_ms / 1000
+        self.put_timeout = put_timeout_ms / 1000
+        self.retries = retries
+        self.retry_backoff = retry_backoff_ms / 1000
+        self.dead_letter_path = dead_letter_path or os.path.join(app.instance_path, DEFAULT_DEAD_LETTER)
+        self.queue = queue.Queue(maxsize=max_rows)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._closed = False
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                # forked after rows were queued: those rows belong to the parent's thread
+                self.queue = queue.Queue(maxsize=self.max_rows)
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='ecl-write-behind', daemon=True)
+            self._thread.start()
+
+    def submit(self, row):
+        """
+        Queues one row. Raises BufferFull when the queue stayed full for put_timeout_ms or the buffer is closed.
+        """
+        if self._closed:
+            raise BufferFull("The ECL write buffer is closed.")
+        if self._pid != os.getpid() or not self._thread.is_alive():
+            self._start()
+        try:
+            self.queue.put(row, timeout=self.put_timeout)
+        except queue.Full:
+            metrics.observe_write_rejected(TABLE)
+            raise BufferFull("The ECL write buffer is full.")
+
+    def _next_batch(self):
+        """
+        Waits for a row, then collects more until batch_rows rows or interval seconds. Returns the rows and
+        whether the buffer was closed.
+        """
+        rows = []
+        first = self.queue.get()
+        if first is _STOP:
+            return rows, True
+        rows.append(first)
+        deadline = time.monotonic() + self.interval
+        while len(rows) < self.batch_rows:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                row = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if row is _STOP:
+                return rows, True
+            rows.append(row)
+        return rows, False
+
+    def _save(self, rows):
+        """
+        Writes rows in one transaction, retrying it with backoff while it fails with OperationalError.
+        """
+        for attempt in range(self.retries + 1):
+            with self.app.app_context():
+                try:
+                    save_ecl_rows(rows)
+                    db.session.commit()
+                    return
+                except OperationalError as e:
+                    db.session.rollback()
+                    if attempt == self.retries:
+                        raise
+                    logger.warning("Writing %d buffered ECL rows failed (%s), retry %d of %d", len(rows), e.orig,
+                                   attempt + 1, self.retries)
+                except Exception:
+                    db.session.rollback()
+                    raise
+            metrics.observe_write_retry(TABLE)
+            time.sleep(self.retry_backoff * 2 ** attempt)
+
+    def _write(self, rows):
+        """
+        Writes one batch. A batch that fails with anything but OperationalError is written row by row; rows that
+        can't be written go to the dead-letter file. The database staying unavailable dead-letters the remaining
+        rows at once rather than retrying each of them.
+        """
+        started = time.perf_counter()
+        failed = []
+        try:
+            self._save(rows)
+        except OperationalError:
+            logger.exception("Writing %d buffered ECL rows failed after %d retries", len(rows), self.retries)
+            failed = rows
+        except Exception:
+            logger.exception("Writing %d buffered ECL rows failed, writing them one by one", len(rows))
+            for index, row in enumerate(rows):
+                try:
+                    self._save([row])
+                except OperationalError:
+                    logger.exception("Writing buffered ECL rows failed after %d retries", self.retries)
+                    failed.extend(rows[index:])
+                    break
+                except Exception:
+                    logger.exception("Writing the buffered ECL row of loan %s failed", row.get('loan_id'))
+                    failed.append(row)
+        if failed:
+            self._dead_letter(failed)
+        metrics.observe_write_flush(TABLE, len(rows), time.perf_counter() - started, len(failed))
+
+    def _dead_letter(self, rows):
+        lines = ''.join(json.dumps(_dump_row(row), default=str) + '\n' for row in rows)
+        try:
+            os.makedirs(os.path.dirname(self.dead_letter_path) or '.', exist_ok=True)
+            with open(self.dead_letter_path, 'a') as f:
+                f.write(lines)
+        except OSError:
+            logger.exception("Writing %d ECL rows to the dead-letter file failed, they are lost:\n%s", len(rows), lines)
+            return
+        logger.error("%d ECL rows could not be written and were appended to %s", len(rows), self.dead_letter_path)
+
+    def _run(self):
+        stopped = False
+        while not stopped:
+            rows, stopped = self._next_batch()
+            if rows:
+                self._write(rows)
+            for _ in range(len(rows) + stopped):
+                self.queue.task_done()
+
+    def flush(self):
+        """
+        Waits until every row queued so far is written.
+        """
+        if self._pid == os.getpid() and self._thread.is_alive():
+            self.queue.join()
+
+    def close(self, timeout=30):
+        """
+        Stops accepting rows and writes the queued ones. Registered with atexit.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self._pid == os.getpid() and self._thread.is_alive():
+            self.queue.put(_STOP)
+            self._thread.join(timeout)
+
+
+def _setting(app, name, default):
+    return int(app.config.setdefault(name, int(os.environ.get(name) or default)))
+
+
+def _dump_row(row):
+    return {key: value.isoformat() if isinstance(value, datetime) else value for key, value in row.items()}
+
+
+def _load_row(line):
+    row = json.loads(line)
+    for key in DATETIME_COLUMNS:
+        if row.get(key) is not None:
+            row[key] = datetime.fromisoformat(row[key])
+    return row
+
+
+def dead_letter_path(app):
+    return app.config.setdefault('ECL_WRITE_BEHIND_DEAD_LETTER', os.environ.get('ECL_WRITE_BEHIND_DEAD_LETTER')
+                                 or os.path.join(app.instance_path, DEFAULT_DEAD_LETTER))
+
+
+def replay_dead_letter(path):
+    """
+    Writes the rows of a dead-letter file in one transaction and removes the file. Returns the number of rows.
+    The file is renamed to <path>.replay first, so rows dead-lettered meanwhile go to a new file; a failed replay
+    leaves the .replay file in place and the next replay writes it before taking the new file.
+    """
+    replay = path + '.replay'
+    if not os.path.exists(replay):
+        if not os.path.exists(path):
+            return 0
+        os.replace(path, replay)
+    with open(replay) as f:
+        rows = [_load_row(line) for line in f if line.strip()]
+    if rows:
+        save_ecl_rows(rows)
+        db.session.commit()
+    os.remove(replay)
+    return len(rows)
+
+
+def init_write_behind(app):
+    """
+    Creates the app's ECL write buffer when ECL_WRITE_BEHIND is set (app config or environment), and returns it.
+    """
+    enabled = app.config.setdefault(
+        'ECL_WRITE_BEHIND', os.environ.get('ECL_WRITE_BEHIND', '').lower() in ('1', 'true', 'yes'))
+    if not enabled:
+        return None
+    buffer = ECLWriteBuffer(
+        app,
+        max_rows=_setting(app, 'ECL_WRITE_BEHIND_MAX_ROWS', DEFAULT_MAX_ROWS),
+        batch_rows=_setting(app, 'ECL_WRITE_BEHIND_BATCH_ROWS', DEFAULT_BATCH_ROWS),
+        interval_ms=_setting(app, 'ECL_WRITE_BEHIND_INTERVAL_MS', DEFAULT_INTERVAL_MS),
+        put_timeout_ms=_setting(app, 'ECL_WRITE_BEHIND_PUT_TIMEOUT_MS', DEFAULT_PUT_TIMEOUT_MS),
+        retries=_setting(app, 'ECL_WRITE_BEHIND_RETRIES', DEFAULT_RETRIES),
+        retry_backoff_ms=_setting(app, 'ECL_WRITE_BEHIND_RETRY_BACKOFF_MS', DEFAULT_RETRY_BACKOFF_MS),
+        dead_letter_path=dead_letter_path(app))
+    app.extensions['ecl_write_buffer'] = buffer
+    metrics.register_gauge('ecl_write_buffer_queue_depth', 'ECL rows waiting to be written.', buffer.depth)
+    atexit.register(buffer.close)
+    return buffer
+
+
+def get_write_buffer():
+    """
+    The app's ECL write buffer, None when write-behind is off.
+    """
+    return current_app.extensions.get('ecl_write_buffer')
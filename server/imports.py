@@ -0,0 +1,280 @@
+import csv
+import json
+import logging
+from datetime import datetime
+
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from flask import request, current_app
+from marshmallow import ValidationError
+from sqlalchemy import case, func, insert, inspect, select, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from utils.extensions import db
+from utils.response import iter_chunks
+from utils.validators import CustomerSchema, LoanSchema, PaymentSchema
+from server.models import LendingType, Loan, Payment, User
+from server.payment_summary import apply_payments
+from server.portfolio_summary import refresh_loans, refresh_portfolio
+from server.jobs import enqueue_recalculation
+
+DEFAULT_CHUNK_SIZE = 5000
+MAX_REPORTED_ERRORS = 1000
+
+logger = logging.getLogger(__name__)
+
+
+def is_dry_run():
+    return request.args.get('dry_run', '').lower() in ('1', 'true', 'yes')
+
+
+def get_chunk_size():
+    """
+    Returns the chunk size from the `chunk_size` query argument or the BULK_CHUNK_SIZE setting.
+    """
+    value = request.args.get('chunk_size', current_app.config.get('BULK_CHUNK_SIZE', DEFAULT_CHUNK_SIZE))
+    try:
+        return max(1, int(value))
+    except ValueError:
+        raise ValueError("chunk_size must be an integer.")
+
+
+def read_records():
+    """
+    Yields (row_number, record) pairs from the request body, which may be NDJSON, CSV or a JSON array.
+    Lines that can't be parsed yield a None record. NDJSON and CSV bodies are read line by line.
+    """
+    mimetype = request.mimetype
+    if mimetype == 'application/json':
+        records = request.get_json()
+        if not isinstance(records, list):
+            records = [records]
+        yield from enumerate(records, start=1)
+    elif mimetype == 'text/csv':
+        lines = (line.decode('utf-8-sig') for line in request.stream)
+        for row_number, row in enumerate(csv.DictReader(lines), start=1):
+            yield row_number, {key: value for key, value in row.items() if value not in ('', None)}
+    else:
+        row_number = 0
+        for line in request.stream:
+            line = line.strip()
+            if not line:
+                continue
+            row_number += 1
+            try:
+                yield row_number, json.loads(line)
+            except ValueError:
+                yield row_number, None
+
+
+class ImportReport:
+    """Collects per-row errors of a bulk import without failing the whole file."""
+    def __init__(self):
+        self.processed = 0
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, row_number, messages):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': row_number, 'errors': messages})
+
+    def serialize(self):
+        return {
+            'processed': self.processed,
+            'imported': self.imported,
+            'failed': self.failed,
+            'errors': self.errors
+        }
+
+
+def _load_chunk(schema, chunk, report):
+    """
+    Validates a chunk with many=True and returns (row_number, data) pairs of the valid rows.
+    """
+    rows = []
+    records = []
+    for row_number, record in chunk:
+        if isinstance(record, dict):
+            rows.append(row_number)
+            records.append(record)
+        else:
+            report.add_error(row_number, {'_schema': ["Invalid row."]})
+    try:
+        return list(zip(rows, schema.load(records, many=True)))
+    except ValidationError as err:
+        valid = []
+        for index, (row_number, data) in enumerate(zip(rows, err.valid_data)):
+            if index in err.messages:
+                report.add_error(row_number, err.messages[index])
+            else:
+                valid.append((row_number, data))
+        return valid
+
+
+def run_import(records, prepare_chunk, save_chunk, chunk_size=DEFAULT_CHUNK_SIZE, dry_run=False):
+    """
+    Runs a bulk import chunk by chunk. prepare_chunk(chunk, report) validates a chunk and returns the
+    (row_number, data) pairs to store, save_chunk(rows) stores them. Each chunk is committed on its own,
+    a failing chunk marks its rows as errors and the import goes on. With dry_run nothing is stored.
+    """
+    report = ImportReport()
+    for chunk in iter_chunks(records, chunk_size):
+        report.processed += len(chunk)
+        rows = prepare_chunk(chunk, report)
+        if not rows:
+            continue
+        if dry_run:
+            report.imported += len(rows)
+            continue
+        try:
+            save_chunk([data for _, data in rows])
+            db.session.commit()
+            report.imported += len(rows)
+        except SQLAlchemyError:
+            db.session.rollback()
+            for row_number, _ in rows:
+                report.add_error(row_number, {'_schema': ["Error saving data."]})
+    if dry_run:
+        db.session.rollback()
+    return report
+
+
+def _prepare_payments(chunk, report):
+    valid = _load_chunk(PaymentSchema(), chunk, report)
+    loan_ids = {payment['loan_id'] for _, payment in valid}
+    owners = dict(db.session.execute(select(Loan.id, Loan.user_id).where(Loan.id.in_(loan_ids))).all()) \
+        if loan_ids else {}
+    payments = []
+    for row_number, payment in valid:
+        if payment['loan_id'] not in owners:
+            report.add_error(row_number, {'loan_id': ["Loan doesn't exists"]})
+        elif owners[payment['loan_id']] != payment['user_id']:
+            report.add_error(row_number, {'user_id': ["Loan doesn't belong to this customer"]})
+        else:
+            payments.append((row_number, payment))
+    return payments
+
+
+def _save_payments(payments):
+    db.session.execute(insert(Payment), payments)
+
+    paid_per_loan = {}
+    for payment in payments:
+        paid_per_loan[payment['loan_id']] = paid_per_loan.get(payment['loan_id'], 0) + payment['amount']
+    db.session.execute(
+        update(Loan)
+        .where(Loan.id.in_(list(paid_per_loan)))
+        .values(outstanding_balance=Loan.outstanding_balance - case(paid_per_loan, value=Loan.id))
+        .execution_options(synchronize_session=False)
+    )
+    apply_payments(payments)
+    refresh_loans(paid_per_loan)
+    enqueue_recalculation(f"{len(payments)} payments imported", Loan.id.in_(list(paid_per_loan)))
+
+
+def import_payments(records, chunk_size=DEFAULT_CHUNK_SIZE, dry_run=False):
+    """
+    Validates and stores payments chunk by chunk. Every chunk inserts its payments with executemany,
+    decrements the loans' outstanding balance with one aggregated UPDATE and updates the payment summaries.
+    """
+    return run_import(records, _prepare_payments, _save_payments, chunk_size, dry_run)
+
+
+class _CustomerImport:
+    """
+    Checks email and phone number uniqueness against the DB (one IN query per chunk) and within the file.
+    The email is optional, as in CustomerSchema; only given emails have to be unique.
+    """
+    def __init__(self):
+        self.seen_emails = set()
+        self.seen_phone_numbers = set()
+
+    def prepare(self, chunk, report):
+        valid = _load_chunk(CustomerSchema(), chunk, report)
+        emails = {customer.get('email') for _, customer in valid if customer.get('email')}
+        phone_numbers = {customer['phone_number'] for _, customer in valid}
+        taken_emails = set(db.session.execute(
+            select(User.email).where(User.email.in_(emails))).scalars()) if emails else set()
+        taken_phone_numbers = set(db.session.execute(
+            select(User.phone_number).where(User.phone_number.in_(phone_numbers))).scalars())
+
+        customers = []
+        for row_number, customer in valid:
+            email = customer.get('email')
+            phone_number = customer['phone_number']
+            if email and (email in taken_emails or email in self.seen_emails):
+                report.add_error(row_number, {'email': ["Email already in use"]})
+            elif phone_number in taken_phone_numbers or phone_number in self.seen_phone_numbers:
+                report.add_error(row_number, {'phone_number': ["Phone Number already in use"]})
+            else:
+                if email:
+                    self.seen_emails.add(email)
+                self.seen_phone_numbers.add(phone_number)
+                customers.append((row_number, customer))
+        return customers
+
+    @staticmethod
+    def save(customers):
+        db.session.execute(insert(User), customers)
+
+
+def init_customer_import():
+    """
+    Drops the NOT NULL of user.email on a database created while the email was required, so customers without one
+    can be stored. SQLite can't alter a column, so alembic's batch mode copies the table there. Called at startup.
+    Returns True when the column was changed.
+    """
+    email = next(column for column in inspect(db.engine).get_columns(User.__tablename__) if column['name'] == 'email')
+    if email['nullable']:
+        return False
+    with db.engine.begin() as connection:
+        with Operations(MigrationContext.configure(connection)).batch_alter_table(User.__tablename__) as batch:
+            batch.alter_column('email', existing_type=User.email.type, nullable=True)
+    logger.info("Made %s.email nullable", User.__tablename__)
+    return True
+
+
+def import_customers(records, chunk_size=DEFAULT_CHUNK_SIZE, dry_run=False):
+    """
+    Validates and bulk inserts customers. Emails and phone numbers must be unique in the DB and in the file.
+    """
+    customer_import = _CustomerImport()
+    return run_import(records, customer_import.prepare, customer_import.save, chunk_size, dry_run)
+
+
+def _prepare_loans(chunk, report):
+    valid = _load_chunk(LoanSchema(), chunk, report)
+    user_ids = {loan['user_id'] for _, loan in valid}
+    lending_types = {loan['lending_type'] for _, loan in valid}
+    existing_users = set(db.session.execute(
+        select(User.id).where(User.id.in_(user_ids))).scalars()) if user_ids else set()
+    existing_lending_types = set(db.session.execute(
+        select(LendingType.id).where(LendingType.id.in_(lending_types))).scalars()) if lending_types else set()
+
+    loans = []
+    for row_number, loan in valid:
+        if loan['user_id'] not in existing_users:
+            report.add_error(row_number, {'user_id': ["User not found."]})
+        elif loan['lending_type'] not in existing_lending_types:
+            report.add_error(row_number, {'lending_type': ["Lending type doesn't exists."]})
+        elif loan['collateral_value'] <= loan['loan_amount']:
+            report.add_error(row_number, {'collateral_value': ["Collateral amount must be greater than the loan amount."]})
+        else:
+            loans.append((row_number, loan))
+    return loans
+
+
+def _save_loans(loans):
+    now = datetime.now()
+    last_id = db.session.execute(select(func.max(Loan.id))).scalar() or 0
+    db.session.execute(insert(Loan), [{**loan, 'created_at': now} for loan in loans])
+    refresh_portfolio(Loan.id > last_id)
+
+
+def import_loans(records, chunk_size=DEFAULT_CHUNK_SIZE, dry_run=False):
+    """
+    Validates and bulk inserts loans of existing customers and lending types.
+    """
+    return run_import(records, _prepare_loans, _save_loans, chunk_size, dry_run)
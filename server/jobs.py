@@ -0,0 +1,192 @@
+import logging
+import multiprocessing
+import os
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, case, delete, exists, insert, literal, select, update
+
+from utils.extensions import db
+from server.batch import calculate_portfolio, load_portfolio, save_ecl_results
+from server.models import ECLRecalculation, ECLRecalculationWatcher, Job, Loan, User
+
+ECL_RECALCULATION = 'ecl_recalculation'
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_POLL_INTERVAL = 2
+DEFAULT_CLAIM_TIMEOUT = 600
+
+logger = logging.getLogger(__name__)
+
+
+def industry_loans(industry_id):
+    """
+    Condition matching the loans of every customer in the business industry.
+    """
+    return Loan.user_id.in_(select(User.id).where(User.industry_id == industry_id))
+
+
+def enqueue_recalculation(description, condition):
+    """
+    Queues an ECL recalculation for every loan matching the condition and returns the job following it.
+    Loans that are already waiting for a worker are not queued twice: the job watches their queued
+    recalculation instead, so it only finishes once those loans are recalculated too.
+    The caller commits, normally together with the change that made the stored ECL stale.
+    """
+    now = datetime.now()
+    job = Job(kind=ECL_RECALCULATION, description=description, status='pending', created_at=now)
+    db.session.add(job)
+    db.session.flush()
+
+    pending = and_(ECLRecalculation.loan_id == Loan.id, ECLRecalculation.claimed_at.is_(None))
+    watched = (select(ECLRecalculation.id, literal(job.id))
+               .join(Loan, Loan.id == ECLRecalculation.loan_id)
+               .where(condition, ECLRecalculation.claimed_at.is_(None)))
+    job.total = db.session.execute(
+        insert(ECLRecalculationWatcher).from_select(['recalculation_id', 'job_id'], watched)).rowcount
+    loans = select(Loan.id, literal(job.id), literal(now)).where(condition).where(~exists().where(pending))
+    job.total += db.session.execute(
+        insert(ECLRecalculation).from_select(['loan_id', 'job_id', 'enqueued_at'], loans)).rowcount
+    if not job.total:
+        job.status = 'done'
+        job.finished_at = now
+    return job
+
+
+def release_stale_claims(claim_timeout=DEFAULT_CLAIM_TIMEOUT):
+    """
+    Puts loans claimed by a worker that died more than claim_timeout seconds ago back in the queue.
+    """
+    cutoff = datetime.now() - timedelta(seconds=claim_timeout)
+    db.session.execute(
+        update(ECLRecalculation)
+        .where(ECLRecalculation.claimed_at < cutoff)
+        .values(claimed_by=None, claimed_at=None)
+    )
+    db.session.commit()
+
+
+def claim_batch(worker_id, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Atomically claims up to batch_size queued loans for this worker and returns the claimed queue rows.
+    """
+    token = f"{worker_id}:{uuid.uuid4().hex[:12]}"
+    now = datetime.now()
+    pending = (select(ECLRecalculation.id)
+               .where(ECLRecalculation.claimed_at.is_(None))
+               .order_by(ECLRecalculation.id)
+               .limit(batch_size))
+    db.session.execute(
+        update(ECLRecalculation)
+        .where(ECLRecalculation.id.in_(pending), ECLRecalculation.claimed_at.is_(None))
+        .values(claimed_by=token, claimed_at=now)
+    )
+    rows = db.session.execute(
+        select(ECLRecalculation.id, ECLRecalculation.loan_id, ECLRecalculation.job_id)
+        .where(ECLRecalculation.claimed_by == token)
+    ).all()
+    if rows:
+        db.session.execute(
+            update(Job)
+            .where(Job.id.in_(_job_counts(rows)), Job.status == 'pending')
+            .values(status='running', started_at=now)
+        )
+    db.session.commit()
+    return rows
+
+
+def _job_counts(rows):
+    """
+    Number of the claimed queue rows per job, counting the jobs watching them.
+    """
+    per_job = Counter(row.job_id for row in rows)
+    per_job.update(db.session.execute(
+        select(ECLRecalculationWatcher.job_id)
+        .where(ECLRecalculationWatcher.recalculation_id.in_([row.id for row in rows]))
+    ).scalars())
+    return per_job
+
+
+def _finish_batch(rows, error=None):
+    now = datetime.now()
+    per_job = _job_counts(rows)
+    counter = Job.failed if error else Job.processed
+    recalculation_ids = [row.id for row in rows]
+    db.session.execute(delete(ECLRecalculationWatcher).where(
+        ECLRecalculationWatcher.recalculation_id.in_(recalculation_ids)))
+    db.session.execute(delete(ECLRecalculation).where(ECLRecalculation.id.in_(recalculation_ids)))
+    db.session.execute(
+        update(Job)
+        .where(Job.id.in_(per_job))
+        .values({counter: counter + case(per_job, value=Job.id)})
+    )
+    if error:
+        db.session.execute(update(Job).where(Job.id.in_(per_job)).values(error=error[:1000]))
+    db.session.execute(
+        update(Job)
+        .where(Job.id.in_(per_job), Job.processed + Job.failed >= Job.total)
+        .values(status=case((Job.failed > 0, 'failed'), else_='done'), finished_at=now)
+    )
+
+
+def process_batch(rows):
+    """
+    Recalculates the ECL of the claimed loans in one vectorized pass and records the progress on their jobs.
+    Loans without outstanding balance are skipped but still count as processed.
+    """
+    loan_ids = sorted({row.loan_id for row in rows})
+    try:
+        save_ecl_results(calculate_portfolio(load_portfolio(loan_ids=loan_ids)))
+        _finish_batch(rows)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.exception("ECL recalculation failed for %s loans", len(loan_ids))
+        _finish_batch(rows, error=str(e))
+        db.session.commit()
+
+
+def run_worker(worker_id=None, batch_size=DEFAULT_BATCH_SIZE, poll_interval=DEFAULT_POLL_INTERVAL,
+               claim_timeout=DEFAULT_CLAIM_TIMEOUT, once=False):
+    """
+    Processes queued recalculations until the queue is empty (once=True) or forever.
+    Returns the number of loans processed.
+    """
+    worker_id = worker_id or str(os.getpid())
+    processed = 0
+    while True:
+        release_stale_claims(claim_timeout)
+        rows = claim_batch(worker_id, batch_size)
+        if not rows:
+            if once:
+                return processed
+            time.sleep(poll_interval)
+            continue
+        process_batch(rows)
+        processed += len(rows)
+
+
+def _worker_process(options):
+    from main import app
+
+    with app.app_context():
+        run_worker(**options)
+
+
+def run_worker_pool(processes=1, **options):
+    """
+    Runs run_worker in separate processes, each with its own DB connections.
+    """
+    if processes <= 1:
+        return run_worker(**options)
+    context = multiprocessing.get_context('spawn')
+    workers = [context.Process(target=_worker_process, args=(options,)) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
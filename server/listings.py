@@ -0,0 +1,166 @@
+"""
+Statements and row shapes of the read endpoints, shared by the Flask views and the ASGI read app so both
+serve the same rows in the same JSON.
+"""
+from sqlalchemy import case, func, select
+
+from utils.versioning import BUSINESS_INDUSTRIES, ECL_THRESHOLDS, LENDING_TYPES
+from server.models import BusinessIndustry, User, CIBData, Loan, Payment, LendingType, ECLData, ECLThreshold, \
+    ECLMonthlySnapshot, LoanCurrentECL
+
+CUSTOMER_SORT_FIELDS = ('id', 'name', 'monthly_income', 'total_loans', 'average_ecl')
+
+REFERENCE_MODELS = {
+    BUSINESS_INDUSTRIES: BusinessIndustry,
+    LENDING_TYPES: LendingType,
+    ECL_THRESHOLDS: ECLThreshold,
+}
+
+
+def customer_listing(sort):
+    """
+    Customers with their industry, loan count and average ECL. Returns the statement and the `sort_key`
+    column to paginate on.
+    """
+    loan_stats = (
+        select(Loan.user_id, func.count(Loan.id).label('total_loans'))
+        .group_by(Loan.user_id)
+        .subquery()
+    )
+    raw_ecl = (
+        select(Loan.user_id, func.avg(ECLData.value).label('average_ecl'), func.sum(ECLData.value).label('value_sum'),
+               func.count(ECLData.value).label('value_count'))
+        .join(ECLData, ECLData.loan_id == Loan.id)
+        .group_by(Loan.user_id)
+        .subquery()
+    )
+    compacted_ecl = (
+        select(Loan.user_id, func.sum(ECLMonthlySnapshot.value_sum).label('value_sum'),
+               func.sum(ECLMonthlySnapshot.value_count).label('value_count'))
+        .join(ECLMonthlySnapshot, ECLMonthlySnapshot.loan_id == Loan.id)
+        .group_by(Loan.user_id)
+        .subquery()
+    )
+    # compacted months count with their sums and counts, so the average stays over every calculation made
+    value_sum = func.coalesce(raw_ecl.c.value_sum, 0) + compacted_ecl.c.value_sum
+    value_count = func.coalesce(raw_ecl.c.value_count, 0) + compacted_ecl.c.value_count
+    ecl_stats = (
+        select(
+            User.id.label('user_id'),
+            case((compacted_ecl.c.user_id.is_(None), raw_ecl.c.average_ecl),
+                 else_=value_sum / func.nullif(value_count, 0)).label('average_ecl')
+        )
+        .outerjoin(raw_ecl, raw_ecl.c.user_id == User.id)
+        .outerjoin(compacted_ecl, compacted_ecl.c.user_id == User.id)
+        .subquery()
+    )
+    total_loans = func.coalesce(loan_stats.c.total_loans, 0)
+    sort_columns = {
+        'id': User.id,
+        'name': User.name,
+        'monthly_income': func.coalesce(User.monthly_income, 0),
+        'total_loans': total_loans,
+        'average_ecl': func.coalesce(ecl_stats.c.average_ecl, 0)
+    }
+    sort_key = sort_columns[sort].label('sort_key')
+    customers = (
+        select(
+            User.id,
+            User.name.label('name'),
+            User.email,
+            User.phone_number,
+            User.estd_date,
+            User.monthly_income,
+            User.employment_status,
+            User.user_type,
+            BusinessIndustry.name.label('business_name'),
+            BusinessIndustry.risk_factor.label('risk_factor'),
+            total_loans.label('total_loans'),
+            ecl_stats.c.average_ecl,
+            sort_key
+        )
+        .outerjoin(BusinessIndustry, BusinessIndustry.id == User.industry_id)
+        .outerjoin(loan_stats, loan_stats.c.user_id == User.id)
+        .outerjoin(ecl_stats, ecl_stats.c.user_id == User.id)
+    )
+    return customers, sort_key
+
+
+def customer_rows(chunk, risk_index):
+    risk_levels = risk_index.classify_many([user.average_ecl or 0 for user in chunk])
+    return [{
+        'id': user.id,
+        'name': user.name,
+        'email': user.email,
+        'phone_number': user.phone_number,
+        'estd_date': user.estd_date,
+        'monthly_income': user.monthly_income,
+        'employment_status': user.employment_status,
+        'user_type': user.user_type,
+        'business_name': user.business_name,
+        'risk_factor': user.risk_factor,
+        'total_loans': user.total_loans,
+        'average_ecl': user.average_ecl,
+        'risk': risk
+    } for user, risk in zip(chunk, risk_levels)]
+
+
+def cib_listing():
+    return (select(CIBData.id, CIBData.credit_score, User.name, User.id.label('user_id'))
+            .join(User, User.id == CIBData.user_id))
+
+
+def loan_listing(user_id=None):
+    """
+    Loans with their customer name and current ECL row.
+    """
+    loans = (
+        select(
+            Loan.id,
+            Loan.loan_name,
+            Loan.user_id,
+            Loan.loan_amount,
+            Loan.outstanding_balance,
+            Loan.loan_term,
+            Loan.interest_rate,
+            Loan.collateral_value,
+            Loan.lending_type,
+            User.name,
+            LoanCurrentECL.value,
+            LoanCurrentECL.ecl_amount,
+            LoanCurrentECL.updated_at
+        )
+        .join(User, User.id == Loan.user_id)
+        .outerjoin(LoanCurrentECL, LoanCurrentECL.loan_id == Loan.id)
+    )
+    if user_id:
+        loans = loans.where(Loan.user_id == user_id)
+    return loans
+
+
+def loan_rows(chunk, risk_index):
+    risk_levels = risk_index.classify_many([loan.value or 0 for loan in chunk])
+    return [{
+        "id": loan.id,
+        "loan_name": loan.loan_name,
+        "user_id": loan.user_id,
+        "loan_amount": loan.loan_amount,
+        "outstanding_balance": loan.outstanding_balance,
+        "loan_term": loan.loan_term,
+        "interest_rate": loan.interest_rate,
+        "collateral_value": loan.collateral_value,
+        "lending_type": loan.lending_type,
+        "name": loan.name,
+        "value": loan.value,
+        "ecl_amount": loan.ecl_amount,
+        "updated_at": loan.updated_at,
+        "risk": risk
+    } for loan, risk in zip(chunk, risk_levels)]
+
+
+def payment_listing(user_id, loan_id):
+    return select(Payment).filter_by(user_id=user_id, loan_id=loan_id)
+
+
+def reference_listing(name):
+    return select(REFERENCE_MODELS[name])
@@ -21,7 +21,7 @@ class BusinessIndustry(db.Model):
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=False)
-    email = db.Column(db.String(120), unique=False, nullable=False)
+    email = db.Column(db.String(120), unique=False, nullable=True)
     phone_number = db.Column(db.Integer, unique=False, nullable=False)
     estd_date = db.Column(db.Date, nullable=False)  # can be nullable for non-business users.
     monthly_income = db.Column(db.Float)
@@ -112,6 +112,7 @@ class EADData(db.Model):
 
 
 class ECLData(db.Model):
+    __table_args__ = (db.Index('ix_ecl_data_loan_id_created_at', 'loan_id', 'created_at'),)
     id = db.Column(db.Integer, primary_key=True)
     loan_id = db.Column(db.Integer, db.ForeignKey(Loan.id), nullable=False)
     value = db.Column(db.Float)
@@ -121,3 +122,249 @@ class ECLData(db.Model):
     ead_value = db.Column(db.Float)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.now())
     updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now())
+
+
+class ECLMonthlySnapshot(db.Model):
+    """
+    ECLData rows of one loan and month after compaction. Sums and counts instead of averages, so snapshots of the
+    same month merge exactly; last_* is the loan's last calculation of the month.
+    """
+    __table_args__ = (db.UniqueConstraint('loan_id', 'month'),)
+    id = db.Column(db.Integer, primary_key=True)
+    loan_id = db.Column(db.Integer, db.ForeignKey(Loan.id), nullable=False)
+    month = db.Column(db.Date, nullable=False, index=True)  # first day of the month
+    samples = db.Column(db.Integer, nullable=False)
+    value_sum = db.Column(db.Float)
+    value_count = db.Column(db.Integer, nullable=False, default=0)
+    value_min = db.Column(db.Float)
+    value_max = db.Column(db.Float)
+    ecl_amount_sum = db.Column(db.Float)
+    ecl_amount_count = db.Column(db.Integer, nullable=False, default=0)
+    ecl_amount_min = db.Column(db.Float)
+    ecl_amount_max = db.Column(db.Float)
+    last_value = db.Column(db.Float)
+    last_ecl_amount = db.Column(db.Float)
+    last_pd_value = db.Column(db.Float)
+    last_lgd_value = db.Column(db.Float)
+    last_ead_value = db.Column(db.Float)
+    last_at = db.Column(db.DateTime, nullable=False)
+
+
+class LoanCurrentECL(db.Model):
+    """Latest ECLData row of every loan, kept in sync with each ECLData insert."""
+    loan_id = db.Column(db.Integer, db.ForeignKey(Loan.id), primary_key=True)
+    ecl_data_id = db.Column(db.Integer, db.ForeignKey(ECLData.id), nullable=False)
+    value = db.Column(db.Float)
+    ecl_amount = db.Column(db.Float)
+    pd_value = db.Column(db.Float)
+    lgd_value = db.Column(db.Float)
+    ead_value = db.Column(db.Float)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+
+class LoanPaymentSummary(db.Model):
+    """Running payment behaviour of a loan, updated with every payment."""
+    loan_id = db.Column(db.Integer, db.ForeignKey(Loan.id), primary_key=True)
+    payment_count = db.Column(db.Integer, nullable=False, default=0)
+    late_count = db.Column(db.Integer, nullable=False, default=0)
+    missed_count = db.Column(db.Integer, nullable=False, default=0)
+    total_days_late = db.Column(db.Integer, nullable=False, default=0)  # late payments only, same as daysLate.
+    max_days_late = db.Column(db.Integer, nullable=False, default=0)
+    last_payment_date = db.Column(db.Date, nullable=True)
+    total_paid = db.Column(db.Float, nullable=False, default=0)
+
+
+class UserPaymentSummary(db.Model):
+    """Running payment behaviour of a customer across all of their loans."""
+    user_id = db.Column(db.Integer, db.ForeignKey(User.id), primary_key=True)
+    payment_count = db.Column(db.Integer, nullable=False, default=0)
+    late_count = db.Column(db.Integer, nullable=False, default=0)
+    missed_count = db.Column(db.Integer, nullable=False, default=0)
+    total_days_late = db.Column(db.Integer, nullable=False, default=0)
+    max_days_late = db.Column(db.Integer, nullable=False, default=0)
+    last_payment_date = db.Column(db.Date, nullable=True)
+    total_paid = db.Column(db.Float, nullable=False, default=0)
+
+
+class LoanPortfolioPosition(db.Model):
+    """What a loan contributes to the portfolio rollup, so a change can subtract its old contribution."""
+    loan_id = db.Column(db.Integer, db.ForeignKey(Loan.id), primary_key=True)
+    industry_id = db.Column(db.Integer, db.ForeignKey(BusinessIndustry.id), nullable=True)
+    lending_type_id = db.Column(db.Integer, db.ForeignKey(LendingType.id), nullable=False)
+    risk_level = db.Column(db.String(20), nullable=False)
+    exposure = db.Column(db.Float, nullable=False, default=0)  # outstanding balance.
+    ecl_amount = db.Column(db.Float)  # current ECL, None until the loan is calculated.
+
+
+class PortfolioRollup(db.Model):
+    """Loan count, exposure and current ECL per industry, lending type and risk level, updated with every change."""
+    id = db.Column(db.Integer, primary_key=True)
+    industry_id = db.Column(db.Integer, db.ForeignKey(BusinessIndustry.id), nullable=True)
+    lending_type_id = db.Column(db.Integer, db.ForeignKey(LendingType.id), nullable=False)
+    risk_level = db.Column(db.String(20), nullable=False)
+    loans = db.Column(db.Integer, nullable=False, default=0)
+    calculated_loans = db.Column(db.Integer, nullable=False, default=0)
+    exposure = db.Column(db.Float, nullable=False, default=0)
+    ecl_amount = db.Column(db.Float, nullable=False, default=0)
+
+
+# one row per cell, customers without an industry included: a plain unique constraint lets NULLs repeat.
+# The 0 is inlined so that the ON CONFLICT target of the upserts renders the same expression.
+PORTFOLIO_ROLLUP_CELL = db.Index('uq_portfolio_rollup_cell',
+                                 db.func.coalesce(PortfolioRollup.industry_id, db.literal_column('0')),
+                                 PortfolioRollup.lending_type_id, PortfolioRollup.risk_level, unique=True)
+
+
+class ECLLifetimeData(db.Model):
+    """Lifetime ECL of a loan over its remaining amortization schedule."""
+    id = db.Column(db.Integer, primary_key=True)
+    loan_id = db.Column(db.Integer, db.ForeignKey(Loan.id), nullable=False, index=True)
+    value = db.Column(db.Float)  # lifetime ECL as percentage of the outstanding balance.
+    ecl_amount = db.Column(db.Float)
+    lifetime_pd = db.Column(db.Float)
+    lgd_value = db.Column(db.Float)
+    ead_value = db.Column(db.Float)
+    remaining_term = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, nullable=False)
+
+
+class ECLScenario(db.Model):
+    """Forward-looking macro scenario (e.g. base/upside/downside) with its probability weight."""
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), nullable=False)
+    weight = db.Column(db.Float, nullable=False)
+    pd_multiplier = db.Column(db.Float, nullable=False, default=1)
+    lgd_multiplier = db.Column(db.Float, nullable=False, default=1)
+    overlays = db.relationship('ECLScenarioOverlay', lazy='selectin', cascade='all, delete-orphan')
+
+    def serialize(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "weight": self.weight,
+            "pd_multiplier": self.pd_multiplier,
+            "lgd_multiplier": self.lgd_multiplier,
+            "overlays": [overlay.serialize() for overlay in self.overlays]
+        }
+
+
+class ECLScenarioOverlay(db.Model):
+    """Extra PD/LGD multipliers of a scenario for one industry and/or lending type (None matches all)."""
+    id = db.Column(db.Integer, primary_key=True)
+    scenario_id = db.Column(db.Integer, db.ForeignKey(ECLScenario.id), nullable=False)
+    industry_id = db.Column(db.Integer, db.ForeignKey(BusinessIndustry.id), nullable=True)
+    lending_type_id = db.Column(db.Integer, db.ForeignKey(LendingType.id), nullable=True)
+    pd_multiplier = db.Column(db.Float, nullable=False, default=1)
+    lgd_multiplier = db.Column(db.Float, nullable=False, default=1)
+
+    def serialize(self):
+        return {
+            "id": self.id,
+            "industry_id": self.industry_id,
+            "lending_type_id": self.lending_type_id,
+            "pd_multiplier": self.pd_multiplier,
+            "lgd_multiplier": self.lgd_multiplier
+        }
+
+
+class ECLScenarioResult(db.Model):
+    """Per-scenario figures behind a probability-weighted ECLData row."""
+    id = db.Column(db.Integer, primary_key=True)
+    ecl_data_id = db.Column(db.Integer, db.ForeignKey(ECLData.id), nullable=False, index=True)
+    scenario_id = db.Column(db.Integer, db.ForeignKey(ECLScenario.id), nullable=False)
+    pd_value = db.Column(db.Float)
+    lgd_value = db.Column(db.Float)
+    ecl_amount = db.Column(db.Float)
+
+
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    description = db.Column(db.String(255))
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, running, done, failed
+    total = db.Column(db.Integer, nullable=False, default=0)
+    processed = db.Column(db.Integer, nullable=False, default=0)
+    failed = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def serialize(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "description": self.description,
+            "status": self.status,
+            "total": self.total,
+            "processed": self.processed,
+            "failed": self.failed,
+            "progress": round((self.processed + self.failed) * 100 / self.total, 2) if self.total else 100,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
+
+
+# at most one running early-warning scan; partial indexes exist on SQLite and PostgreSQL only
+_RUNNING_SCAN = db.and_(Job.kind == 'early_warning_scan', Job.status == 'running')
+RUNNING_SCAN_INDEX = db.Index('uq_job_running_early_warning_scan', Job.kind, unique=True,
+                              sqlite_where=_RUNNING_SCAN, postgresql_where=_RUNNING_SCAN)
+RUNNING_SCAN_INDEX.ddl_if(dialect=('sqlite', 'postgresql'))
+
+
+class ECLRecalculation(db.Model):
+    """Pending ECL recalculation of a loan. A loan is queued at most once until a worker claims it."""
+    id = db.Column(db.Integer, primary_key=True)
+    loan_id = db.Column(db.Integer, db.ForeignKey(Loan.id), nullable=False, index=True)
+    job_id = db.Column(db.Integer, db.ForeignKey(Job.id), nullable=False)
+    enqueued_at = db.Column(db.DateTime, nullable=False)
+    claimed_by = db.Column(db.String(50), nullable=True, index=True)
+    claimed_at = db.Column(db.DateTime, nullable=True)
+
+
+class ECLRecalculationWatcher(db.Model):
+    """Further job waiting for a queued recalculation: the loan was already queued when the job was created."""
+    recalculation_id = db.Column(db.Integer, db.ForeignKey(ECLRecalculation.id), primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey(Job.id), primary_key=True)
+
+
+class ScanWatermark(db.Model):
+    """Highest row id of a source table already processed by the early-warning scan."""
+    source = db.Column(db.String(50), primary_key=True)
+    last_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+
+class LoanMonitorState(db.Model):
+    """Figures of a loan at its last early-warning scan, the baseline of the next one."""
+    loan_id = db.Column(db.Integer, db.ForeignKey(Loan.id), primary_key=True)
+    max_days_late = db.Column(db.Integer)
+    ecl_value = db.Column(db.Float)
+    credit_score = db.Column(db.Float)
+    balance_to_collateral = db.Column(db.Float)
+    scanned_at = db.Column(db.DateTime, nullable=False)
+
+
+class EarlyWarningAlert(db.Model):
+    """A loan crossing an early-warning threshold, found by the scan of job_id."""
+    __table_args__ = (
+        db.Index('ix_early_warning_alert_rule_id', 'rule', 'id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey(Job.id), nullable=False)
+    loan_id = db.Column(db.Integer, db.ForeignKey(Loan.id), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey(User.id), nullable=False, index=True)
+    rule = db.Column(db.String(30), nullable=False)  # days_late, ecl_jump, credit_score_drop, balance_to_collateral
+    value = db.Column(db.Float)
+    previous_value = db.Column(db.Float)
+    threshold = db.Column(db.Float, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+
+
+class DataVersion(db.Model):
+    """Version counter per dataset, bumped on every change so all workers can drop their in-memory copies."""
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
@@ -0,0 +1,170 @@
+import logging
+import math
+
+from sqlalchemy import Date, Float, Integer, bindparam, case, delete, func, insert, or_, select, update
+
+from utils.extensions import db
+from server.models import Payment, LoanPaymentSummary, UserPaymentSummary
+
+SUMMARY_FIELDS = ('payment_count', 'late_count', 'missed_count', 'total_days_late', 'max_days_late',
+                  'last_payment_date', 'total_paid')
+SUMMARIES = (
+    (LoanPaymentSummary, 'loan_id'),
+    (UserPaymentSummary, 'user_id'),
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _empty_summary():
+    return {
+        'payment_count': 0,
+        'late_count': 0,
+        'missed_count': 0,
+        'total_days_late': 0,
+        'max_days_late': 0,
+        'last_payment_date': None,
+        'total_paid': 0.0
+    }
+
+
+def summarize_payments(payments, key):
+    """
+    Aggregates payment dicts into summary deltas keyed by `key` (loan_id or user_id).
+    """
+    deltas = {}
+    for payment in payments:
+        delta = deltas.setdefault(payment[key], _empty_summary())
+        days_late = payment.get('daysLate') or 0
+        delta['payment_count'] += 1
+        if payment.get('status') == 'late':
+            delta['late_count'] += 1
+            delta['total_days_late'] += days_late
+            delta['max_days_late'] = max(delta['max_days_late'], days_late)
+        elif payment.get('status') == 'missed':
+            delta['missed_count'] += 1
+        delta['total_paid'] += payment.get('amount') or 0
+        payment_date = payment.get('date')
+        if payment_date and (delta['last_payment_date'] is None or payment_date > delta['last_payment_date']):
+            delta['last_payment_date'] = payment_date
+    return deltas
+
+
+def _apply_deltas(model, key, deltas):
+    table = model.__table__
+    key_column = table.c[key]
+    existing = set(db.session.execute(select(key_column).where(key_column.in_(list(deltas)))).scalars())
+    missing = [{key: value, **_empty_summary()} for value in deltas if value not in existing]
+    if missing:
+        db.session.execute(insert(table), missing)
+
+    max_days_late = bindparam('d_max_days_late', type_=Integer)
+    last_payment_date = bindparam('d_last_payment_date', type_=Date)
+    statement = (
+        update(table)
+        .where(key_column == bindparam('d_key'))
+        .values(
+            payment_count=table.c.payment_count + bindparam('d_payment_count', type_=Integer),
+            late_count=table.c.late_count + bindparam('d_late_count', type_=Integer),
+            missed_count=table.c.missed_count + bindparam('d_missed_count', type_=Integer),
+            total_days_late=table.c.total_days_late + bindparam('d_total_days_late', type_=Integer),
+            max_days_late=case((table.c.max_days_late < max_days_late, max_days_late),
+                               else_=table.c.max_days_late),
+            last_payment_date=case((or_(table.c.last_payment_date.is_(None),
+                                        table.c.last_payment_date < last_payment_date), last_payment_date),
+                                   else_=table.c.last_payment_date),
+            total_paid=table.c.total_paid + bindparam('d_total_paid', type_=Float)
+        )
+    )
+    params = [{'d_key': value, **{f'd_{field}': delta[field] for field in SUMMARY_FIELDS}}
+              for value, delta in deltas.items()]
+    db.session.execute(statement, params)
+
+
+def apply_payments(payments):
+    """
+    Adds payment dicts to the loan and customer summaries with one UPDATE per summary row.
+    The caller commits, normally in the same transaction as the payment insert.
+    """
+    payments = list(payments)
+    if not payments:
+        return
+    for model, key in SUMMARIES:
+        _apply_deltas(model, key, summarize_payments(payments, key))
+
+
+def _aggregate_query(key_column):
+    days_late = func.coalesce(Payment.daysLate, 0)
+    return (
+        select(
+            key_column,
+            func.count(Payment.id),
+            func.sum(case((Payment.status == 'late', 1), else_=0)),
+            func.sum(case((Payment.status == 'missed', 1), else_=0)),
+            func.sum(case((Payment.status == 'late', days_late), else_=0)),
+            func.max(case((Payment.status == 'late', days_late), else_=0)),
+            func.max(Payment.date),
+            func.coalesce(func.sum(Payment.amount), 0)
+        )
+        .group_by(key_column)
+    )
+
+
+def rebuild_payment_summaries():
+    """
+    Recomputes both summary tables from the payments table. Returns the number of rows per table.
+    """
+    counts = {}
+    for model, key in SUMMARIES:
+        db.session.execute(delete(model))
+        db.session.execute(insert(model).from_select([key, *SUMMARY_FIELDS],
+                                                     _aggregate_query(getattr(Payment, key))))
+        counts[model.__tablename__] = db.session.query(func.count()).select_from(model).scalar()
+    db.session.commit()
+    return counts
+
+
+def backfill_payment_summaries():
+    """
+    Builds the payment summaries when they are empty but payments exist, i.e. on a database created before the
+    summary tables; the ECL inputs read them. Called at startup. Returns the rows per table, None when the
+    summaries were in place.
+    """
+    if db.session.query(LoanPaymentSummary.loan_id).first() is not None \
+            or db.session.query(Payment.id).first() is None:
+        return None
+    counts = rebuild_payment_summaries()
+    logger.info("Built the payment summaries from the payments table: %s", counts)
+    return counts
+
+
+def _same(expected, actual):
+    if expected is None or actual is None:
+        return expected == actual
+    for field, left, right in zip(SUMMARY_FIELDS, expected, actual):
+        if field == 'total_paid':
+            if not math.isclose(left or 0, right or 0, rel_tol=1e-9, abs_tol=1e-6):
+                return False
+        elif left != right:
+            return False
+    return True
+
+
+def check_payment_summaries():
+    """
+    Compares the summary tables with the payments table and returns every row that differs.
+    """
+    mismatches = []
+    for model, key in SUMMARIES:
+        expected = {row[0]: tuple(row[1:]) for row in db.session.execute(_aggregate_query(getattr(Payment, key)))}
+        columns = [getattr(model, field) for field in (key, *SUMMARY_FIELDS)]
+        actual = {row[0]: tuple(row[1:]) for row in db.session.execute(select(*columns))}
+        for value in expected.keys() | actual.keys():
+            if not _same(expected.get(value), actual.get(value)):
+                mismatches.append({
+                    'table': model.__tablename__,
+                    key: value,
+                    'expected': dict(zip(SUMMARY_FIELDS, expected[value])) if value in expected else None,
+                    'actual': dict(zip(SUMMARY_FIELDS, actual[value])) if value in actual else None
+                })
+    return mismatches
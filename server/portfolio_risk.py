@@ -0,0 +1,139 @@
+import os
+import time
+
+import numpy as np
+from flask import current_app, has_app_context
+from sqlalchemy import func
+
+from utils.extensions import db
+from utils.simulation import build_buckets, simulate_portfolio_loss
+from server.models import Loan, LoanCurrentECL, User
+from server.reference_data import get_reference_data
+
+DEFAULT_CORRELATION = 0.12
+MAX_SCENARIOS = 10_000_000
+# a simulation requested through the API holds its request worker until it finishes
+DEFAULT_API_MAX_SCENARIOS = 100_000
+DEFAULT_API_MAX_PROCESSES = 1
+
+
+class SimulationError(ValueError):
+    pass
+
+
+def load_exposures():
+    """
+    Loads PD, LGD and EAD of every loan from its current ECL, with the customer's industry (0 when none).
+    """
+    rows = (
+        db.session.query(
+            LoanCurrentECL.pd_value,
+            LoanCurrentECL.lgd_value,
+            LoanCurrentECL.ead_value,
+            func.coalesce(User.industry_id, 0)
+        )
+        .join(Loan, Loan.id == LoanCurrentECL.loan_id)
+        .join(User, User.id == Loan.user_id)
+        .filter(LoanCurrentECL.ead_value > 0)
+        .all()
+    )
+    columns = list(zip(*rows)) or [()] * 4
+    return {
+        "pd": np.array(columns[0], dtype=float),
+        "lgd": np.array(columns[1], dtype=float),
+        "ead": np.array(columns[2], dtype=float),
+        "industry_id": np.array(columns[3], dtype=np.int64)
+    }
+
+
+def max_processes():
+    return os.cpu_count() or 1
+
+
+def _setting(name, default):
+    """
+    App config value, else the environment variable of the same name, else the default.
+    """
+    if has_app_context() and current_app.config.get(name) is not None:
+        return int(current_app.config[name])
+    value = os.environ.get(name)
+    return int(value) if value not in (None, '') else default
+
+
+def check_api_limits(scenarios, processes):
+    """
+    Raises SimulationError when a simulation is too large to run inside a request: more scenarios than
+    SIMULATION_API_MAX_SCENARIOS or more processes than SIMULATION_API_MAX_PROCESSES (app config or environment).
+    Larger runs are left to the simulate-credit-loss command.
+    """
+    max_scenarios = _setting('SIMULATION_API_MAX_SCENARIOS', DEFAULT_API_MAX_SCENARIOS)
+    max_processes = _setting('SIMULATION_API_MAX_PROCESSES', DEFAULT_API_MAX_PROCESSES)
+    if scenarios > max_scenarios or processes > max_processes:
+        raise SimulationError(f"The API runs at most {max_scenarios} scenarios on {max_processes} processes; "
+                              f"run larger simulations with `flask simulate-credit-loss`.")
+
+
+def _validate(scenarios, confidence, correlations, processes):
+    if not 1 <= scenarios <= MAX_SCENARIOS:
+        raise SimulationError(f"scenarios must be between 1 and {MAX_SCENARIOS}.")
+    if not 0 < confidence < 1:
+        raise SimulationError("confidence must be between 0 and 1.")
+    for rho in correlations:
+        if not 0 < rho < 1:
+            raise SimulationError("correlations must be between 0 and 1.")
+    if not 1 <= processes <= max_processes():
+        raise SimulationError(f"processes must be between 1 and {max_processes()}.")
+
+
+def run_credit_loss_simulation(scenarios=100000, seed=0, confidence=0.999, default_correlation=DEFAULT_CORRELATION,
+                               correlations=None, processes=1):
+    """
+    Simulates the loss distribution of the book with a one-factor Vasicek model, drawing the default of every
+    loan in every scenario.
+    The asset correlation of a loan is the one given for its industry (correlations maps industry id to rho)
+    or default_correlation. Returns quantiles, VaR, expected shortfall and the contribution of every industry.
+    """
+    correlations = {int(key): float(value) for key, value in (correlations or {}).items()}
+    _validate(scenarios, confidence, [default_correlation, *correlations.values()], processes)
+    started = time.perf_counter()
+
+    exposures = load_exposures()
+    if not len(exposures["ead"]):
+        raise SimulationError("No loans with a calculated ECL to simulate.")
+    industry_ids = sorted(set(exposures["industry_id"].tolist()))
+    group = np.searchsorted(industry_ids, exposures["industry_id"])
+    rho = np.array([correlations.get(i, default_correlation) for i in industry_ids])[group]
+
+    buckets = build_buckets(exposures["pd"], exposures["lgd"], exposures["ead"], rho, group)
+    result = simulate_portfolio_loss(buckets, len(industry_ids), scenarios=scenarios, seed=seed,
+                                     confidence=confidence, processes=processes)
+
+    industries = get_reference_data().industries
+    exposure_by_group = np.bincount(group, weights=exposures["ead"], minlength=len(industry_ids))
+    expected_shortfall = result["expected_shortfall"] or 1
+    by_industry = [
+        {
+            "industry_id": industry_id or None,
+            "name": industries[industry_id].name if industry_id in industries else "N/A",
+            "exposure": float(exposure_by_group[index]),
+            "correlation": correlations.get(industry_id, default_correlation),
+            "expected_loss": float(result["expected_loss_by_group"][index]),
+            "expected_shortfall_contribution": float(result["tail_loss_by_group"][index]),
+            "expected_shortfall_share": float(result["tail_loss_by_group"][index] / expected_shortfall)
+        }
+        for index, industry_id in enumerate(industry_ids)
+    ]
+    return {
+        "loans": int(len(exposures["ead"])),
+        "buckets": int(len(buckets["group"])),
+        "scenarios": result["scenarios"],
+        "seed": seed,
+        "confidence": confidence,
+        "total_exposure": float(exposures["ead"].sum()),
+        "expected_loss": result["expected_loss"],
+        "value_at_risk": result["value_at_risk"],
+        "expected_shortfall": result["expected_shortfall"],
+        "quantiles": result["quantiles"],
+        "by_industry": by_industry,
+        "seconds": round(time.perf_counter() - started, 3)
+    }
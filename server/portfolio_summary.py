@@ -0,0 +1,257 @@
+"""
+Portfolio rollup: loans, exposure and current ECL per business industry, lending type and risk level.
+Every loan's contribution is kept in LoanPortfolioPosition; when loans, payments or ECL rows change, the
+affected positions are recomputed and the difference is added to the PortfolioRollup cells, in the same
+transaction as the change.
+"""
+import logging
+
+from sqlalchemy import Float, Integer, bindparam, case, delete, func, insert, literal, select, update
+from sqlalchemy.schema import CreateIndex
+
+from utils.calculations import RiskThresholdIndex, get_risk_index
+from utils.database import UPSERT_DIALECTS
+from utils.extensions import db
+from server.models import PORTFOLIO_ROLLUP_CELL, ECLThreshold, Loan, LoanCurrentECL, LoanPortfolioPosition, \
+    PortfolioRollup, User
+from server.reference_data import get_reference_data
+
+ROLLUP_FIELDS = ('loans', 'calculated_loans', 'exposure', 'ecl_amount')
+CELL_COLUMNS = ('industry_id', 'lending_type_id', 'risk_level')
+POSITION_COLUMNS = ('loan_id', *CELL_COLUMNS, 'exposure', 'ecl_amount')
+REFRESH_CHUNK_SIZE = 5000
+
+logger = logging.getLogger(__name__)
+
+
+def risk_level_case(value, risk_index):
+    """
+    SQL expression of risk_index.classify(value): one WHEN per threshold boundary.
+    """
+    whens = [(value < boundary, literal(level))
+             for boundary, level in zip(risk_index.boundaries, risk_index.levels)]
+    if not whens:
+        return literal(risk_index.levels[-1])
+    return case(*whens, else_=literal(risk_index.levels[-1]))
+
+
+def _load_risk_index():
+    # read in the caller's transaction, so a threshold change is seen before it is committed
+    return RiskThresholdIndex(db.session.query(ECLThreshold).all())
+
+
+def _positions(risk_index, condition=None):
+    """
+    Position of every loan matching the condition. Loans without an ECL are classified as 0%, as in the
+    loans listing, and only count as calculated once they have one.
+    """
+    statement = (
+        select(
+            Loan.id,
+            User.industry_id,
+            Loan.lending_type,
+            risk_level_case(func.coalesce(LoanCurrentECL.value, 0), risk_index),
+            func.coalesce(Loan.outstanding_balance, 0),
+            LoanCurrentECL.ecl_amount
+        )
+        .join(User, User.id == Loan.user_id)
+        .outerjoin(LoanCurrentECL, LoanCurrentECL.loan_id == Loan.id)
+    )
+    return statement.where(condition) if condition is not None else statement
+
+
+def _cells():
+    """
+    Rollup figures of positions, per cell.
+    """
+    return (
+        select(
+            LoanPortfolioPosition.industry_id,
+            LoanPortfolioPosition.lending_type_id,
+            LoanPortfolioPosition.risk_level,
+            func.count(),
+            func.count(LoanPortfolioPosition.ecl_amount),
+            func.sum(LoanPortfolioPosition.exposure),
+            func.coalesce(func.sum(LoanPortfolioPosition.ecl_amount), 0)
+        )
+        .group_by(LoanPortfolioPosition.industry_id, LoanPortfolioPosition.lending_type_id,
+                  LoanPortfolioPosition.risk_level)
+    )
+
+
+def _cell_totals(condition):
+    return {tuple(row[:3]): row[3:] for row in db.session.execute(_cells().where(condition))}
+
+
+def _upsert_deltas(dialect, deltas):
+    """
+    Adds the deltas to their cells, creating missing cells, in one ON CONFLICT statement, so concurrent
+    changes creating the same cell both land instead of one failing on the unique index.
+    """
+    table = PortfolioRollup.__table__
+    statement = UPSERT_DIALECTS[dialect](table)
+    statement = statement.on_conflict_do_update(
+        index_elements=list(PORTFOLIO_ROLLUP_CELL.expressions),
+        set_={field: table.c[field] + statement.excluded[field] for field in ROLLUP_FIELDS})
+    db.session.execute(statement, [dict(zip(CELL_COLUMNS + ROLLUP_FIELDS, cell + delta))
+                                   for cell, delta in deltas.items()])
+
+
+def _update_deltas(deltas):
+    cells = {tuple(row[1:]): row[0] for row in db.session.execute(
+        select(PortfolioRollup.id, PortfolioRollup.industry_id, PortfolioRollup.lending_type_id,
+               PortfolioRollup.risk_level))}
+    missing = [dict(zip(CELL_COLUMNS + ROLLUP_FIELDS, cell + delta))
+               for cell, delta in deltas.items() if cell not in cells]
+    if missing:
+        db.session.execute(insert(PortfolioRollup), missing)
+
+    table = PortfolioRollup.__table__
+    params = [{'d_id': cells[cell], **{f'd_{field}': value for field, value in zip(ROLLUP_FIELDS, delta)}}
+              for cell, delta in deltas.items() if cell in cells]
+    if params:
+        db.session.execute(
+            update(table)
+            .where(table.c.id == bindparam('d_id'))
+            .values(
+                loans=table.c.loans + bindparam('d_loans', type_=Integer),
+                calculated_loans=table.c.calculated_loans + bindparam('d_calculated_loans', type_=Integer),
+                exposure=table.c.exposure + bindparam('d_exposure', type_=Float),
+                ecl_amount=table.c.ecl_amount + bindparam('d_ecl_amount', type_=Float)
+            ),
+            params
+        )
+
+
+def _apply_deltas(deltas):
+    dialect = db.session.get_bind().dialect.name
+    if dialect in UPSERT_DIALECTS:
+        _upsert_deltas(dialect, deltas)
+    else:
+        _update_deltas(deltas)
+    if any(delta[0] < 0 for delta in deltas.values()):
+        # an emptied cell goes away, which also drops the rounding left behind by its increments
+        db.session.execute(delete(PortfolioRollup).where(PortfolioRollup.loans <= 0))
+
+
+def _refresh(condition, risk_index, affected=None):
+    if affected is None:
+        affected = LoanPortfolioPosition.loan_id.in_(select(Loan.id).where(condition))
+    before = _cell_totals(affected)
+    db.session.execute(delete(LoanPortfolioPosition).where(affected))
+    db.session.execute(insert(LoanPortfolioPosition).from_select(POSITION_COLUMNS, _positions(risk_index, condition)))
+    after = _cell_totals(affected)
+
+    deltas = {}
+    for cell in before.keys() | after.keys():
+        old = before.get(cell, (0, 0, 0.0, 0.0))
+        new = after.get(cell, (0, 0, 0.0, 0.0))
+        delta = tuple(n - o for n, o in zip(new, old))
+        if any(delta):
+            deltas[cell] = delta
+    if deltas:
+        _apply_deltas(deltas)
+
+
+def refresh_portfolio(condition):
+    """
+    Recomputes the positions of the loans matching the condition (e.g. Loan.id == loan_id) and moves the
+    difference into the rollup. The caller commits, normally together with the change.
+    """
+    _refresh(condition, get_risk_index())
+
+
+def refresh_loans(loan_ids):
+    """
+    refresh_portfolio for a collection of loan ids, REFRESH_CHUNK_SIZE loans per statement. The positions of
+    deleted loans are dropped.
+    """
+    loan_ids = list(loan_ids)
+    if not loan_ids:
+        return
+    risk_index = get_risk_index()
+    for start in range(0, len(loan_ids), REFRESH_CHUNK_SIZE):
+        chunk = loan_ids[start:start + REFRESH_CHUNK_SIZE]
+        _refresh(Loan.id.in_(chunk), risk_index, LoanPortfolioPosition.loan_id.in_(chunk))
+
+
+def init_portfolio_rollup():
+    """
+    Prepares the rollup at startup: creates the cell index on a database whose portfolio_rollup table predates
+    it (create_all only creates the indexes of new tables), and builds the positions and rollup when they are
+    empty but loans exist, since the incremental updates only add the loans they touch.
+    Returns the rebuild counts, None when the rollup was in place.
+    """
+    # checkfirst can't see expression indexes on SQLite
+    with db.engine.begin() as connection:
+        connection.execute(CreateIndex(PORTFOLIO_ROLLUP_CELL, if_not_exists=True))
+    if db.session.query(LoanPortfolioPosition.loan_id).first() is not None or db.session.query(Loan.id).first() is None:
+        return None
+    counts = rebuild_portfolio_summary()
+    logger.info("Built the portfolio rollup of %d loans", counts['loans'])
+    return counts
+
+
+def rebuild_portfolio_rollup():
+    """
+    Recomputes every position and rollup cell, e.g. after the ECL thresholds changed, with the thresholds
+    as they are in the current transaction. The caller commits.
+    """
+    db.session.execute(delete(LoanPortfolioPosition))
+    db.session.execute(insert(LoanPortfolioPosition).from_select(POSITION_COLUMNS, _positions(_load_risk_index())))
+    db.session.execute(delete(PortfolioRollup))
+    db.session.execute(insert(PortfolioRollup).from_select(CELL_COLUMNS + ROLLUP_FIELDS, _cells()))
+
+
+def rebuild_portfolio_summary():
+    """
+    Rebuilds the positions and the rollup from the loans. Returns the number of loans and rollup cells.
+    """
+    rebuild_portfolio_rollup()
+    db.session.commit()
+    return {
+        'loans': db.session.query(func.count(LoanPortfolioPosition.loan_id)).scalar(),
+        'cells': db.session.query(func.count(PortfolioRollup.id)).scalar()
+    }
+
+
+def _totals(**group):
+    return {**group, 'loans': 0, 'calculated_loans': 0, 'exposure': 0.0, 'ecl_amount': 0.0}
+
+
+def _add(totals, cell):
+    for field in ROLLUP_FIELDS:
+        totals[field] += getattr(cell, field)
+
+
+def _finish(totals):
+    # coverage ratio: ECL as a percentage of exposure, like the ECL value of a loan
+    totals['coverage_ratio'] = totals['ecl_amount'] / totals['exposure'] * 100 if totals['exposure'] else None
+    return totals
+
+
+def portfolio_summary():
+    """
+    Totals of the whole portfolio and per industry, lending type and risk level, read from the rollup cells.
+    """
+    reference = get_reference_data()
+    portfolio = _totals()
+    by_industry, by_lending_type, by_risk_level = {}, {}, {}
+    for cell in db.session.query(PortfolioRollup).order_by(PortfolioRollup.industry_id,
+                                                           PortfolioRollup.lending_type_id,
+                                                           PortfolioRollup.risk_level):
+        industry = reference.industry(cell.industry_id)
+        lending_type = reference.lending_type(cell.lending_type_id)
+        _add(portfolio, cell)
+        _add(by_industry.setdefault(cell.industry_id, _totals(
+            industry_id=cell.industry_id, industry=industry.name if industry else None)), cell)
+        _add(by_lending_type.setdefault(cell.lending_type_id, _totals(
+            lending_type_id=cell.lending_type_id, lending_type=lending_type.type if lending_type else None)), cell)
+        _add(by_risk_level.setdefault(cell.risk_level, _totals(risk_level=cell.risk_level)), cell)
+    return {
+        'totals': _finish(portfolio),
+        'by_industry': [_finish(totals) for totals in by_industry.values()],
+        'by_lending_type': [_finish(totals) for totals in by_lending_type.values()],
+        'by_risk_level': [_finish(totals) for totals in sorted(by_risk_level.values(),
+                                                              key=lambda totals: totals['risk_level'])]
+    }
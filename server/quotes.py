@@ -0,0 +1,138 @@
+"""
+What-if ECL quotes for prospective loans: the ECLCalculationApi formulas over request inputs only, without a
+Loan row and without writing anything.
+"""
+import numpy as np
+
+from utils.calculations import compute_ecl, get_risk_index
+from server.reference_data import get_reference_data
+
+MAX_QUOTES = 50_000
+
+# request field -> default when a row leaves it out (None: required)
+NUMERIC_FIELDS = {
+    'credit_score': None,
+    'yearInBusiness': 0,
+    'daysLate': 0,
+    'missed_payments': 0,
+    'latePayment': 0,
+    'collateral_value': None,
+    'outstanding_value': None,
+    'recovery_cost': 0,
+}
+
+
+class QuoteError(ValueError):
+    pass
+
+
+def _rows_to_columns(rows):
+    if not rows:
+        raise QuoteError("At least one quote is required.")
+    if not all(isinstance(row, dict) for row in rows):
+        raise QuoteError("Every quote must be an object.")
+    fields = list(NUMERIC_FIELDS) + ['lendingType', 'industry_name']
+    return {field: [row.get(field) for row in rows] for field in fields}
+
+
+def _numeric_column(name, values, size):
+    default = NUMERIC_FIELDS[name]
+    if values is None:
+        values = [default] * size
+    elif not isinstance(values, list) or len(values) != size:
+        raise QuoteError(f"{name} must be a list of {size} values.")
+    elif default is not None:
+        values = [default if value is None else value for value in values]
+    try:
+        column = np.array(values, dtype=float)
+    except (TypeError, ValueError):
+        column = None
+    if column is None or column.ndim != 1 or not np.isfinite(column).all():
+        index = next(i for i, value in enumerate(values)
+                     if isinstance(value, bool) or not isinstance(value, (int, float)) or not np.isfinite(value))
+        if values[index] is None:
+            raise QuoteError(f"Quote {index}: {name} is required.")
+        raise QuoteError(f"Quote {index}: {name} must be a number.")
+    return column
+
+
+def _name_column(name, values, size):
+    if values is None:
+        return [None] * size
+    if not isinstance(values, list) or len(values) != size:
+        raise QuoteError(f"{name} must be a list of {size} values.")
+    for index, value in enumerate(values):
+        if value is not None and not isinstance(value, str):
+            raise QuoteError(f"Quote {index}: {name} must be a string.")
+    return values
+
+
+def quote_inputs(payload):
+    """
+    Turns the request payload into input arrays. The payload is one quote (an object), a list of quotes, or
+    columns: an object of equally long lists under the same field names.
+    Returns the arrays and whether a single quote was asked for.
+    """
+    single = isinstance(payload, dict) and not isinstance(payload.get('credit_score'), list)
+    if single:
+        columns = _rows_to_columns([payload])
+    elif isinstance(payload, list):
+        columns = _rows_to_columns(payload)
+    elif isinstance(payload, dict):
+        columns = payload
+    else:
+        raise QuoteError("Expected a quote object, a list of quotes or an object of columns.")
+
+    size = len(columns['credit_score'])
+    if not 1 <= size <= MAX_QUOTES:
+        raise QuoteError(f"Between 1 and {MAX_QUOTES} quotes can be priced per request.")
+    inputs = {name: _numeric_column(name, columns.get(name), size) for name in NUMERIC_FIELDS}
+    bad_outstanding = np.flatnonzero(inputs['outstanding_value'] <= 0)
+    if len(bad_outstanding):
+        raise QuoteError(f"Quote {bad_outstanding[0]}: outstanding_value must be greater than 0.")
+
+    reference = get_reference_data()
+    lending_type_names = _name_column('lendingType', columns.get('lendingType'), size)
+    lending_types = {}
+    if None in lending_type_names:
+        raise QuoteError(f"Quote {lending_type_names.index(None)}: lendingType is required.")
+    for lending_type in set(lending_type_names):
+        factors = reference.lending_type_named(lending_type)
+        if factors is None:
+            raise QuoteError(f"Lending type {lending_type!r} doesn't exists.")
+        lending_types[lending_type] = (factors.pd_value, factors.lgd_value)
+    industry_names = _name_column('industry_name', columns.get('industry_name'), size)
+    industries = {}
+    for industry in set(industry_names):
+        industry_data = reference.industry_named(industry)
+        # unknown names and "N/A" are customers without an industry, as in ECLCalculationApi
+        industries[industry] = (industry_data.risk_factor or 0) if industry_data else 0
+
+    factors = np.array([lending_types[name] for name in lending_type_names], dtype=float)
+    inputs['pd_factor'] = factors[:, 0]
+    inputs['lgd_factor'] = factors[:, 1]
+    inputs['industry_risk'] = np.fromiter((industries[name] for name in industry_names), dtype=float, count=size)
+    return inputs, single
+
+
+def price_quotes(inputs):
+    """
+    Computes PD, LGD, EAD, ECL and the risk level of every quote in one vectorized pass.
+    """
+    pd, lgd, ead, ecl, ecl_ratio = compute_ecl(
+        inputs['credit_score'], inputs['missed_payments'], inputs['latePayment'], inputs['daysLate'],
+        inputs['industry_risk'], inputs['yearInBusiness'], inputs['pd_factor'], inputs['lgd_factor'],
+        inputs['collateral_value'], inputs['outstanding_value'], inputs['recovery_cost'])
+    risk = get_risk_index().classify_many(ecl_ratio).tolist()
+    return [
+        {
+            "ecl_amount": ecl_amount,
+            "ecl_percentage": ecl_percentage,
+            "risk": level + " risk",
+            "pd": pd_value,
+            "lgd": lgd_value,
+            "ead": ead_value
+        }
+        for ecl_amount, ecl_percentage, level, pd_value, lgd_value, ead_value in zip(
+            ecl.tolist(), ecl_ratio.tolist(), risk, pd.tolist(), lgd.tolist(), ead.tolist())
+    ]
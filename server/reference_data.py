@@ -0,0 +1,74 @@
+from collections import namedtuple
+
+import numpy as np
+
+from utils.extensions import db
+from utils.versioning import BUSINESS_INDUSTRIES, LENDING_TYPES, VersionedCache
+from server.models import BusinessIndustry, LendingType
+
+Industry = namedtuple('Industry', ['id', 'name', 'risk_factor'])
+LendingTypeFactors = namedtuple('LendingTypeFactors', ['id', 'type', 'pd_value', 'lgd_value'])
+
+
+class ReferenceData:
+    """
+    Snapshot of the business industries and lending types, looked up by id and by name/type.
+    Rows are plain tuples, so the snapshot can be shared between requests and threads.
+    When several rows have the same name the one with the lowest id is returned, as .first() did.
+    """
+
+    def __init__(self, industries, lending_types):
+        self.industries = {industry.id: industry for industry in industries}
+        self.lending_types = {lending_type.id: lending_type for lending_type in lending_types}
+        self._industries_by_name = {}
+        for industry in industries:
+            self._industries_by_name.setdefault(industry.name, industry)
+        self._lending_types_by_type = {}
+        for lending_type in lending_types:
+            self._lending_types_by_type.setdefault(lending_type.type, lending_type)
+
+    def industry(self, industry_id):
+        return self.industries.get(industry_id)
+
+    def industry_named(self, name):
+        return self._industries_by_name.get(name)
+
+    def lending_type(self, type_id):
+        return self.lending_types.get(type_id)
+
+    def lending_type_named(self, type_name):
+        return self._lending_types_by_type.get(type_name)
+
+    def industry_risks(self, industry_ids):
+        """
+        Risk factor of every industry id as an array, 0 for customers without (a known) industry.
+        """
+        return np.fromiter(
+            ((self.industries[i].risk_factor or 0) if i in self.industries else 0 for i in industry_ids),
+            dtype=float, count=len(industry_ids))
+
+    def lending_type_factors(self, type_ids):
+        """
+        (pd_value, lgd_value) arrays of the lending type ids, NaN for unset values.
+        """
+        factors = [self.lending_types[i] for i in type_ids]
+        return (np.array([f.pd_value for f in factors], dtype=float),
+                np.array([f.lgd_value for f in factors], dtype=float))
+
+
+def _load_reference_data():
+    industries = [Industry(*row) for row in db.session.query(
+        BusinessIndustry.id, BusinessIndustry.name, BusinessIndustry.risk_factor).order_by(BusinessIndustry.id)]
+    lending_types = [LendingTypeFactors(*row) for row in db.session.query(
+        LendingType.id, LendingType.type, LendingType.pd_value, LendingType.lgd_value).order_by(LendingType.id)]
+    return ReferenceData(industries, lending_types)
+
+
+_reference_data = VersionedCache([BUSINESS_INDUSTRIES, LENDING_TYPES], _load_reference_data)
+
+
+def get_reference_data():
+    """
+    Returns this process's snapshot of the industries and lending types, reloaded after they changed.
+    """
+    return _reference_data.get()
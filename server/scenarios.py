@@ -0,0 +1,95 @@
+import numpy as np
+from sqlalchemy import insert
+
+from utils.calculations import weighted_scenario_ecl
+from utils.extensions import db
+from server.models import ECLScenario, ECLScenarioResult
+
+
+class ScenarioError(ValueError):
+    pass
+
+
+def load_scenarios():
+    """
+    Returns the scenarios with a positive weight, overlays included.
+    """
+    scenarios = db.session.query(ECLScenario).filter(ECLScenario.weight > 0).order_by(ECLScenario.id).all()
+    if not scenarios:
+        raise ScenarioError("No ECL scenarios with a positive weight are defined.")
+    return scenarios
+
+
+def build_multipliers(inputs, scenarios):
+    """
+    Builds the (loans x scenarios) PD and LGD multiplier matrices from the scenario multipliers and
+    their industry / lending type overlays.
+    """
+    loans = len(inputs["loan_id"])
+    pd_multipliers = np.tile(np.array([s.pd_multiplier for s in scenarios], dtype=float), (loans, 1))
+    lgd_multipliers = np.tile(np.array([s.lgd_multiplier for s in scenarios], dtype=float), (loans, 1))
+    for column, scenario in enumerate(scenarios):
+        for overlay in scenario.overlays:
+            mask = np.ones(loans, dtype=bool)
+            if overlay.industry_id is not None:
+                mask &= inputs["industry_id"] == overlay.industry_id
+            if overlay.lending_type_id is not None:
+                mask &= inputs["lending_type_id"] == overlay.lending_type_id
+            pd_multipliers[mask, column] *= overlay.pd_multiplier
+            lgd_multipliers[mask, column] *= overlay.lgd_multiplier
+    return pd_multipliers, lgd_multipliers
+
+
+def calculate_scenarios(inputs, results, scenarios):
+    """
+    Evaluates the base results under every scenario in one vectorized pass.
+    "weighted" holds results shaped like calculate_portfolio's with the probability-weighted figures.
+    """
+    pd_multipliers, lgd_multipliers = build_multipliers(inputs, scenarios)
+    weights = [s.weight for s in scenarios]
+    scenario_pd, scenario_lgd, scenario_ecl, pd, lgd, ecl = weighted_scenario_ecl(
+        results["pd"], results["lgd"], results["ead"], pd_multipliers, lgd_multipliers, weights)
+    ead = results["ead"]
+    return {
+        "scenarios": scenarios,
+        "pd": scenario_pd,
+        "lgd": scenario_lgd,
+        "ecl_amount": scenario_ecl,
+        "weighted": {
+            "loan_id": results["loan_id"],
+            "pd": pd,
+            "lgd": lgd,
+            "ead": ead,
+            "ecl_amount": ecl,
+            "ecl_percentage": (ecl / ead) * 100
+        }
+    }
+
+
+def save_scenario_results(ecl_ids, scenario_results, chunk_size=10000):
+    """
+    Stores the per-scenario figures of every loan next to its weighted ECLData row.
+    """
+    scenario_ids = [s.id for s in scenario_results["scenarios"]]
+    pd, lgd, ecl = (scenario_results[key].tolist() for key in ("pd", "lgd", "ecl_amount"))
+    rows = [
+        {
+            "ecl_data_id": ecl_id,
+            "scenario_id": scenario_id,
+            "pd_value": pd[row][column],
+            "lgd_value": lgd[row][column],
+            "ecl_amount": ecl[row][column]
+        }
+        for row, ecl_id in enumerate(ecl_ids)
+        for column, scenario_id in enumerate(scenario_ids)
+    ]
+    for start in range(0, len(rows), chunk_size):
+        db.session.execute(insert(ECLScenarioResult), rows[start:start + chunk_size])
+
+
+def scenario_summary(scenario_results):
+    totals = scenario_results["ecl_amount"].sum(axis=0)
+    return [
+        {"id": s.id, "name": s.name, "weight": s.weight, "total_ecl_amount": float(total)}
+        for s, total in zip(scenario_results["scenarios"], totals)
+    ]
@@ -0,0 +1,251 @@
+"""
+Deterministic synthetic data for load testing: reference data, customers with CIB scores, loans, payment
+histories and optionally ECL history, written with bulk Core inserts.
+"""
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import event, func, insert
+
+from utils.extensions import db
+from utils.versioning import BUSINESS_INDUSTRIES, ECL_THRESHOLDS, LENDING_TYPES, bump_version
+from server.ecl_store import refresh_current_ecl
+from server.payment_summary import rebuild_payment_summaries
+from server.portfolio_summary import rebuild_portfolio_summary
+from server.models import BusinessIndustry, LendingType, ECLThreshold, User, CIBData, Loan, Payment, ECLData
+
+LOANS_PER_CUSTOMER = 4
+CHUNK_SIZE = 50_000
+TRANSACTION_ROWS = 1_000_000
+INDUSTRIES = ('retail', 'agriculture', 'manufacturing', 'construction', 'hospitality', 'transport', 'energy',
+              'health', 'technology', 'trading')
+LENDING_TYPES_SEED = (('personal', 0.05, 0.45), ('sme', 0.08, 0.5), ('mortgage', 0.03, 0.25),
+                      ('overdraft', 0.12, 0.6))
+THRESHOLDS = ((None, 2, 'low'), (2, 5, 'medium'), (5, None, 'high'))
+LOAN_TERMS = (12, 24, 36, 60, 120, 240)
+PAYMENT_STATUSES = np.array(['paid', 'late', 'missed'])
+
+
+class _Writer:
+    """
+    Inserts rows given as column lists and commits every TRANSACTION_ROWS rows.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.pending = 0
+
+    def insert(self, model, columns):
+        keys = list(columns)
+        values = [column.tolist() if isinstance(column, np.ndarray) else column for column in columns.values()]
+        rows = [dict(zip(keys, row)) for row in zip(*values)]
+        if not rows:
+            return
+        db.session.execute(insert(model), rows)
+        self.rows += len(rows)
+        self.pending += len(rows)
+        if self.pending >= TRANSACTION_ROWS:
+            db.session.commit()
+            self.pending = 0
+
+
+def _synchronous_off(dbapi_connection, connection_record, connection_proxy):
+    dbapi_connection.execute('PRAGMA synchronous=OFF')
+
+
+def _synchronous_normal(dbapi_connection, connection_record):
+    if dbapi_connection is not None:
+        dbapi_connection.execute('PRAGMA synchronous=NORMAL')
+
+
+@contextmanager
+def relaxed_durability():
+    """
+    Turns off fsync on SQLite while the load runs (a crash loses the seed, not the database). Every connection
+    checked out meanwhile gets synchronous=OFF and is put back to NORMAL when it returns to the pool.
+    Other databases are left as they are.
+    """
+    engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        yield
+        return
+    event.listen(engine, 'checkout', _synchronous_off)
+    event.listen(engine, 'checkin', _synchronous_normal)
+    try:
+        yield
+    finally:
+        db.session.commit()
+        db.session.close()
+        event.remove(engine, 'checkout', _synchronous_off)
+        event.remove(engine, 'checkin', _synchronous_normal)
+
+
+def _next_id(model):
+    return (db.session.query(func.max(model.id)).scalar() or 0) + 1
+
+
+def _seed_reference_data(writer, now):
+    """
+    Adds industries, lending types and thresholds when their tables are empty and returns the ids to use.
+    """
+    if not db.session.query(BusinessIndustry.id).first():
+        writer.insert(BusinessIndustry, {
+            'name': list(INDUSTRIES),
+            'risk_factor': [round(0.05 + 0.05 * (i % 8), 2) for i in range(len(INDUSTRIES))],
+            'created_at': [now] * len(INDUSTRIES)
+        })
+        bump_version(BUSINESS_INDUSTRIES)
+    if not db.session.query(LendingType.id).first():
+        writer.insert(LendingType, {
+            'type': [name for name, _, _ in LENDING_TYPES_SEED],
+            'pd_value': [pd for _, pd, _ in LENDING_TYPES_SEED],
+            'lgd_value': [lgd for _, _, lgd in LENDING_TYPES_SEED]
+        })
+        bump_version(LENDING_TYPES)
+    if not db.session.query(ECLThreshold.id).first():
+        writer.insert(ECLThreshold, {
+            'min_value': [low for low, _, _ in THRESHOLDS],
+            'max_value': [high for _, high, _ in THRESHOLDS],
+            'level': [level for _, _, level in THRESHOLDS]
+        })
+        bump_version(ECL_THRESHOLDS)
+    industry_ids = [row[0] for row in db.session.query(BusinessIndustry.id).order_by(BusinessIndustry.id)]
+    lending_type_ids = [row[0] for row in db.session.query(LendingType.id).order_by(LendingType.id)]
+    return np.array(industry_ids), np.array(lending_type_ids)
+
+
+def _seed_customers(writer, rng, customers, industry_ids, today):
+    first_id = _next_id(User)
+    ids = np.arange(first_id, first_id + customers)
+    has_industry = rng.random(customers) < 0.7
+    industries = np.where(has_industry, industry_ids[rng.integers(0, len(industry_ids), customers)], 0)
+    estd = np.datetime64(today) - rng.integers(180, 30 * 365, customers).astype('timedelta64[D]')
+    writer.insert(User, {
+        'id': ids,
+        'name': [f'Customer {i}' for i in ids.tolist()],
+        'email': [f'customer{i}@example.com' for i in ids.tolist()],
+        'phone_number': 9000000000 + ids,
+        'estd_date': estd.astype(object).tolist(),
+        'monthly_income': (rng.lognormal(11, 0.8, customers)).round(-2),
+        'employment_status': rng.choice(['employed', 'self-employed', 'business'], customers),
+        'user_type': np.where(has_industry, 'Corporate', 'Individual'),
+        'industry_id': [int(i) or None for i in industries.tolist()]
+    })
+    scores = np.clip(rng.normal(650, 90, customers), 300, 850).round()
+    writer.insert(CIBData, {'user_id': ids, 'credit_score': scores})
+    return ids, scores
+
+
+def _seed_loans(writer, rng, loans, customer_ids, lending_type_ids, now):
+    first_id = _next_id(Loan)
+    ids = np.arange(first_id, first_id + loans)
+    owner = rng.integers(0, len(customer_ids), loans)
+    amounts = (rng.lognormal(11.5, 1, loans)).round(-3).clip(1000)
+    terms = rng.choice(LOAN_TERMS, loans)
+    rates = rng.uniform(4, 18, loans).round(2)
+    age_months = rng.integers(0, 60, loans)
+    paid_share = np.minimum(age_months / terms, 1) * rng.uniform(0.6, 1, loans)
+    writer.insert(Loan, {
+        'id': ids,
+        'loan_name': [f'Loan {i}' for i in ids.tolist()],
+        'user_id': customer_ids[owner],
+        'loan_term': terms,
+        'loan_amount': amounts,
+        'lending_type': lending_type_ids[rng.integers(0, len(lending_type_ids), loans)],
+        'interest_rate': rates,
+        'collateral_value': (amounts * rng.uniform(0.2, 1.6, loans)).round(2),
+        'outstanding_balance': (amounts * (1 - paid_share)).round(2),
+        'created_at': [now - timedelta(days=30 * int(m)) for m in age_months.tolist()]
+    })
+    return ids, owner, amounts, terms, rates, age_months
+
+
+def _seed_payments(writer, rng, loan_ids, customer_ids, owner, scores, amounts, terms, rates, age_months,
+                   payments_per_loan, today):
+    """
+    Monthly installments since each loan started (at most payments_per_loan). Customers with lower credit scores
+    pay late or miss more often; days late follow a long-tailed gamma distribution.
+    """
+    monthly_rate = rates / 1200
+    installment = amounts * monthly_rate / (1 - (1 + monthly_rate) ** -terms)
+    late_probability = np.clip(0.03 + (700 - scores[owner]) / 1200, 0.01, 0.45)
+    counts = np.minimum(age_months, payments_per_loan)
+    today = np.datetime64(today)
+    for start in range(0, len(loan_ids), CHUNK_SIZE):
+        part = slice(start, start + CHUNK_SIZE)
+        repeats = counts[part]
+        loans = np.repeat(np.arange(start, start + len(repeats)), repeats)
+        if not len(loans):
+            continue
+        # month index of every payment, counted back from today
+        month = np.arange(len(loans)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+        draw = rng.random(len(loans))
+        missed = draw < late_probability[loans] / 4
+        late = ~missed & (draw < late_probability[loans] * 1.25)
+        days_late = np.where(late, np.minimum(1 + rng.gamma(1.5, 8, len(loans)), 120).astype(np.int64), 0)
+        paid_on = today - (30 * (counts[loans] - month)).astype('timedelta64[D]') + days_late.astype('timedelta64[D]')
+        writer.insert(Payment, {
+            'user_id': customer_ids[owner[loans]],
+            'loan_id': loan_ids[loans],
+            'date': paid_on.astype(object).tolist(),
+            'amount': np.where(missed, 0, installment[loans]).round(2),
+            'status': PAYMENT_STATUSES[np.where(missed, 2, np.where(late, 1, 0))],
+            'daysLate': days_late
+        })
+
+
+def _seed_ecl_history(writer, rng, loan_ids, ecl_history, now):
+    outstanding = np.array([row[0] or 0 for row in db.session.query(Loan.outstanding_balance)
+                            .filter(Loan.id >= int(loan_ids[0])).order_by(Loan.id)], dtype=float)
+    for run in range(ecl_history):
+        created = now - timedelta(days=30 * (ecl_history - run))
+        for start in range(0, len(loan_ids), CHUNK_SIZE):
+            part = slice(start, start + CHUNK_SIZE)
+            size = len(loan_ids[part])
+            pd = rng.uniform(0.01, 0.3, size)
+            lgd = rng.uniform(0.1, 0.8, size)
+            writer.insert(ECLData, {
+                'loan_id': loan_ids[part],
+                'value': pd * lgd * 100,
+                'ecl_amount': pd * lgd * outstanding[part],
+                'pd_value': pd,
+                'lgd_value': lgd,
+                'ead_value': outstanding[part],
+                'created_at': [created] * size,
+                'updated_at': [created] * size
+            })
+
+
+def seed_portfolio(loans, customers=None, payments_per_loan=12, ecl_history=0, seed=0, now=None):
+    """
+    Appends a synthetic portfolio of `loans` loans to the database. Industries, lending types and thresholds are
+    only created when their tables are empty. The same arguments on the same database give the same rows.
+    Returns the number of rows written per table.
+    """
+    rng = np.random.default_rng(seed)
+    now = now or datetime(2024, 6, 30, 12, 0)
+    today = now.date()
+    customers = customers or max(1, loans // LOANS_PER_CUSTOMER)
+    writer = _Writer()
+    counts = {}
+    with relaxed_durability():
+        industry_ids, lending_type_ids = _seed_reference_data(writer, now)
+        customer_ids, scores = _seed_customers(writer, rng, customers, industry_ids, today)
+        counts['customers'] = customers
+        loan_ids, owner, amounts, terms, rates, age_months = _seed_loans(
+            writer, rng, loans, customer_ids, lending_type_ids, now)
+        counts['loans'] = loans
+        before = writer.rows
+        _seed_payments(writer, rng, loan_ids, customer_ids, owner, scores, amounts, terms, rates, age_months,
+                       payments_per_loan, today)
+        counts['payments'] = writer.rows - before
+        if ecl_history:
+            before = writer.rows
+            _seed_ecl_history(writer, rng, loan_ids, ecl_history, now)
+            counts['ecl_data'] = writer.rows - before
+            refresh_current_ecl()
+        db.session.commit()
+    rebuild_payment_summaries()
+    rebuild_portfolio_summary()
+    return counts
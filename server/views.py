@@ -2,20 +2,52 @@ from datetime import datetime, date
 from operator import and_
 
 from flask.views import MethodView
-from flask import request
+from flask import request, Response
 from marshmallow import ValidationError
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy import func, literal
-from sqlalchemy.orm import aliased
+from sqlalchemy import literal
 from dateutil.relativedelta import relativedelta
 
-from utils.calculations import get_risk_level
+from utils.calculations import get_risk_level, get_risk_index, compute_ecl
+from server.batch import run_ecl_batch
+from server.scenarios import ScenarioError
+from server.portfolio_risk import DEFAULT_CORRELATION, SimulationError, check_api_limits, \
+    run_credit_loss_simulation
+from server.ecl_store import ecl_row, record_ecl
+from server.ecl_writer import BufferFull, get_write_buffer
+from server.quotes import QuoteError, price_quotes, quote_inputs
+from server.ecl_history import INTERVALS, HistoryError, loan_history, parse_day, portfolio_history
+from server.reference_data import get_reference_data
+from server.listings import CUSTOMER_SORT_FIELDS, customer_listing, customer_rows, cib_listing, loan_listing, \
+    loan_rows, payment_listing, reference_listing
+from server.payment_summary import apply_payments
+from server.portfolio_summary import portfolio_summary, rebuild_portfolio_rollup, refresh_portfolio
+from server.early_warning import RULES, ScanInProgress, alert_listing, run_early_warning_scan
+from server.jobs import enqueue_recalculation, industry_loans
+from server.imports import get_chunk_size, is_dry_run, read_records, import_payments, import_customers, \
+    import_loans
 from utils.extensions import db
-from server.models import BusinessIndustry, User, CIBData, Loan, Payment, LendingType, ECLData, \
-    ECLThreshold
+from server.models import BusinessIndustry, User, CIBData, Loan, Payment, LendingType, ECLThreshold, \
+    LoanPaymentSummary, Job, ECLScenario, ECLScenarioOverlay, EarlyWarningAlert
 from utils.response import success_response, server_error, list_response, validation_error, not_found_error, \
-    detail_response, bad_request_error
-from utils.validators import CustomerSchema, LoanSchema
+    detail_response, bad_request_error, conflict_error, service_unavailable, iter_chunks, STREAM_CHUNK_SIZE
+from utils.versioning import ECL_THRESHOLDS, BUSINESS_INDUSTRIES, LENDING_TYPES, bump_version
+from utils.http_cache import versioned_list_response
+from utils.database import pool_status
+from utils.instrumentation import metrics
+from utils.pagination import PaginationError, keyset_paginate, parse_limit
+from utils.validators import CustomerSchema, LoanSchema, PaymentSchema, ScenarioSchema
+
+
+def _stream_rows(statement):
+    """
+    Runs a listing statement, fetching the rows in chunks of the streaming size.
+    """
+    return db.session.execute(statement.execution_options(yield_per=STREAM_CHUNK_SIZE))
+
+
+def _reference_rows(name):
+    return lambda: _stream_rows(reference_listing(name)).scalars()
 
 
 class BusinessIndustryApi(MethodView):
@@ -24,6 +56,7 @@ class BusinessIndustryApi(MethodView):
         try:
             data_obj = BusinessIndustry(**data)
             db.session.add(data_obj)
+            bump_version(BUSINESS_INDUSTRIES)
             db.session.commit()
         except SQLAlchemyError as e:
             db.session.rollback()
@@ -33,8 +66,7 @@ class BusinessIndustryApi(MethodView):
             return success_response("Data uploaded successfully")
 
     def get(self):
-        data = db.session.query(BusinessIndustry).all()
-        return list_response(data)
+        return versioned_list_response(BUSINESS_INDUSTRIES, _reference_rows(BUSINESS_INDUSTRIES))
 
     def put(self):
         industry_id = request.args.get('id')
@@ -45,6 +77,10 @@ class BusinessIndustryApi(MethodView):
         try:
             for key, value in data.items():
                 setattr(business_industry, key, value)
+            if 'risk_factor' in data:
+                enqueue_recalculation(f"Business industry {industry_id} risk factor changed",
+                                      industry_loans(business_industry.id))
+            bump_version(BUSINESS_INDUSTRIES)
             db.session.commit()
         except SQLAlchemyError as e:
             db.session.rollback()
@@ -76,7 +112,7 @@ class UserListApi(MethodView):
             return validation_error(err)
 
         email = data.get('email')
-        email_exists = user.filter_by(email=email).first()
+        email_exists = email and user.filter_by(email=email).first()
         if email_exists:
             return bad_request_error("Email already in use")
 
@@ -96,53 +132,30 @@ class UserListApi(MethodView):
             return success_response("New Customer created successfully")
 
     def get(self):
-        customers = (
-            db.session.query(User)
-            .outerjoin(Loan, Loan.user_id == User.id)
-            .outerjoin(ECLData, ECLData.loan_id == Loan.id)
-            .outerjoin(BusinessIndustry, BusinessIndustry.id == User.industry_id)
-            .group_by(User.id).with_entities(User.id,
-                User.name.label('name'),
-                User.email,
-                User.phone_number,
-                User.estd_date,
-                User.monthly_income,
-                User.employment_status,
-                User.user_type,
-                BusinessIndustry.name.label('business_name'),
-                BusinessIndustry.risk_factor.label('risk_factor'),
-                # func.count(Loan.id).label("total_loans"),
-                func.avg(ECLData.value).label("average_ecl")
-                )
-            .all()
-        )
-        customer_data = []
-        for user in customers:
-            avg_ecl_query = (
-                db.session.query(func.avg(ECLData.value))
-                .join(Loan, Loan.id == ECLData.loan_id)
-                .join(User, User.id == Loan.user_id)
-                .filter(User.id == user.id)
-            )
-
-            avg_ecl_value = avg_ecl_query.scalar()
-            data = {
-                'id': user.id,
-                'name': user.name,
-                'email': user.email,
-                'phone_number': user.phone_number,
-                'estd_date': user.estd_date,
-                'monthly_income': user.monthly_income,
-                'employment_status': user.employment_status,
-                'user_type': user.user_type,
-                'business_name': user.business_name,
-                'risk_factor': user.risk_factor,
-                'total_loans': db.session.query(Loan).filter_by(user_id=user.id).count(),
-                'average_ecl': avg_ecl_value,
-                'risk': get_risk_level(user.average_ecl) if user.average_ecl else get_risk_level(0)
-            }
-            customer_data.append(data)
-        return list_response(customer_data)
+        sort = request.args.get('sort', 'id')
+        order = request.args.get('order', 'asc')
+        if sort not in CUSTOMER_SORT_FIELDS:
+            return bad_request_error(f"sort must be one of: {', '.join(CUSTOMER_SORT_FIELDS)}.")
+        if order not in ('asc', 'desc'):
+            return bad_request_error("order must be asc or desc.")
+
+        customers, sort_key = customer_listing(sort)
+        try:
+            limit = parse_limit(request.args.get('limit'))
+            customers, next_cursor = keyset_paginate(customers, sort_key, User.id, descending=order == 'desc',
+                                                     limit=limit, cursor=request.args.get('cursor'),
+                                                     session=db.session)
+        except PaginationError as e:
+            return bad_request_error(str(e))
+        if not limit:
+            customers = _stream_rows(customers)
+
+        return list_response(self._serialize(customers), next_cursor=next_cursor)
+
+    @staticmethod
+    def _serialize(customers):
+        for chunk in iter_chunks(customers):
+            yield from customer_rows(chunk, get_risk_index())
 
     def put(self):
         user_id = request.args.get('id')
@@ -166,6 +179,8 @@ class UserListApi(MethodView):
         try:
             for key, value in data.items():
                 setattr(user, key, value)
+            if 'industry_id' in data:
+                refresh_portfolio(Loan.user_id == user.id)
             db.session.commit()
         except SQLAlchemyError as e:
             db.session.rollback()
@@ -201,6 +216,8 @@ class RiskThresholdApi(MethodView):
                 data_obj = ECLThreshold(**d)
                 data_objs.append(data_obj)
             db.session.bulk_save_objects(data_objs)
+            bump_version(ECL_THRESHOLDS)
+            rebuild_portfolio_rollup()
             db.session.commit()
         except SQLAlchemyError as e:
             db.session.rollback()
@@ -210,8 +227,7 @@ class RiskThresholdApi(MethodView):
             return success_response("ECL thresholds set successfully")
 
     def get(self):
-        threshold = db.session.query(ECLThreshold).all()
-        return list_response(threshold)
+        return versioned_list_response(ECL_THRESHOLDS, _reference_rows(ECL_THRESHOLDS))
 
     def put(self):
         data = request.get_json()
@@ -223,6 +239,8 @@ class RiskThresholdApi(MethodView):
                     return not_found_error("ECL threshold parameter doesn't exists.")
                 for key, value in d.items():
                     setattr(threshold, key, value)
+            bump_version(ECL_THRESHOLDS)
+            rebuild_portfolio_rollup()
             db.session.commit()
         except SQLAlchemyError as e:
             db.session.rollback()
@@ -290,10 +308,7 @@ class RiskThresholdApi(MethodView):
 class FetchCIBData(MethodView):
     def get(self):
         user_id = request.args.get('user_id')
-        cib_data = (db.session.query(CIBData)
-                    .join(User, User.id == CIBData.user_id)
-                    .with_entities(CIBData.id, CIBData.credit_score, User.name, User.id.label('user_id'))).all()
-        return list_response(cib_data)
+        return list_response(_stream_rows(cib_listing()))
 
     def post(self):
         data = request.get_json()
@@ -305,6 +320,7 @@ class FetchCIBData(MethodView):
                 credit_score=credit_score
             )
             db.session.add(data_obj)
+            enqueue_recalculation(f"CIB data added for user {user_id}", Loan.user_id == user_id)
             db.session.commit()
         except SQLAlchemyError as e:
             db.session.rollback()
@@ -323,6 +339,7 @@ class FetchCIBData(MethodView):
             return not_found_error("CIB data not found for the user.")
         try:
             cib_data.credit_score = credit_score
+            enqueue_recalculation(f"CIB data updated for user {cib_data.user_id}", Loan.user_id == cib_data.user_id)
             db.session.commit()
         except SQLAlchemyError as e:
             db.session.rollback()
@@ -343,6 +360,7 @@ class LendingTypeAPI(MethodView):
         try:
             data_obj = LendingType(**data)
             db.session.add(data_obj)
+            bump_version(LENDING_TYPES)
             db.session.commit()
         except SQLAlchemyError as e:
             db.session.rollback()
@@ -352,8 +370,7 @@ class LendingTypeAPI(MethodView):
             return success_response("Lending type created successfully")
 
     def get(self):
-        lending_types = db.session.query(LendingType).all()
-        return list_response(lending_types)
+        return versioned_list_response(LENDING_TYPES, _reference_rows(LENDING_TYPES))
 
     def put(self):
         type_id = request.args.get('id')
@@ -364,6 +381,9 @@ class LendingTypeAPI(MethodView):
         try:
             for key, value in data.items():
                 setattr(lending_type, key, value)
+            if 'pd_value' in data or 'lgd_value' in data:
+                enqueue_recalculation(f"Lending type {type_id} factors changed", Loan.lending_type == lending_type.id)
+            bump_version(LENDING_TYPES)
             db.session.commit()
         except SQLAlchemyError as e:
             db.session.rollback()
@@ -399,6 +419,8 @@ class CustomerLoanApi(MethodView):
         try:
             data_obj = Loan(**validated_data)
             db.session.add(data_obj)
+            db.session.flush()
+            refresh_portfolio(Loan.id == data_obj.id)
             db.session.commit()
         except SQLAlchemyError as e:
             db.session.rollback()
@@ -410,70 +432,13 @@ class CustomerLoanApi(MethodView):
     def get(self):
         user_id = request.args.get('user_id')
 
-        # Subquery to get max ID per loan_id
-        latest_ecl_subquery = (
-            db.session.query(
-                ECLData.loan_id,
-                func.max(ECLData.id).label('latest_id')
-            )
-            .group_by(ECLData.loan_id)
-            .subquery()
-        )
-
-        # Alias for joining with ECLData again
-        ECLLatest = aliased(ECLData)
-
-        # Final query: join Loan, User, and latest ECL row
-        loan_data = (
-            db.session.query(
-                Loan.id,
-                Loan.loan_name,
-                Loan.user_id,
-                Loan.loan_amount,
-                Loan.outstanding_balance,
-                Loan.loan_term,
-                Loan.interest_rate,
-                Loan.collateral_value,
-                Loan.lending_type,
-                User.name,
-                ECLLatest.value,
-                ECLLatest.ecl_amount,
-                ECLLatest.updated_at
-            )
-            .join(User, User.id == Loan.user_id)
-            .outerjoin(
-                latest_ecl_subquery,
-                Loan.id == latest_ecl_subquery.c.loan_id
-            )
-            .outerjoin(
-                ECLLatest,
-                ECLLatest.id == latest_ecl_subquery.c.latest_id
-            )
-        )
-        if user_id:
-            loan_data = loan_data.filter(Loan.user_id == user_id)
-        loan_data = loan_data.all()
-        result = []
-        for loan in loan_data:
-            data = {
-                "id": loan.id,
-                "loan_name": loan.loan_name,
-                "user_id": loan.user_id,
-                "loan_amount": loan.loan_amount,
-                "outstanding_balance": loan.outstanding_balance,
-                "loan_term": loan.loan_term,
-                "interest_rate": loan.interest_rate,
-                "collateral_value": loan.collateral_value,
-                "lending_type": loan.lending_type,
-                "name": loan.name,
-                "value": loan.value,
-                "ecl_amount": loan.ecl_amount,
-                "updated_at": loan.updated_at,
-                "risk": get_risk_level(loan.value) if loan.value else get_risk_level(0)
-            }
-            result.append(data)
+        loan_data = _stream_rows(loan_listing(user_id))
+        return list_response(self._serialize(loan_data))
 
-        return list_response(result)
+    @staticmethod
+    def _serialize(loan_data):
+        for chunk in iter_chunks(loan_data):
+            yield from loan_rows(chunk, get_risk_index())
 
     def put(self):
         loan_id = request.args.get('id')
@@ -486,6 +451,8 @@ class CustomerLoanApi(MethodView):
         try:
             for key, value in data.items():
                 setattr(loan, key, value)
+            refresh_portfolio(Loan.id == loan.id)
+            enqueue_recalculation(f"Loan {loan.id} updated", Loan.id == loan.id)
             db.session.commit()
         except SQLAlchemyError:
             db.session.rollback()
@@ -544,33 +511,18 @@ class ECLCalculationApi(MethodView):
         loan = db.session.query(Loan).filter_by(id=loan_id, user_id=user_id).first()
         if not loan:
             return not_found_error("Loan doesn't exits.")
-        history_factor = (missed_payments * 0.15) + (late_payment * 0.05)
-
         # past_due_days = missed_payment.with_entities(func.sum(Payment.daysLate)).scalar()
 
-        due_days_factor = (daysLate / 90) * 0.3
-
-        industry_risk = db.session.query(BusinessIndustry).filter_by(name=industry).first().risk_factor
-        lending_type_factor = db.session.query(LendingType).filter_by(type=lending_type).first()
-        base_score = (850 - credit_score) / 550
-        experience_factor = max(0, (0.1 - (yearInBusiness / 100)))
-        pd = (base_score + history_factor + due_days_factor + industry_risk - experience_factor) * lending_type_factor.pd_value
-
-        # lgd calculation part
-
-        collateral_ratio = collateral_value / outstanding_loan_amount
-        base_lgd = 1 - min(1, collateral_ratio)
-        recovery_ratio = recovery_cost / outstanding_loan_amount
-
-        final_lgd = (base_lgd + recovery_ratio) * lending_type_factor.lgd_value #TODO: validate between 0 and 1
-
-        # ead part
-        ead = outstanding_loan_amount
-
-        # ecl calculation part
-        ecl = pd * final_lgd * ead
-        ecl_ratio = ecl / ead
-        ecl_ratio = ecl_ratio * 100
+        reference = get_reference_data()
+        lending_type_factor = reference.lending_type_named(lending_type)
+        if not lending_type_factor:
+            return bad_request_error("Lending type doesn't exists.")
+        industry_data = reference.industry_named(industry)
+        industry_risk = (industry_data.risk_factor or 0) if industry_data else 0  # "N/A": customer without industry
+        pd, final_lgd, ead, ecl, ecl_ratio = compute_ecl(
+            credit_score, missed_payments, late_payment, daysLate, industry_risk, yearInBusiness,
+            lending_type_factor.pd_value, lending_type_factor.lgd_value, collateral_value, outstanding_loan_amount,
+            recovery_cost)  # TODO: validate lgd between 0 and 1
 
         risk = get_risk_level(ecl_ratio)
         # if ecl_ratio < 2:
@@ -588,16 +540,17 @@ class ECLCalculationApi(MethodView):
             "lgd": final_lgd,
             "ead": ead
         }
+        write_buffer = get_write_buffer()
+        if write_buffer is not None:
+            try:
+                write_buffer.submit(ecl_row(loan_id, ecl_ratio, ecl, pd, final_lgd, ead))
+            except BufferFull:
+                return service_unavailable("ECL calculations are queued faster than they can be saved, retry later.")
+            finally:
+                db.session.close()
+            return success_response("Success", data)
         try:
-            data_obj = ECLData(
-                loan_id=loan_id,
-                value=ecl_ratio,
-                ecl_amount=ecl,
-                pd_value=pd,
-                lgd_value=final_lgd,
-                ead_value=ead
-            )
-            db.session.add(data_obj)
+            record_ecl(loan_id, ecl_ratio, ecl, pd, final_lgd, ead)
             db.session.commit()
         except SQLAlchemyError:
             db.session.rollback()
@@ -621,7 +574,7 @@ class ECLCalculationApi(MethodView):
 
         if not user_data:
             return not_found_error("User doesn't exists.")
-        industry = db.session.query(BusinessIndustry).filter_by(id=user_data.industry_id).first()
+        industry = get_reference_data().industry(user_data.industry_id)
         if industry:
             industry_name = industry.name
             industry_risk = industry.risk_factor
@@ -635,19 +588,14 @@ class ECLCalculationApi(MethodView):
         else:
             credit_score = cib_data.credit_score
 
-        payments = (db.session.query(Payment)
-                    .filter(Payment.loan_id == loan_id))
-        late_payments = payments.filter(Payment.status == 'late')
-        num_late_payments = late_payments.count()
-        # daysLate = late_payments.with_entities(func.sum(Payment.daysLate).label('days_late')).first()
-        # if daysLate:
-        #     days_late = daysLate.days_late
-        # else:
-        #     days_late = 0
-
-        missed_payments = payments.filter(Payment.status == 'missed').count()
-        daysLate = late_payments.with_entities(func.sum(Payment.daysLate)).scalar()
-        if not daysLate:
+        payment_summary = db.session.query(LoanPaymentSummary).filter_by(loan_id=loan_id).first()
+        if payment_summary:
+            num_late_payments = payment_summary.late_count
+            missed_payments = payment_summary.missed_count
+            daysLate = payment_summary.total_days_late
+        else:
+            num_late_payments = 0
+            missed_payments = 0
             daysLate = 0
         history_factor = (missed_payments * 0.15) + (daysLate * 0.05)
 
@@ -681,6 +629,211 @@ class ECLCalculationApi(MethodView):
         return detail_response(data)
 
 
+class ECLBatchApi(MethodView):
+    def post(self):
+        request_data = {
+            "user_id": None,
+            "recovery_cost": 0,
+            "scenarios": True,
+            "lifetime": True
+        }
+        data = request.get_json(silent=True) or {}
+        try:
+            summary = run_ecl_batch(user_id=data.get('user_id'), recovery_cost=data.get('recovery_cost') or 0,
+                                    scenarios=bool(data.get('scenarios')), lifetime=bool(data.get('lifetime')))
+        except ScenarioError as e:
+            return bad_request_error(str(e))
+        except SQLAlchemyError:
+            return server_error("Error running ecl batch calculation.")
+        finally:
+            db.session.close()
+        return success_response("ECL batch calculation completed", summary)
+
+
+class ECLScenarioApi(MethodView):
+    def post(self):
+        request_data = {
+            "name": "downside",
+            "weight": 0.3,
+            "pd_multiplier": 1.4,
+            "lgd_multiplier": 1.1,
+            "overlays": [
+                {"industry_id": 1, "lending_type_id": None, "pd_multiplier": 1.2, "lgd_multiplier": 1}
+            ]
+        }
+        data = request.get_json()
+        try:
+            validated_data = ScenarioSchema().load(data)
+        except ValidationError as err:
+            return validation_error(err)
+        overlays = validated_data.pop('overlays')
+        try:
+            scenario = ECLScenario(**validated_data)
+            scenario.overlays = [ECLScenarioOverlay(**overlay) for overlay in overlays]
+            db.session.add(scenario)
+            db.session.commit()
+        except SQLAlchemyError:
+            db.session.rollback()
+            return server_error("Error creating scenario.")
+        finally:
+            db.session.close()
+        return success_response("Scenario created successfully")
+
+    def get(self):
+        scenarios = db.session.query(ECLScenario).order_by(ECLScenario.id).all()
+        return list_response([scenario.serialize() for scenario in scenarios])
+
+    def put(self):
+        scenario_id = request.args.get('id')
+        scenario = db.session.query(ECLScenario).filter_by(id=scenario_id).first()
+        if not scenario:
+            return not_found_error("Scenario doesn't exists.")
+        try:
+            validated_data = ScenarioSchema(partial=True).load(request.get_json())
+        except ValidationError as err:
+            return validation_error(err)
+        try:
+            overlays = validated_data.pop('overlays', None)
+            for key, value in validated_data.items():
+                setattr(scenario, key, value)
+            if overlays is not None:
+                scenario.overlays = [ECLScenarioOverlay(**overlay) for overlay in overlays]
+            db.session.commit()
+        except SQLAlchemyError:
+            db.session.rollback()
+            return server_error("Error updating scenario.")
+        finally:
+            db.session.close()
+        return success_response("Scenario updated successfully")
+
+
+class ECLQuoteApi(MethodView):
+    def post(self):
+        """
+        Prices hypothetical loans without storing anything. Takes one quote, a list of quotes or an object of
+        columns and returns PD/LGD/EAD/ECL and risk per quote, in order.
+        """
+        request_data = {
+            "credit_score": 680,
+            "industry_name": "retail",
+            "yearInBusiness": 5,
+            "daysLate": 15,
+            "missed_payments": 1,
+            "latePayment": 0,
+            "outstanding_value": 45000,
+            "collateral_value": 20000,
+            "recovery_cost": 0,
+            "lendingType": "personal"
+        }
+        data = request.get_json(silent=True)
+        try:
+            inputs, single = quote_inputs(data)
+        except QuoteError as e:
+            return bad_request_error(str(e))
+        quotes = price_quotes(inputs)
+        return success_response("Success", quotes[0] if single else quotes)
+
+
+class ECLHistoryApi(MethodView):
+    def get(self):
+        """
+        ECL series of a loan (loan_id) or of the whole portfolio, bucketed per day or month (interval) between
+        the optional from and to dates. Compacted months are included from their monthly snapshots.
+        """
+        interval = request.args.get('interval', 'month')
+        if interval not in INTERVALS:
+            return bad_request_error(f"interval must be one of: {', '.join(INTERVALS)}.")
+        try:
+            loan_id = request.args.get('loan_id', type=int)
+            start = parse_day(request.args.get('from'), 'from')
+            end = parse_day(request.args.get('to'), 'to')
+        except HistoryError as e:
+            return bad_request_error(str(e))
+        if request.args.get('loan_id') and loan_id is None:
+            return bad_request_error("loan_id must be an integer.")
+        if start and end and start > end:
+            return bad_request_error("from must not be after to.")
+        if loan_id is None:
+            return list_response(portfolio_history(interval, start, end), interval=interval)
+        if not db.session.get(Loan, loan_id):
+            return not_found_error("Loan doesn't exists.")
+        return list_response(loan_history(loan_id, interval, start, end), loan_id=loan_id, interval=interval)
+
+
+class PortfolioSummaryApi(MethodView):
+    def get(self):
+        """
+        Loans, exposure, ECL amount and coverage ratio of the portfolio, per industry, lending type and risk level.
+        """
+        return detail_response(portfolio_summary())
+
+
+class EarlyWarningAlertApi(MethodView):
+    def get(self):
+        """
+        Early-warning alerts, newest first, optionally of one rule, loan or customer. Paginated with limit/cursor.
+        """
+        rule = request.args.get('rule')
+        if rule and rule not in RULES:
+            return bad_request_error(f"rule must be one of: {', '.join(RULES)}.")
+        loan_id = request.args.get('loan_id', type=int)
+        user_id = request.args.get('user_id', type=int)
+        try:
+            limit = parse_limit(request.args.get('limit'), default=100)
+            alerts, next_cursor = keyset_paginate(alert_listing(rule, loan_id, user_id), EarlyWarningAlert.id,
+                                                  EarlyWarningAlert.id, descending=True, limit=limit,
+                                                  cursor=request.args.get('cursor'), session=db.session)
+        except PaginationError as e:
+            return bad_request_error(str(e))
+        return list_response(alerts, next_cursor=next_cursor)
+
+
+class EarlyWarningScanApi(MethodView):
+    def post(self):
+        """
+        Runs the early-warning scan over the loans changed since the last scan, or over every loan with full.
+        """
+        request_data = {
+            "full": False
+        }
+        data = request.get_json(silent=True) or {}
+        try:
+            job = run_early_warning_scan(full=bool(data.get('full')))
+        except ScanInProgress as e:
+            return conflict_error(str(e))
+        except SQLAlchemyError:
+            return server_error("Error running early-warning scan.")
+        return success_response("Early-warning scan completed", job.serialize())
+
+
+class CreditLossSimulationApi(MethodView):
+    def post(self):
+        request_data = {
+            "scenarios": 100000,
+            "seed": 42,
+            "confidence": 0.999,
+            "default_correlation": 0.12,
+            "correlations": {"1": 0.18},
+            "processes": 1
+        }
+        data = request.get_json(silent=True) or {}
+        try:
+            scenarios = int(data.get('scenarios', 100000))
+            processes = int(data.get('processes', 1))
+            check_api_limits(scenarios, processes)
+            result = run_credit_loss_simulation(
+                scenarios=scenarios,
+                seed=int(data.get('seed', 0)),
+                confidence=float(data.get('confidence', 0.999)),
+                default_correlation=float(data.get('default_correlation', DEFAULT_CORRELATION)),
+                correlations=data.get('correlations'),
+                processes=processes
+            )
+        except (SimulationError, ValueError, TypeError) as e:
+            return bad_request_error(str(e))
+        return success_response("Credit loss simulation completed", result)
+
+
 class LoanPaymentsApi(MethodView):
     def post(self):
         request_data = {
@@ -691,13 +844,16 @@ class LoanPaymentsApi(MethodView):
             "status": "paid",
             "daysLate": 0
         }
-        data = request.get_json()
-        date_obj = datetime.strptime(data.get('date'), '%Y-%m-%d').date()
-        data['date'] = date_obj
-        loan_id = data.get('loan_id')
+        try:
+            data = PaymentSchema().load(request.get_json())
+        except ValidationError as err:
+            return validation_error(err)
+        loan_id = data['loan_id']
         loan = db.session.query(Loan).filter_by(id=loan_id).first()
         if not loan:
             return bad_request_error("Loan doesn't exists")
+        if data['user_id'] != loan.user_id:
+            return bad_request_error("Loan doesn't belong to this customer")
         # try:
         #     validated_data = loan_schema.load(data)
         # except ValidationError as err:
@@ -709,6 +865,9 @@ class LoanPaymentsApi(MethodView):
             data_obj = Payment(**data)
             db.session.add(data_obj)
             loan.outstanding_balance -= data.get('amount')
+            apply_payments([data])
+            refresh_portfolio(Loan.id == loan.id)
+            enqueue_recalculation(f"Payment added for loan {loan_id}", Loan.id == loan.id)
             db.session.commit()
         except SQLAlchemyError as e:
             db.session.rollback()
@@ -720,5 +879,84 @@ class LoanPaymentsApi(MethodView):
     def get(self):
         user_id = request.args.get('user_id')
         loan_id = request.args.get('loan_id')
-        payments = db.session.query(Payment).filter_by(user_id=user_id, loan_id=loan_id).all()
-        return list_response(payments)
+        return list_response(_stream_rows(payment_listing(user_id, loan_id)).scalars())
+
+
+class PaymentBulkApi(MethodView):
+    def post(self):
+        """
+        Accepts NDJSON (application/x-ndjson), CSV (text/csv) or a JSON array of payments.
+        `dry_run=true` only validates.
+        """
+        try:
+            chunk_size = get_chunk_size()
+        except ValueError as e:
+            return bad_request_error(str(e))
+        report = import_payments(read_records(), chunk_size, is_dry_run())
+        db.session.close()
+        return success_response("Payments imported", report.serialize())
+
+
+class CustomerBulkApi(MethodView):
+    def post(self):
+        """
+        Imports customers from NDJSON, CSV or a JSON array. `dry_run=true` only validates.
+        """
+        try:
+            chunk_size = get_chunk_size()
+        except ValueError as e:
+            return bad_request_error(str(e))
+        report = import_customers(read_records(), chunk_size, is_dry_run())
+        db.session.close()
+        return success_response("Customers imported", report.serialize())
+
+
+class LoanBulkApi(MethodView):
+    def post(self):
+        """
+        Imports loans from NDJSON, CSV or a JSON array. `dry_run=true` only validates.
+        """
+        try:
+            chunk_size = get_chunk_size()
+        except ValueError as e:
+            return bad_request_error(str(e))
+        report = import_loans(read_records(), chunk_size, is_dry_run())
+        db.session.close()
+        return success_response("Loans imported", report.serialize())
+
+
+class JobListApi(MethodView):
+    def get(self):
+        try:
+            limit = parse_limit(request.args.get('limit'), default=50)
+        except PaginationError as e:
+            return bad_request_error(str(e))
+        jobs = db.session.query(Job)
+        if request.args.get('status'):
+            jobs = jobs.filter(Job.status == request.args.get('status'))
+        jobs = jobs.order_by(Job.id.desc()).limit(limit)
+        return list_response([job.serialize() for job in jobs])
+
+
+class JobApi(MethodView):
+    def get(self, job_id):
+        job = db.session.get(Job, job_id)
+        if not job:
+            return not_found_error("Job doesn't exists.")
+        return detail_response(job.serialize())
+
+
+class DatabasePoolApi(MethodView):
+    def get(self):
+        """
+        Connection pool usage and checkout wait statistics of this worker process.
+        """
+        return detail_response(pool_status(db.engine))
+
+
+class MetricsApi(MethodView):
+    def get(self):
+        """
+        Per-endpoint request, query count and DB time histograms plus pool usage, in Prometheus text format.
+        """
+        return Response(metrics.render(db.engine), content_type='text/plain; version=0.0.4; charset=utf-8')
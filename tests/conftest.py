@@ -0,0 +1,38 @@
+"""
+One app on a temporary SQLite database for the whole run; every test starts with empty tables.
+"""
+import os
+import tempfile
+
+import pytest
+
+
+@pytest.fixture(scope='session')
+def app():
+    directory = tempfile.TemporaryDirectory()
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(directory.name, 'test.db')}"
+    from main import app
+    app.config['TESTING'] = True
+    yield app
+    directory.cleanup()
+
+
+@pytest.fixture(autouse=True)
+def empty_database(app):
+    """
+    Deletes every row before the test. seed_portfolio bumps the reference data versions when it re-creates them,
+    so the process-local caches don't keep the rows of an earlier test.
+    """
+    from utils.extensions import db
+
+    with app.app_context():
+        db.session.remove()
+        for table in reversed(db.metadata.sorted_tables):
+            db.session.execute(table.delete())
+        db.session.commit()
+    yield
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,54 @@
+"""
+Credit-loss Monte Carlo: the simulated losses match the model, do not depend on the number of processes, and the
+API refuses runs too large for a request.
+"""
+import numpy as np
+import pytest
+
+from server.seed import seed_portfolio
+from utils import simulation
+from utils.simulation import build_buckets, norm_cdf, simulate_portfolio_loss
+
+
+@pytest.fixture
+def buckets():
+    rng = np.random.default_rng(1)
+    loans = 2000
+    # rounded PDs and a few loss amounts give both single loans and buckets of many loans
+    pd = np.round(rng.uniform(0.01, 0.3, loans), 2)
+    loss = np.where(np.arange(loans) % 2, rng.choice([1000, 5000], loans), rng.uniform(1000, 50000, loans))
+    return build_buckets(pd, np.ones(loans), loss, np.where(np.arange(loans) % 3, 0.2, 0.1),
+                         rng.integers(0, 3, loans), pd_decimals=2)
+
+
+def test_expected_loss_of_every_group(buckets):
+    result = simulate_portfolio_loss(buckets, 3, scenarios=40000, seed=3)
+    # unconditional PD x loss of every loan, with the PD the normal CDF of the threshold
+    expected = np.bincount(buckets["group"], minlength=3,
+                           weights=buckets["loans"] * norm_cdf(buckets["threshold"]) * buckets["loss"])
+    assert result["expected_loss_by_group"] == pytest.approx(expected, rel=0.02)
+    assert result["expected_shortfall"] >= result["value_at_risk"] > result["expected_loss"]
+
+
+def test_results_do_not_depend_on_the_number_of_processes(buckets, monkeypatch):
+    monkeypatch.setattr(simulation, 'STREAM_SCENARIOS', 1500)
+    one = simulate_portfolio_loss(buckets, 3, scenarios=5000, seed=11)
+    two = simulate_portfolio_loss(buckets, 3, scenarios=5000, seed=11, processes=2)
+    assert one["quantiles"] == two["quantiles"]
+    assert one["expected_shortfall"] == two["expected_shortfall"]
+    assert np.array_equal(one["tail_loss_by_group"], two["tail_loss_by_group"])
+
+
+def test_api_caps_scenarios_and_processes(app, client):
+    with app.app_context():
+        seed_portfolio(30, payments_per_loan=1, ecl_history=1)
+    app.config.update(SIMULATION_API_MAX_SCENARIOS=5000, SIMULATION_API_MAX_PROCESSES=1)
+    try:
+        assert client.post('/api/v1/credit-loss-simulation', json={'scenarios': 5001}).status_code == 400
+        assert client.post('/api/v1/credit-loss-simulation',
+                           json={'scenarios': 1000, 'processes': 2}).status_code == 400
+        response = client.post('/api/v1/credit-loss-simulation', json={'scenarios': 5000})
+        assert response.status_code == 200
+        assert response.get_json()['data']['loans'] == 30
+    finally:
+        app.config.update(SIMULATION_API_MAX_SCENARIOS=None, SIMULATION_API_MAX_PROCESSES=None)
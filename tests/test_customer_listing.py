@@ -0,0 +1,61 @@
+"""
+Customer listing: every page is built with the same number of SQL statements, whatever the number of customers.
+"""
+from sqlalchemy import event
+
+PAGE_SIZE = 50
+CUSTOMERS = 200
+
+
+def _seed(customers, seed):
+    from server.seed import LOANS_PER_CUSTOMER, seed_portfolio
+    seed_portfolio(customers * LOANS_PER_CUSTOMER, customers=customers, payments_per_loan=2, ecl_history=2,
+                   seed=seed)
+
+
+def _page_queries(app, query_string):
+    """
+    Statements run for every page of the listing, walking the cursors to the end.
+    """
+    from utils.extensions import db
+
+    statements = []
+    client = app.test_client()
+    client.get('/api/v1/users?limit=1')  # opens the pooled connection, whose setup pragmas are not counted
+    with app.app_context():
+        engine = db.engine
+
+    def count(*args):
+        statements[-1] += 1
+
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        cursor = None
+        while True:
+            statements.append(0)
+            path = f'/api/v1/users?limit={PAGE_SIZE}&{query_string}' + (f'&cursor={cursor}' if cursor else '')
+            response = client.get(path)
+            assert response.status_code == 200
+            cursor = response.get_json()['data']['next_cursor']
+            if not cursor:
+                return statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+
+
+def test_statements_per_page_do_not_grow_with_customers(app):
+    from server.models import User
+    from utils.extensions import db
+
+    orders = ['sort=id', 'sort=name', 'sort=total_loans', 'sort=average_ecl&order=desc']
+    with app.app_context():
+        _seed(CUSTOMERS, seed=1)
+        small = {order: _page_queries(app, order) for order in orders}
+        _seed(CUSTOMERS * 9, seed=2)
+        assert db.session.query(User).count() == CUSTOMERS * 10
+        large = {order: _page_queries(app, order) for order in orders}
+
+    for order in orders:
+        assert len(small[order]) == CUSTOMERS // PAGE_SIZE
+        assert len(large[order]) == CUSTOMERS * 10 // PAGE_SIZE
+        assert len(set(small[order] + large[order])) == 1, (order, small[order], large[order])
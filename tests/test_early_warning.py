@@ -0,0 +1,100 @@
+"""
+Early-warning scan: watermarks, the rescan of rows committed below the watermark, and one running scan at a time.
+"""
+from datetime import date, datetime, timedelta
+
+import pytest
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from server.early_warning import EARLY_WARNING_SCAN, ScanInProgress, _start_job, run_early_warning_scan
+from server.models import EarlyWarningAlert, Job, Loan, LoanMonitorState, LoanPaymentSummary, Payment
+from server.payment_summary import apply_payments
+from server.seed import seed_portfolio
+from utils.extensions import db
+
+
+def _alerts(job):
+    return sorted(db.session.query(EarlyWarningAlert.rule, EarlyWarningAlert.loan_id).filter_by(job_id=job.id))
+
+
+def _quiet_loan(exclude_user=None):
+    """
+    An active loan below the days-late threshold, of a customer with no other active loan.
+    """
+    single_loan_users = (db.session.query(Loan.user_id).filter(Loan.outstanding_balance > 0)
+                         .group_by(Loan.user_id).having(func.count() == 1))
+    loan = (db.session.query(Loan)
+            .join(LoanMonitorState, LoanMonitorState.loan_id == Loan.id)
+            .outerjoin(LoanPaymentSummary, LoanPaymentSummary.loan_id == Loan.id)
+            .filter(Loan.user_id.in_(single_loan_users), Loan.user_id != exclude_user,
+                    LoanMonitorState.credit_score.isnot(None),
+                    func.coalesce(LoanPaymentSummary.max_days_late, 0) < 30)
+            .order_by(Loan.id).first())
+    assert loan is not None
+    return loan
+
+
+def test_rescan_alerts_once_per_change(app, client):
+    with app.app_context():
+        seed_portfolio(60, customers=45, payments_per_loan=3, seed=5)
+        # free a payment id below the watermark the first scan will save
+        freed = db.session.query(func.max(Payment.id)).scalar() - 3
+        db.session.query(Payment).filter_by(id=freed).delete()
+        db.session.commit()
+        run_early_warning_scan()
+
+        late = _quiet_loan()
+        dropped = _quiet_loan(exclude_user=late.user_id)
+        late_id, dropped_id, dropped_user = late.id, dropped.id, dropped.user_id
+        baseline_score = db.session.get(LoanMonitorState, dropped_id).credit_score
+        # a payment committed after the scan, with an id it already went past
+        payment = {'id': freed, 'user_id': late.user_id, 'loan_id': late_id, 'date': date(2024, 7, 1),
+                   'amount': 1.0, 'status': 'late', 'daysLate': 45}
+        db.session.add(Payment(**payment))
+        apply_payments([payment])
+        db.session.commit()
+
+    response = client.post('/api/v1/cib-data', json={'user_id': dropped_user, 'credit_score': baseline_score - 80})
+    assert response.status_code == 200
+
+    with app.app_context():
+        rescan = run_early_warning_scan()
+        assert _alerts(rescan) == sorted([('credit_score_drop', dropped_id), ('days_late', late_id)])
+        quiet = run_early_warning_scan()
+        assert _alerts(quiet) == []
+        assert quiet.status == 'done'
+
+
+def test_second_scan_is_refused_while_one_runs(app, client):
+    with app.app_context():
+        running = _start_job(datetime.now())
+        with pytest.raises(ScanInProgress):
+            _start_job(datetime.now())
+        assert client.post('/api/v1/early-warnings/scan').status_code == 409
+        assert db.session.query(Job).filter_by(kind=EARLY_WARNING_SCAN, status='running').one().id == running.id
+
+
+def test_unique_index_refuses_a_second_running_scan(app):
+    # the guard when two scans pass the running check at the same time
+    with app.app_context():
+        now = datetime.now()
+        db.session.add(Job(kind=EARLY_WARNING_SCAN, status='running', created_at=now, started_at=now))
+        db.session.commit()
+        db.session.add(Job(kind=EARLY_WARNING_SCAN, status='running', created_at=now, started_at=now))
+        with pytest.raises(IntegrityError):
+            db.session.commit()
+        db.session.rollback()
+
+
+def test_stale_running_scan_is_released(app):
+    with app.app_context():
+        seed_portfolio(10, payments_per_loan=1)
+        started = datetime.now() - timedelta(hours=2)
+        stale = Job(kind=EARLY_WARNING_SCAN, status='running', created_at=started, started_at=started)
+        db.session.add(stale)
+        db.session.commit()
+
+        job = run_early_warning_scan()
+        assert job.status == 'done'
+        assert db.session.get(Job, stale.id).status == 'failed'
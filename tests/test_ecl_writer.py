@@ -0,0 +1,130 @@
+"""
+Write-behind buffer: retries on OperationalError, row-by-row fallback, dead-letter file and its replay.
+"""
+import json
+import os
+import sqlite3
+from datetime import datetime
+
+import pytest
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from server import ecl_writer
+from server.ecl_store import ecl_row, save_ecl_rows
+from server.ecl_writer import ECLWriteBuffer, replay_dead_letter
+from server.models import ECLData, Loan
+from server.seed import seed_portfolio
+from utils.extensions import db
+
+RETRIES = 3
+
+
+@pytest.fixture
+def loan_ids(app):
+    with app.app_context():
+        seed_portfolio(10, payments_per_loan=1)
+        return [loan.id for loan in db.session.query(Loan).order_by(Loan.id).limit(5)]
+
+
+@pytest.fixture
+def buffer(app, tmp_path):
+    # a long interval so the rows submitted together are written as one batch
+    buffer = ECLWriteBuffer(app, interval_ms=500, retries=RETRIES, retry_backoff_ms=1,
+                            dead_letter_path=str(tmp_path / 'dead_letter.ndjson'))
+    yield buffer
+    buffer.close()
+
+
+class FlakySave:
+    """save_ecl_rows failing with "database is locked" `failures` times, then writing."""
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+
+    def __call__(self, rows):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise OperationalError('INSERT INTO ecl_data', {}, sqlite3.OperationalError('database is locked'))
+        return save_ecl_rows(rows)
+
+
+def _rows(loan_ids):
+    return [ecl_row(loan_id, 3.5, 350.0, 0.07, 0.5, 10000.0) for loan_id in loan_ids]
+
+
+def _write(buffer, rows):
+    for row in rows:
+        buffer.submit(row)
+    buffer.flush()
+
+
+def _stored(app):
+    with app.app_context():
+        return [loan_id for loan_id, in db.session.query(ECLData.loan_id).order_by(ECLData.id)]
+
+
+def _dead_letters(buffer):
+    if not os.path.exists(buffer.dead_letter_path):
+        return []
+    with open(buffer.dead_letter_path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_batch_is_retried_until_the_database_is_available(app, buffer, loan_ids, monkeypatch):
+    save = FlakySave(failures=2)
+    monkeypatch.setattr(ecl_writer, 'save_ecl_rows', save)
+    _write(buffer, _rows(loan_ids))
+    assert save.calls == 3
+    assert _stored(app) == loan_ids
+    assert _dead_letters(buffer) == []
+
+
+def test_batch_failing_past_the_retries_is_dead_lettered(app, buffer, loan_ids, monkeypatch):
+    save = FlakySave(failures=RETRIES + 1)
+    monkeypatch.setattr(ecl_writer, 'save_ecl_rows', save)
+    _write(buffer, _rows(loan_ids))
+    # no row-by-row retries while the database is unavailable
+    assert save.calls == RETRIES + 1
+    assert _stored(app) == []
+    assert [row['loan_id'] for row in _dead_letters(buffer)] == loan_ids
+
+
+def test_bad_row_is_dead_lettered_and_its_batch_mates_commit(app, buffer, loan_ids):
+    rows = _rows(loan_ids)
+    rows[2]['loan_id'] = None
+    _write(buffer, rows)
+    assert _stored(app) == loan_ids[:2] + loan_ids[3:]
+    dead_letters = _dead_letters(buffer)
+    assert len(dead_letters) == 1 and dead_letters[0]['loan_id'] is None
+
+
+def test_replay_writes_the_dead_letters_with_their_timestamps(app, buffer, loan_ids, monkeypatch):
+    rows = _rows(loan_ids)
+    for row, day in zip(rows, range(1, 6)):
+        row['created_at'] = row['updated_at'] = datetime(2024, 5, day, 9, 30, 15, 250000)
+    monkeypatch.setattr(ecl_writer, 'save_ecl_rows', FlakySave(failures=RETRIES + 1))
+    _write(buffer, rows)
+    path = buffer.dead_letter_path
+
+    with app.app_context():
+        assert replay_dead_letter(path) == 5
+        stored = db.session.query(ECLData).order_by(ECLData.id).all()
+        assert [(row.loan_id, row.created_at, row.updated_at) for row in stored] == \
+            [(row['loan_id'], row['created_at'], row['updated_at']) for row in rows]
+    assert not os.path.exists(path)
+    assert not os.path.exists(path + '.replay')
+
+
+def test_failed_replay_keeps_the_replay_file(app, buffer, loan_ids):
+    rows = _rows(loan_ids[:1])
+    rows[0]['loan_id'] = None
+    _write(buffer, rows)
+    path = buffer.dead_letter_path
+
+    with app.app_context():
+        with pytest.raises(IntegrityError):
+            replay_dead_letter(path)
+        db.session.rollback()
+    assert not os.path.exists(path)
+    assert os.path.exists(path + '.replay')
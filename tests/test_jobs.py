@@ -0,0 +1,97 @@
+"""
+ECL recalculation queue: claims, expired claims, and jobs waiting for loans another job already queued.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from server.jobs import claim_batch, enqueue_recalculation, process_batch, release_stale_claims, run_worker
+from server.models import ECLData, ECLRecalculation, ECLRecalculationWatcher, Job, Loan
+from server.seed import seed_portfolio
+from utils.extensions import db
+
+
+@pytest.fixture
+def loan_ids(app):
+    with app.app_context():
+        seed_portfolio(20, payments_per_loan=2)
+        return [loan_id for loan_id, in db.session.query(Loan.id).order_by(Loan.id)]
+
+
+def _enqueue(loan_ids, description='test'):
+    job = enqueue_recalculation(description, Loan.id.in_(loan_ids))
+    db.session.commit()
+    return job
+
+
+def _job(job_id):
+    db.session.expire_all()
+    return db.session.get(Job, job_id)
+
+
+def test_claims_do_not_overlap(app, loan_ids):
+    with app.app_context():
+        job = _enqueue(loan_ids[:10])
+        first = claim_batch('worker-1', batch_size=4)
+        second = claim_batch('worker-2', batch_size=10)
+        assert [row.loan_id for row in first] == loan_ids[:4]
+        assert [row.loan_id for row in second] == loan_ids[4:10]
+        assert claim_batch('worker-3') == []
+        assert _job(job.id).status == 'running'
+
+
+def test_expired_claim_is_claimed_again(app, loan_ids):
+    with app.app_context():
+        _enqueue(loan_ids[:6])
+        dead = claim_batch('dead-worker', batch_size=3)
+        alive = claim_batch('live-worker', batch_size=3)
+        # the first worker died ten minutes ago
+        (db.session.query(ECLRecalculation)
+         .filter(ECLRecalculation.id.in_([row.id for row in dead]))
+         .update({ECLRecalculation.claimed_at: datetime.now() - timedelta(seconds=700)}))
+        db.session.commit()
+
+        release_stale_claims(claim_timeout=600)
+        reclaimed = claim_batch('worker-3')
+        assert [row.id for row in reclaimed] == [row.id for row in dead]
+        assert db.session.query(ECLRecalculation).filter_by(claimed_at=None).count() == 0
+        assert {row.id for row in alive}.isdisjoint(row.id for row in reclaimed)
+
+
+def test_job_finishes_after_the_loans_it_waited_on(app, loan_ids):
+    with app.app_context():
+        first = _enqueue(loan_ids[:5], 'first')
+        second = _enqueue(loan_ids[:8], 'second')
+        # the first five loans stay queued once, watched by the second job
+        assert second.total == 8
+        assert db.session.query(ECLRecalculation).count() == 8
+        assert db.session.query(ECLRecalculationWatcher).filter_by(job_id=second.id).count() == 5
+
+        rows = claim_batch('worker', batch_size=8)
+        own = [row for row in rows if row.job_id == second.id]
+        waited = [row for row in rows if row.job_id == first.id]
+        assert len(own) == 3 and len(waited) == 5
+
+        process_batch(own)
+        assert (_job(second.id).status, _job(second.id).processed) == ('running', 3)
+        process_batch(waited)
+        assert (_job(first.id).status, _job(first.id).processed) == ('done', 5)
+        assert (_job(second.id).status, _job(second.id).processed) == ('done', 8)
+        assert db.session.query(ECLRecalculationWatcher).count() == 0
+        assert db.session.query(ECLData.loan_id).distinct().count() == 8
+
+
+def test_job_waiting_only_on_queued_loans(app, loan_ids):
+    with app.app_context():
+        first = _enqueue(loan_ids[:4], 'first')
+        second = _enqueue(loan_ids[:4], 'second')
+        assert (second.status, second.total) == ('pending', 4)
+        assert run_worker(once=True) == 4
+        assert _job(first.id).status == 'done'
+        assert (_job(second.id).status, _job(second.id).processed) == ('done', 4)
+
+
+def test_job_without_loans_is_done(app, loan_ids):
+    with app.app_context():
+        job = _enqueue([])
+        assert (job.status, job.total) == ('done', 0)
@@ -0,0 +1,114 @@
+"""
+Portfolio rollup: after every kind of write the incrementally maintained summary equals a rebuild from the loans.
+The writes go through the API, whose views answer 200 even when their transaction was rolled back, so every test
+also checks that the change landed.
+"""
+import pytest
+
+from server.models import ECLThreshold, Loan
+from server.portfolio_summary import portfolio_summary, rebuild_portfolio_summary, refresh_loans
+from server.seed import seed_portfolio
+from utils.extensions import db
+
+
+def _approx(value):
+    if isinstance(value, float):
+        return pytest.approx(value, rel=1e-9, abs=1e-6)
+    if isinstance(value, dict):
+        return {key: _approx(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_approx(item) for item in value]
+    return value
+
+
+def _summary(app):
+    with app.app_context():
+        return portfolio_summary()
+
+
+def _assert_matches_rebuild(app):
+    with app.app_context():
+        incremental = portfolio_summary()
+        rebuild_portfolio_summary()
+        assert incremental == _approx(portfolio_summary())
+
+
+@pytest.fixture
+def portfolio(app):
+    with app.app_context():
+        seed_portfolio(60, payments_per_loan=3, ecl_history=1, seed=3)
+        loan = db.session.query(Loan).order_by(Loan.id).first()
+        return {'loan_id': loan.id, 'user_id': loan.user_id, 'lending_type': loan.lending_type}
+
+
+def _ecl_request(portfolio, credit_score=520):
+    return {'user_id': portfolio['user_id'], 'loan_id': portfolio['loan_id'], 'credit_score': credit_score,
+            'industry_name': 'retail', 'yearInBusiness': 3, 'daysLate': 40, 'missed_payments': 2, 'latePayment': 1,
+            'outstanding_value': 45000, 'collateral_value': 20000, 'recovery_cost': 0, 'lendingType': 'personal'}
+
+
+def test_loan_create_update_delete(app, client, portfolio):
+    before = _summary(app)['totals']
+    response = client.post('/api/v1/loans', json={
+        'user_id': portfolio['user_id'], 'loan_name': 'Working capital', 'loan_term': 36, 'loan_amount': 50000,
+        'lending_type': portfolio['lending_type'], 'interest_rate': 9.5, 'collateral_value': 80000,
+        'outstanding_balance': 40000})
+    assert response.status_code == 200
+    created = _summary(app)['totals']
+    assert created['loans'] == before['loans'] + 1
+    assert created['exposure'] == pytest.approx(before['exposure'] + 40000)
+    _assert_matches_rebuild(app)
+
+    with app.app_context():
+        loan_id = db.session.query(db.func.max(Loan.id)).scalar()
+    response = client.put(f"/api/v1/loans?id={loan_id}&user_id={portfolio['user_id']}",
+                          json={'outstanding_balance': 15000, 'lending_type': portfolio['lending_type'] % 4 + 1})
+    assert response.status_code == 200
+    assert _summary(app)['totals']['exposure'] == pytest.approx(before['exposure'] + 15000)
+    _assert_matches_rebuild(app)
+
+    with app.app_context():
+        db.session.query(Loan).filter_by(id=loan_id).delete()
+        refresh_loans([loan_id])
+        db.session.commit()
+    deleted = _summary(app)['totals']
+    assert deleted['loans'] == before['loans']
+    assert deleted['exposure'] == pytest.approx(before['exposure'])
+    _assert_matches_rebuild(app)
+
+
+def test_ecl_row_and_payment(app, client, portfolio):
+    before = _summary(app)['totals']
+    response = client.post('/api/v1/ecl-calculation', json=_ecl_request(portfolio))
+    assert response.status_code == 200
+    assert _summary(app)['totals']['ecl_amount'] != pytest.approx(before['ecl_amount'])
+    _assert_matches_rebuild(app)
+
+    before = _summary(app)['totals']
+    response = client.post('/api/v1/payments', json={
+        'user_id': portfolio['user_id'], 'loan_id': portfolio['loan_id'], 'date': '2024-07-05', 'amount': 1000,
+        'status': 'late', 'daysLate': 12})
+    assert response.status_code == 200
+    assert _summary(app)['totals']['exposure'] == pytest.approx(before['exposure'] - 1000)
+    _assert_matches_rebuild(app)
+
+
+def test_threshold_change_moves_loans_between_risk_levels(app, client, portfolio):
+    before = {row['risk_level']: row['loans'] for row in _summary(app)['by_risk_level']}
+    assert len(before) > 1
+    with app.app_context():
+        thresholds = {threshold.level: threshold.id for threshold in db.session.query(ECLThreshold)}
+    # everything below 1000% is low: every loan moves there
+    response = client.put('/api/v1/risk-decisions', json=[
+        {'id': thresholds['low'], 'max_value': 1000},
+        {'id': thresholds['medium'], 'min_value': 1000, 'max_value': 2000},
+        {'id': thresholds['high'], 'min_value': 2000}])
+    assert response.status_code == 200
+    after = {row['risk_level']: row['loans'] for row in _summary(app)['by_risk_level']}
+    assert after == {'low': sum(before.values())}
+    _assert_matches_rebuild(app)
+
+    # later incremental updates classify with the new thresholds
+    client.post('/api/v1/ecl-calculation', json=_ecl_request(portfolio, credit_score=450))
+    assert {row['risk_level'] for row in _summary(app)['by_risk_level']} == {'low'}
+    _assert_matches_rebuild(app)
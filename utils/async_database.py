@@ -0,0 +1,36 @@
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from utils.database import InstrumentedQueuePool, install_engine_hooks
+
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+}
+
+
+def async_url(url):
+    """
+    The URL of the same database with the asyncio driver of its backend.
+    """
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for {backend} databases.")
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+def create_read_engine(app, engine):
+    """
+    AsyncEngine on the database of the Flask app's engine (relative SQLite paths are already resolved there),
+    with the app's pool size and timeouts and the same connect-time setup.
+    """
+    options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    if options.get('poolclass') is InstrumentedQueuePool:
+        options['poolclass'] = AsyncAdaptedQueuePool
+    read_engine = create_async_engine(async_url(engine.url), **options)
+    install_engine_hooks(read_engine.sync_engine)
+    return read_engine
+
+
+def read_session_factory(read_engine):
+    return async_sessionmaker(read_engine, expire_on_commit=False)
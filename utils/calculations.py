@@ -1,7 +1,10 @@
+from bisect import bisect_right
 from datetime import datetime
 
+import numpy as np
 from sqlalchemy import func
 from utils.extensions import db
+from utils.versioning import ECL_THRESHOLDS, VersionedCache
 from server.models import CIBData, Payment, BusinessIndustry, User, Loan, ECLThreshold
 
 
@@ -59,14 +62,143 @@ def calculate_ecl(pd, lgd, ead, loan_amount=None, loan_id=None):
     return ecl_ratio
 
 
-def get_risk_level(value):
-    thresholds = ECLThreshold.query.all()
-    for threshold in thresholds:
-        if threshold.min_value is None and value < threshold.max_value:
-            return threshold.level
-        elif threshold.max_value is None and value >= threshold.min_value:
-            return threshold.level
-        elif threshold.min_value is not None and threshold.max_value is not None:
-            if threshold.min_value <= value < threshold.max_value:
-                return threshold.level
-    return "unknown"
\ No newline at end of file
+def compute_ecl(credit_score, missed_payments, late_payments, days_late, industry_risk, years_in_business,
+                pd_factor, lgd_factor, collateral_value, outstanding_value, recovery_cost=0):
+    """
+    Applies the PD/LGD/EAD/ECL formulas element-wise.
+    Works with plain numbers for a single loan or numpy arrays for a whole portfolio.
+    Returns a tuple of (pd, lgd, ead, ecl_amount, ecl_percentage).
+    """
+    # pd calculation part
+    history_factor = (missed_payments * 0.15) + (late_payments * 0.05)
+    due_days_factor = (days_late / 90) * 0.3
+    base_score = (850 - credit_score) / 550
+    experience_factor = np.maximum(0, (0.1 - (years_in_business / 100)))
+    pd = (base_score + history_factor + due_days_factor + industry_risk - experience_factor) * pd_factor
+
+    # lgd calculation part
+    collateral_ratio = collateral_value / outstanding_value
+    base_lgd = 1 - np.minimum(1, collateral_ratio)
+    recovery_ratio = recovery_cost / outstanding_value
+    lgd = (base_lgd + recovery_ratio) * lgd_factor
+
+    # ead part
+    ead = outstanding_value
+
+    # ecl calculation part
+    ecl = pd * lgd * ead
+    ecl_ratio = (ecl / ead) * 100
+    return pd, lgd, ead, ecl, ecl_ratio
+
+
+def weighted_scenario_ecl(pd, lgd, ead, pd_multipliers, lgd_multipliers, weights):
+    """
+    Evaluates every loan under every scenario at once.
+    pd, lgd and ead are per-loan arrays, the multipliers are (loans x scenarios) matrices and
+    weights the scenario probabilities (normalized to sum to 1).
+    Returns the (loans x scenarios) pd, lgd and ecl matrices and the probability-weighted pd, lgd and ecl.
+    The weighted pd is the weighted average of the scenario pds; the weighted lgd is the one implied by the
+    weighted ecl, ecl / (pd * ead), so that pd * lgd * ead == ecl as for a single-scenario run. It falls back
+    to the weighted average of the scenario lgds where pd * ead is 0.
+    """
+    weights = np.asarray(weights, dtype=float)
+    weights = weights / weights.sum()
+    scenario_pd = pd[:, None] * pd_multipliers
+    scenario_lgd = lgd[:, None] * lgd_multipliers
+    scenario_ecl = scenario_pd * scenario_lgd * ead[:, None]
+    weighted_pd = scenario_pd @ weights
+    weighted_ecl = scenario_ecl @ weights
+    exposure = weighted_pd * ead
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weighted_lgd = np.where(exposure != 0, weighted_ecl / exposure, scenario_lgd @ weights)
+    return scenario_pd, scenario_lgd, scenario_ecl, weighted_pd, weighted_lgd, weighted_ecl
+
+
+def lifetime_ecl(pd, lgd, outstanding, remaining_months, annual_rate, chunk_size=5000):
+    """
+    Lifetime ECL from an annuity amortization schedule of every loan, built as a (loans x months) array.
+    The annual pd is turned into a constant monthly hazard, so the marginal PD of month t is
+    (1 - h) ** (t - 1) * h, and each month's expected loss is discounted at the monthly effective rate.
+    annual_rate is in percent. Loans are processed in chunks to bound memory.
+    Returns the lifetime ECL amounts and the cumulative lifetime PDs.
+    """
+    annual_pd = np.clip(pd, 0, 0.9999)
+    monthly_hazard = 1 - (1 - annual_pd) ** (1 / 12)
+    monthly_rate = np.maximum(annual_rate, 0) / 100 / 12
+    remaining_months = np.maximum(remaining_months, 1).astype(np.int64)
+
+    ecl = np.zeros(len(pd))
+    for start in range(0, len(pd), chunk_size):
+        part = slice(start, start + chunk_size)
+        n = remaining_months[part][:, None]
+        rate = monthly_rate[part][:, None]
+        hazard = monthly_hazard[part][:, None]
+        months = np.arange(1, n.max() + 1 if n.size else 1)[None, :]
+        active = months <= n
+
+        # balance outstanding at the start of each month of an annuity over the remaining term
+        growth = (1 + rate) ** n
+        with np.errstate(divide='ignore', invalid='ignore'):
+            balance = np.where(rate > 0, (growth - (1 + rate) ** (months - 1)) / (growth - 1), 1 - (months - 1) / n)
+        ead = outstanding[part][:, None] * balance
+
+        marginal_pd = (1 - hazard) ** (months - 1) * hazard
+        discount = (1 + rate) ** -months
+        ecl[part] = np.where(active, marginal_pd * lgd[part][:, None] * ead * discount, 0).sum(axis=1)
+
+    lifetime_pd = 1 - (1 - monthly_hazard) ** remaining_months
+    return ecl, lifetime_pd
+
+
+class RiskThresholdIndex:
+    """
+    ECL thresholds compiled into sorted boundaries, so a risk level is a bisect lookup instead of a table scan.
+    Every segment between two boundaries gets the level the thresholds assign to it (first match wins).
+    """
+    def __init__(self, thresholds):
+        ranges = [(t.min_value, t.max_value, t.level) for t in thresholds]
+        self.boundaries = sorted({v for lo, hi, _ in ranges for v in (lo, hi) if v is not None})
+        representatives = [float('-inf')] + self.boundaries
+        self.levels = [self._match(ranges, value) for value in representatives]
+        self._levels_array = np.array(self.levels, dtype=object)
+
+    @staticmethod
+    def _match(ranges, value):
+        for min_value, max_value, level in ranges:
+            if min_value is None and (max_value is None or value < max_value):
+                return level
+            elif max_value is None and value >= min_value:
+                return level
+            elif min_value is not None and max_value is not None:
+                if min_value <= value < max_value:
+                    return level
+        return "unknown"
+
+    def classify(self, value):
+        if value is None or value != value:
+            return "unknown"
+        return self.levels[bisect_right(self.boundaries, value)]
+
+    def classify_many(self, values):
+        """
+        Classifies an array of ECL percentages at once. None/NaN values are "unknown".
+        """
+        values = np.asarray(values, dtype=float)
+        levels = self._levels_array[np.searchsorted(self.boundaries, values, side='right')]
+        return np.where(np.isnan(values), "unknown", levels)
+
+
+_risk_index = VersionedCache([ECL_THRESHOLDS], lambda: RiskThresholdIndex(ECLThreshold.query.all()))
+
+
+def get_risk_index():
+    """
+    Returns the compiled threshold index of this process, rebuilt when the thresholds version changed.
+    """
+    return _risk_index.get()
+
+
+def get_risk_level(value, thresholds=None):
+    if thresholds is None:
+        return get_risk_index().classify(value)
+    return RiskThresholdIndex(thresholds).classify(value)
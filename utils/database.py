@@ -0,0 +1,174 @@
+import os
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+DEFAULT_DATABASE_URI = 'sqlite:///../instance/app.db'
+
+DEFAULT_POOL_SIZE = 5
+DEFAULT_MAX_OVERFLOW = 10
+DEFAULT_POOL_TIMEOUT = 30
+DEFAULT_POOL_RECYCLE = 1800
+
+SQLITE_BUSY_TIMEOUT_MS = 5000
+SQLITE_CACHE_SIZE_KB = 64000
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+
+# dialects whose insert() supports ON CONFLICT DO UPDATE
+UPSERT_DIALECTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value not in (None, '') else default
+
+
+def database_uri():
+    """
+    Returns the DATABASE_URL environment variable, or the bundled SQLite database when it is not set.
+    PostgreSQL URLs without a driver get psycopg2 (requirements.txt); SQLAlchemy's default driver depends on its
+    version.
+    """
+    uri = os.environ.get('DATABASE_URL') or DEFAULT_DATABASE_URI
+    for scheme in ('postgres://', 'postgresql://'):
+        if uri.startswith(scheme):
+            uri = 'postgresql+psycopg2://' + uri[len(scheme):]
+    return uri
+
+
+def _is_memory_sqlite(url):
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def engine_options(uri):
+    """
+    Engine options for the URI. Every pooled database gets the instrumented queue pool, sized from
+    DB_POOL_SIZE / DB_MAX_OVERFLOW / DB_POOL_TIMEOUT / DB_POOL_RECYCLE. In-memory SQLite keeps its own pool.
+    """
+    url = make_url(uri)
+    if _is_memory_sqlite(url):
+        return {}
+    options = {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': _env_int('DB_POOL_SIZE', DEFAULT_POOL_SIZE),
+        'max_overflow': _env_int('DB_MAX_OVERFLOW', DEFAULT_MAX_OVERFLOW),
+        'pool_timeout': _env_int('DB_POOL_TIMEOUT', DEFAULT_POOL_TIMEOUT),
+    }
+    if url.get_backend_name() == 'sqlite':
+        # The driver waits on a locked database itself, as long as the busy_timeout pragma.
+        options['connect_args'] = {'timeout': _env_int('SQLITE_BUSY_TIMEOUT_MS', SQLITE_BUSY_TIMEOUT_MS) / 1000}
+    else:
+        options['pool_recycle'] = _env_int('DB_POOL_RECYCLE', DEFAULT_POOL_RECYCLE)
+        options['pool_pre_ping'] = True
+    return options
+
+
+def configure_database(app):
+    """
+    Sets the database URI and engine options of the app, unless they are already configured.
+    """
+    uri = app.config.setdefault('SQLALCHEMY_DATABASE_URI', database_uri())
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(uri))
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    WAL lets readers run next to the single writer, synchronous=NORMAL is safe in WAL mode and only fsyncs at
+    checkpoints, busy_timeout makes a writer wait for the lock instead of failing with "database is locked".
+    """
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute(f"PRAGMA busy_timeout={_env_int('SQLITE_BUSY_TIMEOUT_MS', SQLITE_BUSY_TIMEOUT_MS)}")
+        cursor.execute(f"PRAGMA cache_size=-{_env_int('SQLITE_CACHE_SIZE_KB', SQLITE_CACHE_SIZE_KB)}")
+        cursor.execute(f"PRAGMA mmap_size={_env_int('SQLITE_MMAP_SIZE', SQLITE_MMAP_SIZE)}")
+        cursor.execute('PRAGMA temp_store=MEMORY')
+    finally:
+        cursor.close()
+
+
+def install_engine_hooks(engine):
+    """
+    Registers the connect-time setup of the engine's dialect. Called once per engine.
+    """
+    if engine.dialect.name == 'sqlite' and not _is_memory_sqlite(engine.url):
+        event.listen(engine, 'connect', set_sqlite_pragmas)
+
+
+class PoolStatistics:
+    """
+    Per-process counters of one pool: checkouts, time spent waiting for a connection and checkout timeouts.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.max_checked_out = 0
+
+    def record(self, waited, checked_out, timed_out=False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+                self.max_checked_out = max(self.max_checked_out, checked_out)
+            self.wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    def serialize(self):
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_seconds": round(self.wait_seconds, 6),
+                "average_wait_seconds": round(self.wait_seconds / self.checkouts, 6) if self.checkouts else 0.0,
+                "max_wait_seconds": round(self.max_wait_seconds, 6),
+                "max_checked_out": self.max_checked_out
+            }
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    QueuePool that records how long every checkout waited, including reconnects and pre-ping.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statistics = PoolStatistics()
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            self.statistics.record(time.perf_counter() - started, self.checkedout(), timed_out=True)
+            raise
+        self.statistics.record(time.perf_counter() - started, self.checkedout())
+        return connection
+
+
+def pool_status(engine):
+    """
+    Current size and usage of the engine's pool plus the statistics collected since the process started.
+    """
+    pool = engine.pool
+    status = {"backend": engine.dialect.name, "pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update({
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "timeout": pool.timeout()
+        })
+    if isinstance(pool, InstrumentedQueuePool):
+        status["statistics"] = pool.statistics.serialize()
+    return status
@@ -1,25 +1,114 @@
-from datetime import time
+import dataclasses
+import decimal
+import numbers
+import uuid
+from datetime import date, time
 from enum import Enum
+from operator import attrgetter
 
 from flask.json.provider import DefaultJSONProvider
-from sqlalchemy import Row
+from sqlalchemy import Row, inspect
+
+try:
+    import orjson
+except ImportError:  # optional fast backend, the stdlib json module is used without it
+    orjson = None
+
+
+def _model_serializer(mapper):
+    """
+    Builds the serializer of a mapped class: a dict of its column attributes, read with one attrgetter.
+    """
+    keys = tuple(attribute.key for attribute in mapper.column_attrs)
+    getter = attrgetter(*keys)
+    if len(keys) == 1:
+        return lambda obj: {keys[0]: getter(obj)}
+    return lambda obj: dict(zip(keys, getter(obj)))
+
+
+def _row_serializer(row):
+    return dict(zip(row._fields, row))
+
+
+def _object_serializer(obj):
+    return {key: value for key, value in vars(obj).items() if key != '_sa_instance_state'}
 
 
 class DobatoEncoder(DefaultJSONProvider):
     """this is custom encoder which encodes the sqlalchemy objects"""
+
+    def __init__(self, app):
+        super().__init__(app)
+        self._serializers = {}
+        self.fast = orjson is not None and app.config.get('JSON_FAST_BACKEND', True)
+
+    def register(self, cls, serializer):
+        """
+        Registers the serializer used for instances of cls (subclasses included, unless they have their own).
+        """
+        self._serializers[cls] = serializer
+
+    def serializer_for(self, cls):
+        """
+        Returns the serializer of cls, building it on the first call. Later calls are one dict lookup.
+        """
+        serializer = self._serializers.get(cls)
+        if serializer is None:
+            serializer = self._build_serializer(cls)
+            self._serializers[cls] = serializer
+        return serializer
+
+    def _build_serializer(self, cls):
+        for base in cls.__mro__[1:]:
+            if base in self._serializers:
+                return self._serializers[base]
+        mapper = inspect(cls, raiseerr=False)
+        if mapper is not None and hasattr(mapper, 'column_attrs'):
+            return _model_serializer(mapper)
+        if issubclass(cls, Row):
+            return _row_serializer
+        if issubclass(cls, time):
+            return time.isoformat
+        if issubclass(cls, Enum):
+            return attrgetter('name')
+        if issubclass(cls, numbers.Integral):
+            return int
+        if issubclass(cls, numbers.Real):
+            return float
+        if (issubclass(cls, (date, decimal.Decimal, uuid.UUID)) or dataclasses.is_dataclass(cls)
+                or hasattr(cls, '__html__')):
+            return super().default
+        if cls.__dictoffset__:
+            return _object_serializer
+        return super().default
+
     def default(self, obj):
-        try:
-            return super().default(obj)
-        except Exception as e:
-            if isinstance(obj, Row):
-                return obj._asdict()
-            elif isinstance(obj, time):
-                return obj.isoformat()
-                # Handle enum types
-            elif isinstance(obj, Enum):
-                return obj.name
-            else:
-                obj_dict = obj.__dict__
-                obj_dict.pop('_sa_instance_state', None)
-
-                return obj_dict
+        return self.serializer_for(type(obj))(obj)
+
+    def _orjson_option(self, indent=None):
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def _can_use_orjson(self, kwargs):
+        return self.fast and kwargs.keys() <= {'indent', 'separators'} and kwargs.get('indent') in (None, 2)
+
+    def dumps(self, obj, **kwargs):
+        """
+        Serializes with orjson when it is installed, dates and dataclasses still go through default so the
+        output matches the stdlib encoder. Unusual json.dumps arguments fall back to the stdlib encoder.
+        """
+        if self._can_use_orjson(kwargs):
+            return orjson.dumps(obj, default=self.default, option=self._orjson_option(kwargs.get('indent'))).decode()
+        return super().dumps(obj, **kwargs)
+
+    def response(self, *args, **kwargs):
+        if not self.fast:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = 2 if (self.compact is None and self._app.debug) or self.compact is False else None
+        body = orjson.dumps(obj, default=self.default, option=self._orjson_option(indent))
+        return self._app.response_class(body + b'\n', mimetype=self.mimetype)
@@ -0,0 +1,89 @@
+import hashlib
+from datetime import datetime, timezone
+
+from flask import current_app, request
+from werkzeug.http import http_date, is_resource_modified, quote_etag
+
+from utils.response import list_response, requested_stream_format
+from utils.versioning import get_version_stamp
+
+_responses = {}
+
+
+class CachedResponse:
+    """
+    Serialized body of one listing at one dataset version, with its strong ETag.
+    """
+
+    def __init__(self, version, body, mimetype, last_modified):
+        self.version = version
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self.last_modified = last_modified
+
+
+def _last_modified(updated_at):
+    if updated_at is None:
+        return datetime.now(timezone.utc).replace(microsecond=0)
+    return updated_at.astimezone(timezone.utc).replace(microsecond=0)
+
+
+def cached_listing(name, version):
+    """
+    Returns the cached listing of a dataset if it was built at this version, else None.
+    """
+    cached = _responses.get(name)
+    if cached is None or cached.version != version:
+        return None
+    return cached
+
+
+def cache_listing(name, version, updated_at, body, mimetype):
+    cached = CachedResponse(version, body, mimetype, _last_modified(updated_at))
+    _responses[name] = cached
+    return cached
+
+
+def cache_headers(cached):
+    return {
+        'ETag': quote_etag(cached.etag),
+        'Last-Modified': http_date(cached.last_modified),
+        'Cache-Control': 'no-cache',
+        'Vary': 'Accept'
+    }
+
+
+def is_modified(cached, headers):
+    """
+    Whether a GET with these request headers (If-None-Match / If-Modified-Since) needs the body again.
+    For callers outside Flask; Flask responses use make_conditional.
+    """
+    environ = {'REQUEST_METHOD': 'GET'}
+    for header in ('If-None-Match', 'If-Modified-Since'):
+        if headers.get(header):
+            environ['HTTP_' + header.upper().replace('-', '_')] = headers[header]
+    return is_resource_modified(environ, etag=cached.etag, last_modified=cached.last_modified)
+
+
+def versioned_list_response(name, load_rows):
+    """
+    Returns the listing of a reference dataset from the process-local cache, rebuilt by calling load_rows()
+    only when the dataset version changed. The DB is asked for the version row only. Responses carry an ETag
+    and Last-Modified, and conditional requests that still match get a 304 without a body.
+    Streamed (NDJSON/CSV) listings are not cached.
+    """
+    if requested_stream_format():
+        return list_response(load_rows())
+    version, updated_at = get_version_stamp(name)
+    cached = cached_listing(name, version)
+    if cached is None:
+        built = list_response(load_rows())
+        cached = cache_listing(name, version, updated_at, built.get_data(), built.mimetype)
+
+    response = current_app.response_class(cached.body, mimetype=cached.mimetype)
+    response.set_etag(cached.etag)
+    response.last_modified = cached.last_modified
+    response.cache_control.no_cache = True
+    response.vary.add('Accept')
+    return response.make_conditional(request)
@@ -0,0 +1,308 @@
+import json
+import os
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+from utils.database import pool_status
+
+DEFAULT_SLOW_QUERY_MS = 200
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+BATCH_ROW_BUCKETS = (1, 5, 10, 50, 100, 250, 500, 1000, 2500, 5000)
+STATEMENT_LOG_LENGTH = 500
+
+request_logger = logging.getLogger('ecl.requests')
+slow_query_logger = logging.getLogger('ecl.slow_queries')
+
+
+class Histogram:
+    """
+    Prometheus-style cumulative histogram per label set.
+    """
+
+    def __init__(self, name, help_text, buckets, labels):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.labels = tuple(labels)
+        self._series = {}
+
+    def observe(self, label_values, value):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, (counts, total, count) in sorted(self._series.items()):
+            labels = _labels(self.labels, label_values)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+
+    def inc(self, label_values, amount=1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{{{_labels(self.labels, label_values)}}} {value}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values):
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+class MetricsRegistry:
+    """
+    Request and SQL metrics of this process. Every gunicorn worker keeps its own registry.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        labels = ('endpoint', 'method')
+        self.requests = Counter('ecl_http_requests_total', 'HTTP requests.', ('endpoint', 'method', 'status'))
+        self.duration = Histogram('ecl_http_request_duration_seconds', 'Handler time per request.',
+                                  DURATION_BUCKETS, labels)
+        self.db_time = Histogram('ecl_db_time_seconds', 'Time spent in SQL statements per request.',
+                                 DURATION_BUCKETS, labels)
+        self.queries = Histogram('ecl_db_queries_per_request', 'SQL statements per request.',
+                                 QUERY_COUNT_BUCKETS, labels)
+        self.slow_queries = Counter('ecl_db_slow_queries_total', 'SQL statements above the slow query threshold.',
+                                    ('endpoint',))
+        self.write_flush = Histogram('ecl_write_buffer_flush_seconds', 'Time to write one batch of buffered rows.',
+                                     DURATION_BUCKETS, ('table',))
+        self.write_batch = Histogram('ecl_write_buffer_batch_rows', 'Rows per write-behind batch.',
+                                     BATCH_ROW_BUCKETS, ('table',))
+        self.write_rows = Counter('ecl_write_buffer_rows_total',
+                                  'Buffered rows by outcome: written, failed (sent to the dead-letter file) '
+                                  'or rejected (queue full).',
+                                  ('table', 'outcome'))
+        self.write_retries = Counter('ecl_write_buffer_retries_total',
+                                     'Write-behind transactions retried after an OperationalError.', ('table',))
+        self._gauges = []
+
+    def observe_request(self, endpoint, method, status, duration, db_time, queries):
+        with self._lock:
+            self.requests.inc((endpoint, method, str(status)))
+            self.duration.observe((endpoint, method), duration)
+            self.db_time.observe((endpoint, method), db_time)
+            self.queries.observe((endpoint, method), queries)
+
+    def observe_slow_query(self, endpoint):
+        with self._lock:
+            self.slow_queries.inc((endpoint,))
+
+    def observe_write_flush(self, table, rows, duration, failed=0):
+        with self._lock:
+            self.write_flush.observe((table,), duration)
+            self.write_batch.observe((table,), rows)
+            if rows > failed:
+                self.write_rows.inc((table, 'written'), rows - failed)
+            if failed:
+                self.write_rows.inc((table, 'failed'), failed)
+
+    def observe_write_retry(self, table):
+        with self._lock:
+            self.write_retries.inc((table,))
+
+    def observe_write_rejected(self, table):
+        with self._lock:
+            self.write_rows.inc((table, 'rejected'))
+
+    def register_gauge(self, name, help_text, read):
+        """
+        Adds a gauge whose value is read with read() when the metrics are rendered.
+        """
+        self._gauges.append((name, help_text, read))
+
+    def render(self, engine=None):
+        with self._lock:
+            lines = [*self.requests.render(), *self.duration.render(), *self.db_time.render(),
+                     *self.queries.render(), *self.slow_queries.render(), *self.write_flush.render(),
+                     *self.write_batch.render(), *self.write_rows.render(),
+                     *self.write_retries.render()]
+        for name, help_text, read in self._gauges:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {read()}"]
+        if engine is not None:
+            lines.extend(_pool_lines(pool_status(engine)))
+        return '\n'.join(lines) + '\n'
+
+
+def _pool_lines(status):
+    lines = []
+    gauges = (('checked_out', 'Connections in use.'), ('checked_in', 'Idle connections in the pool.'),
+              ('overflow', 'Connections above the pool size.'))
+    for key, help_text in gauges:
+        if key in status:
+            lines += [f"# HELP ecl_db_pool_{key} {help_text}", f"# TYPE ecl_db_pool_{key} gauge",
+                      f"ecl_db_pool_{key} {status[key]}"]
+    statistics = status.get('statistics')
+    if statistics:
+        counters = (('checkouts', 'checkouts_total', 'Connection checkouts.'),
+                    ('timeouts', 'checkout_timeouts_total', 'Checkouts that timed out waiting for a connection.'),
+                    ('wait_seconds', 'checkout_wait_seconds_total', 'Time spent waiting for a connection.'))
+        for key, name, help_text in counters:
+            lines += [f"# HELP ecl_db_pool_{name} {help_text}", f"# TYPE ecl_db_pool_{name} counter",
+                      f"ecl_db_pool_{name} {statistics[key]}"]
+    return lines
+
+
+metrics = MetricsRegistry()
+
+
+class RequestMetrics:
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.slowest = 0.0
+        self.slowest_statement = None
+
+
+# Metrics of the request handled by the current task, for requests served outside Flask (the ASGI read app).
+_current_metrics = ContextVar('request_metrics', default=None)
+
+
+def _endpoint():
+    return request.endpoint or 'unmatched'
+
+
+def _current():
+    if has_request_context():
+        return g.get('_request_metrics')
+    return _current_metrics.get()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('_query_started', []).append(time.perf_counter())
+
+
+def _record_query(statement, duration, executemany, slow_query_seconds):
+    current = _current()
+    if current is not None:
+        current.queries += 1
+        current.db_time += duration
+        if duration > current.slowest:
+            current.slowest = duration
+            current.slowest_statement = statement
+    if duration >= slow_query_seconds:
+        endpoint = current.endpoint if current is not None else None
+        metrics.observe_slow_query(endpoint or 'none')
+        slow_query_logger.warning(json.dumps({
+            'event': 'slow_query',
+            'endpoint': endpoint,
+            'duration_ms': round(duration * 1000, 3),
+            'executemany': executemany,
+            'statement': statement[:STATEMENT_LOG_LENGTH]
+        }))
+
+
+def _start_request():
+    g._request_metrics = RequestMetrics(_endpoint())
+
+
+def _finish_request(response):
+    current = g.pop('_request_metrics', None)
+    if current is not None:
+        _report(current, request.method, request.path, response.status_code, response.headers.add)
+    return response
+
+
+def _report(current, method, path, status, add_header):
+    """
+    Adds the Server-Timing header, writes the request log line and records the request in the registry.
+    """
+    duration = time.perf_counter() - current.started
+    metrics.observe_request(current.endpoint, method, status, duration, current.db_time, current.queries)
+    add_header('Server-Timing', f'db;dur={current.db_time * 1000:.3f};desc="{current.queries} queries", '
+                                f'db-slowest;dur={current.slowest * 1000:.3f}, app;dur={duration * 1000:.3f}')
+    if not request_logger.isEnabledFor(logging.INFO):
+        return
+    request_logger.info(json.dumps({
+        'event': 'request',
+        'method': method,
+        'path': path,
+        'endpoint': current.endpoint,
+        'status': status,
+        'duration_ms': round(duration * 1000, 3),
+        'db_ms': round(current.db_time * 1000, 3),
+        'queries': current.queries,
+        'slowest_query_ms': round(current.slowest * 1000, 3),
+        'slowest_query': (current.slowest_statement or '')[:STATEMENT_LOG_LENGTH] or None
+    }))
+
+
+def instrument_endpoint(endpoint, handler):
+    """
+    Wraps an async (Starlette) handler so its requests are measured like the Flask ones, under `endpoint`.
+    """
+    async def instrumented(asgi_request):
+        current = RequestMetrics(endpoint)
+        token = _current_metrics.set(current)
+        try:
+            response = await handler(asgi_request)
+        finally:
+            _current_metrics.reset(token)
+        _report(current, asgi_request.method, asgi_request.url.path, response.status_code, response.headers.append)
+        return response
+    return instrumented
+
+
+def instrument_engine(engine, slow_query_ms=DEFAULT_SLOW_QUERY_MS):
+    """
+    Times every statement of the engine (the sync_engine of an AsyncEngine) for the current request and logs
+    the ones slower than slow_query_ms.
+    """
+    slow_query_seconds = float(slow_query_ms) / 1000
+
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get('_query_started')
+        if started:
+            _record_query(statement, time.perf_counter() - started.pop(), executemany, slow_query_seconds)
+
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def init_instrumentation(app, engine):
+    """
+    Records query count, DB time, slowest statement and handler time of every request.
+    They are sent as Server-Timing headers, logged as one JSON line on the ecl.requests logger and aggregated
+    per endpoint for /metrics. Statements slower than SLOW_QUERY_MS (app config or environment, default 200) are
+    logged on ecl.slow_queries.
+    Streamed responses are measured until the handler returns, not until the last chunk is sent.
+    """
+    slow_query_ms = app.config.setdefault('SLOW_QUERY_MS',
+                                          float(os.environ.get('SLOW_QUERY_MS') or DEFAULT_SLOW_QUERY_MS))
+    instrument_engine(engine, slow_query_ms)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
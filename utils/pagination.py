@@ -0,0 +1,88 @@
+import base64
+import json
+
+from sqlalchemy import and_, or_
+
+
+class PaginationError(ValueError):
+    pass
+
+
+def encode_cursor(sort_value, row_id):
+    """
+    Encodes the position of the last returned row into an opaque cursor string.
+    """
+    raw = json.dumps([sort_value, row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Decodes a cursor created by encode_cursor back into (sort_value, id).
+    """
+    try:
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise PaginationError("Invalid cursor.")
+    return sort_value, row_id
+
+
+def parse_limit(value, default=None, maximum=1000):
+    """
+    Parses the `limit` query argument. Returns the default when it is not given.
+    """
+    if value in (None, ''):
+        return default
+    try:
+        limit = int(value)
+    except ValueError:
+        raise PaginationError("limit must be an integer.")
+    if limit < 1 or limit > maximum:
+        raise PaginationError(f"limit must be between 1 and {maximum}.")
+    return limit
+
+
+def keyset_order(query, sort_column, id_column, descending=False, cursor=None):
+    """
+    Orders a Query or Select by (sort_column, id_column) and continues after the cursor position.
+    """
+    if cursor:
+        sort_value, row_id = decode_cursor(cursor)
+        if descending:
+            query = query.filter(or_(sort_column < sort_value, and_(sort_column == sort_value, id_column < row_id)))
+        else:
+            query = query.filter(or_(sort_column > sort_value, and_(sort_column == sort_value, id_column > row_id)))
+
+    if descending:
+        return query.order_by(sort_column.desc(), id_column.desc())
+    return query.order_by(sort_column.asc(), id_column.asc())
+
+
+def split_page(rows, limit, sort_column, id_column):
+    """
+    Cuts the limit + 1 rows fetched for a page down to the page and returns it with the next page's cursor
+    (None on the last page).
+    """
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last._mapping[sort_column.key], last._mapping[id_column.key])
+    return rows, next_cursor
+
+
+def keyset_paginate(query, sort_column, id_column, descending=False, limit=None, cursor=None, session=None):
+    """
+    Orders the query by (sort_column, id_column) and continues after the cursor position.
+    Returns the page rows and the cursor of the next page (None on the last page).
+    Without a limit the ordered query itself is returned so the caller can stream it.
+    A Select is run on `session`. The sort column must be part of the selected entities under the key of the
+    sort_column label.
+    """
+    query = keyset_order(query, sort_column, id_column, descending=descending, cursor=cursor)
+    if not limit:
+        return query, None
+
+    page = query.limit(limit + 1)
+    rows = page.all() if session is None else session.execute(page).all()
+    return split_page(rows, limit, sort_column, id_column)
@@ -1,4 +1,13 @@
-from flask import jsonify
+import csv
+import io
+from itertools import islice
+
+from flask import jsonify, request, current_app, Response, stream_with_context
+from sqlalchemy.orm import Query
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+CSV_MIMETYPE = 'text/csv'
+STREAM_CHUNK_SIZE = 1000
 
 
 def success_response(msg, data=None):
@@ -32,16 +41,131 @@ def server_error(msg):
     """
     return jsonify({'message': msg, 'status': 500}), 500
 
-def list_response(rows):
+
+def conflict_error(msg):
+    """
+    Returns a conflict error response with message and status code 409.
+    """
+    return jsonify({'message': msg, 'status': 409}), 409
+
+
+def service_unavailable(msg, retry_after=1):
+    """
+    Returns a service unavailable response with message, status code 503 and a Retry-After header.
+    """
+    return jsonify({'message': msg, 'status': 503}), 503, {'Retry-After': str(retry_after)}
+
+
+def list_response(rows, **meta):
+    """
+    Returns the rows of a listing. Extra keyword arguments (e.g. next_cursor) are added next to the rows.
+    Rows may be a list, a generator or a Query; clients sending `Accept: application/x-ndjson` or
+    `Accept: text/csv` get them streamed instead of one JSON document.
+    """
+    stream_format = requested_stream_format()
+    if stream_format:
+        return stream_response(rows, stream_format, **meta)
+    if isinstance(rows, Query):
+        rows = rows.all()
+    elif not isinstance(rows, list):
+        rows = list(rows)
     response = {
         'data': {
-            'rows': rows
+            'rows': rows,
+            **meta
         }
     }
 
     return jsonify(response)
 
 
+def requested_stream_format():
+    """
+    Returns the streaming mimetype asked for in the Accept header, or None for a regular JSON response.
+    """
+    return stream_format(request.accept_mimetypes)
+
+
+def stream_format(accept_mimetypes):
+    """
+    Returns the streaming mimetype preferred by the parsed Accept header, or None for a regular JSON response.
+    """
+    best = accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE, CSV_MIMETYPE])
+    if best in (NDJSON_MIMETYPE, CSV_MIMETYPE):
+        return best
+    return None
+
+
+def iter_chunks(rows, size=STREAM_CHUNK_SIZE):
+    """
+    Yields lists of at most `size` rows. Queries are read from the DB in chunks of the same size.
+    """
+    if isinstance(rows, Query):
+        rows = rows.yield_per(size)
+    iterator = iter(rows)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def stream_response(rows, mimetype, **meta):
+    """
+    Streams rows as NDJSON or CSV, one chunk at a time, so memory stays bounded by the chunk size.
+    Extra keyword arguments are sent as headers, e.g. next_cursor as X-Next-Cursor.
+    """
+    if mimetype == CSV_MIMETYPE:
+        body = _csv_chunks(rows)
+    else:
+        body = _ndjson_chunks(rows)
+    return Response(stream_with_context(body), mimetype=mimetype, headers=stream_headers(meta))
+
+
+def stream_headers(meta):
+    return {f"X-{key.replace('_', '-').title()}": str(value) for key, value in meta.items() if value is not None}
+
+
+def _ndjson_chunks(rows):
+    dumps = current_app.json.dumps
+    for chunk in iter_chunks(rows):
+        yield ndjson_chunk(chunk, dumps)
+
+
+def _csv_chunks(rows):
+    encoder = CsvChunkEncoder(current_app.json.default)
+    for chunk in iter_chunks(rows):
+        yield encoder.encode(chunk)
+
+
+def ndjson_chunk(chunk, dumps):
+    return ''.join(dumps(row) + '\n' for row in chunk)
+
+
+class CsvChunkEncoder:
+    """
+    Encodes rows as CSV one chunk at a time. The header is written before the first row and taken from its keys;
+    rows that are not dicts are converted with `default` (the JSON encoder's).
+    """
+
+    def __init__(self, default):
+        self.default = default
+        self.buffer = io.StringIO()
+        self.writer = None
+
+    def encode(self, chunk):
+        for row in chunk:
+            row = row if isinstance(row, dict) else self.default(row)
+            if self.writer is None:
+                self.writer = csv.DictWriter(self.buffer, fieldnames=list(row), extrasaction='ignore')
+                self.writer.writeheader()
+            self.writer.writerow(row)
+        text = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return text
+
+
 def detail_response(data):
     response = {
         'data': data
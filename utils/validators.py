@@ -1,5 +1,7 @@
 from marshmallow import Schema, fields, validate, ValidationError
 
+PAYMENT_STATUSES = ('paid', 'late', 'missed')
+
 
 def validate_phone_number(value):
     """Ensure phone number is a 10-digit integer."""
@@ -27,4 +29,28 @@ class LoanSchema(Schema):
     interest_rate = fields.Decimal(required=True)
     collateral_value = fields.Decimal(required=True)
     outstanding_balance = fields.Decimal(required=True)
-    un_drawn_commitment = fields.Decimal(required=False, allow_none=True)
\ No newline at end of file
+    un_drawn_commitment = fields.Decimal(required=False, allow_none=True)
+
+
+class PaymentSchema(Schema):
+    user_id = fields.Integer(required=True)
+    loan_id = fields.Integer(required=True)
+    date = fields.Date(required=True)
+    amount = fields.Float(required=True)
+    status = fields.String(required=True, validate=validate.OneOf(PAYMENT_STATUSES))
+    daysLate = fields.Integer(required=False, allow_none=True, load_default=0)  # only if late payment.
+
+
+class ScenarioOverlaySchema(Schema):
+    industry_id = fields.Integer(required=False, allow_none=True)
+    lending_type_id = fields.Integer(required=False, allow_none=True)
+    pd_multiplier = fields.Float(required=False, load_default=1, validate=validate.Range(min=0))
+    lgd_multiplier = fields.Float(required=False, load_default=1, validate=validate.Range(min=0))
+
+
+class ScenarioSchema(Schema):
+    name = fields.String(required=True)
+    weight = fields.Float(required=True, validate=validate.Range(min=0))
+    pd_multiplier = fields.Float(required=False, load_default=1, validate=validate.Range(min=0))
+    lgd_multiplier = fields.Float(required=False, load_default=1, validate=validate.Range(min=0))
+    overlays = fields.List(fields.Nested(ScenarioOverlaySchema), required=False, load_default=list)
@@ -0,0 +1,134 @@
+import time
+from collections import Counter
+from datetime import datetime
+
+from flask import current_app, g, has_app_context
+from sqlalchemy import select
+
+from utils.extensions import db
+from server.models import DataVersion
+
+ECL_THRESHOLDS = 'ecl_thresholds'
+BUSINESS_INDUSTRIES = 'business_industries'
+LENDING_TYPES = 'lending_types'
+DEFAULT_VERSION_MAX_AGE = 2
+
+# Datasets bumped by this process, so its own caches drop their copies right away instead of after max_age.
+_local_bumps = Counter()
+
+
+def _request_cache():
+    if not has_app_context():
+        return {}
+    if '_data_versions' not in g:
+        g._data_versions = {}
+    return g._data_versions
+
+
+def get_version_stamp(name):
+    """
+    Returns (version, updated_at) of a dataset, (0, None) if it never changed.
+    It is read from the DB at most once per request.
+    """
+    cache = _request_cache()
+    if name not in cache:
+        row = db.session.query(DataVersion.version, DataVersion.updated_at).filter_by(name=name).first()
+        cache[name] = (row.version, row.updated_at) if row else (0, None)
+    return cache[name]
+
+
+def get_version(name):
+    """
+    Returns the current version of a dataset. It is read from the DB at most once per request.
+    """
+    return get_version_stamp(name)[0]
+
+
+def bump_version(name):
+    """
+    Increments the version of a dataset. Call it before committing the change so both land in one transaction.
+    """
+    updated = (db.session.query(DataVersion)
+               .filter_by(name=name)
+               .update({DataVersion.version: DataVersion.version + 1, DataVersion.updated_at: datetime.now()}))
+    if not updated:
+        db.session.add(DataVersion(name=name, version=1, updated_at=datetime.now()))
+    _request_cache().pop(name, None)
+    _local_bumps[name] += 1
+
+
+class VersionedCache:
+    """
+    Process-local value built from some datasets and rebuilt when any of their versions changes.
+    The versions are re-read from the DB at most every VERSION_MAX_AGE seconds (app config), so a change made by
+    another worker shows up within that delay; a change made by this process is seen on the next call.
+    """
+
+    def __init__(self, names, build):
+        self.names = tuple(names)
+        self.build = build
+        self._value = None
+        self._versions = None
+        self._local_bumps = None
+        self._checked_at = 0.0
+
+    def _max_age(self):
+        if not has_app_context():
+            return 0
+        return current_app.config.get('VERSION_MAX_AGE', DEFAULT_VERSION_MAX_AGE)
+
+    def get(self):
+        now = time.monotonic()
+        local_bumps = tuple(_local_bumps[name] for name in self.names)
+        if (self._versions is not None and local_bumps == self._local_bumps
+                and now - self._checked_at < self._max_age()):
+            return self._value
+        versions = tuple(get_version(name) for name in self.names)
+        if versions != self._versions:
+            self._value = self.build()
+            self._versions = versions
+        self._local_bumps = local_bumps
+        self._checked_at = now
+        return self._value
+
+
+async def read_version_stamps(session, names):
+    """
+    Async counterpart of get_version_stamp: (version, updated_at) of each dataset, read in one query on an
+    AsyncSession.
+    """
+    rows = (await session.execute(select(DataVersion.name, DataVersion.version, DataVersion.updated_at)
+                                  .where(DataVersion.name.in_(names)))).all()
+    stamps = {row.name: (row.version, row.updated_at) for row in rows}
+    return {name: stamps.get(name, (0, None)) for name in names}
+
+
+class AsyncVersionedCache:
+    """
+    VersionedCache for async code: `build` is a coroutine function taking the AsyncSession to load from.
+    Bumps made by this process (e.g. by the Flask app mounted next to it) are seen on the next call.
+    """
+
+    def __init__(self, names, build, max_age=DEFAULT_VERSION_MAX_AGE):
+        self.names = tuple(names)
+        self.build = build
+        self.max_age = max_age
+        self._value = None
+        self._versions = None
+        self._local_bumps = None
+        self._checked_at = 0.0
+
+    async def get(self, session):
+        now = time.monotonic()
+        local_bumps = tuple(_local_bumps[name] for name in self.names)
+        if (self._versions is not None and local_bumps == self._local_bumps
+                and now - self._checked_at < self.max_age):
+            return self._value
+        stamps = await read_version_stamps(session, self.names)
+        versions = tuple(stamps[name][0] for name in self.names)
+        if versions != self._versions:
+            self._value = await self.build(session)
+            self._versions = versions
+        self._local_bumps = local_bumps
+        self._checked_at = now
+        return self._value